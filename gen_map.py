@@ -3,44 +3,29 @@
 # SPDX-License-Identifier: MIT
 
 import argparse
+import bisect
+import collections
+import concurrent.futures
+import hashlib
 import io
+import json
+import os
+import re
+import struct
+import sys
 #import shutil
 
-from machotools.machofile import MachOFile
+from machotools import fixups, machomap, relocation, stats
+from machotools.cache import CACHE_DIR_ENV, open_macho
 from machotools.enums import *
+from machotools.machomap import group_entries
 
+# the layout manifest is stored next to the output by default
+MANIFEST_VERSION = 1
+MANIFEST_SUFFIX = '.manifest'
 
-def get_text_string(file, text, ptr):
-    s = ''
-    orig_offset = file.tell()
-
-    string_offset = ptr - text._vmaddr
-    file.seek(string_offset, io.SEEK_SET)
-
-    while True:
-        ch = file.read(1).decode('utf-8')
-        if ch == '\0':
-            break
-        s += ch
-
-    file.seek(orig_offset, io.SEEK_SET)
-    return s
-
-
-def get_offset_string(file, offs):
-    s = ''
-    orig_offset = file.tell()
-
-    file.seek(offs, io.SEEK_SET)
-
-    while True:
-        ch = file.read(1).decode('utf-8')
-        if ch == '\0':
-            break
-        s += ch
-
-    file.seek(orig_offset, io.SEEK_SET)
-    return s
+# the layout is decoded by these besides this script, see layout_manifest()
+LAYOUT_SOURCES = (__file__, machomap.__file__, relocation.__file__, fixups.__file__)
 
 
 def get_bytes_at(file, offs, size):
@@ -56,93 +41,396 @@ def get_bytes_at(file, offs, size):
 
 def parse_args():
     parser = argparse.ArgumentParser()
-    parser.add_argument('-i', '--input', dest='input',
-                        help='input file', metavar='FILE', required=True)
+    parser.add_argument('-i', '--input', dest='inputs', nargs='+',
+                        help='linked image, or object files in link order', metavar='FILE', required=True)
     parser.add_argument('-o', '--output', dest='output',
                         help='output file', metavar='FILE', required=True)
+    parser.add_argument('--manifest', dest='manifest',
+                        help=f'layout manifest (default: output file + {MANIFEST_SUFFIX})', metavar='FILE')
+    parser.add_argument('-f', '--force', dest='force', action='store_true',
+                        help='regenerate the output even if the layout is unchanged')
+    parser.add_argument('--cache-dir', dest='cache_dir', default=os.environ.get(CACHE_DIR_ENV),
+                        help=f'cache decoded tables in DIR (default: ${CACHE_DIR_ENV})', metavar='DIR')
+    parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=os.cpu_count(),
+                        help='decode up to N input files in parallel (default: number of CPUs)', metavar='N')
+    parser.add_argument('--stats', dest='stats', metavar='FILE',
+                        help='write per-phase parse statistics as JSON to FILE (- for stderr)')
     args = parser.parse_args()
 
     return args
 
 
-def gen_getter(output, names, type, fname):
-    output.write(
-        f'static {type} *get_{fname}(const char *section_name)\n')
-    output.write('{\n')
-    output.write('\tif (false) {\n')
+# seeded 32-bit FNV-1a with the murmur3 finalizer, must match
+# macho_map_hash() in macho_map_dyn.c
+FNV_OFFSET_BASIS = 2166136261
+FNV_PRIME = 16777619
+
+
+def macho_map_hash(name, seed):
+    h = FNV_OFFSET_BASIS ^ seed
+    for c in name.encode():
+        h = ((h ^ c) * FNV_PRIME) & 0xffffffff
+    h ^= h >> 16
+    h = (h * 0x85ebca6b) & 0xffffffff
+    h ^= h >> 13
+    h = (h * 0xc2b2ae35) & 0xffffffff
+    h ^= h >> 16
+    return h
+
+
+def perfect_hash(names, load=4):
+    """Compute a collision-free hash of names (hash and displace)
+
+    Names are first split into buckets by macho_map_hash(name, 0).  Starting
+    with the largest bucket, each bucket is then assigned the first seed for
+    which macho_map_hash(name, seed) sends all of its names to free slots.
+    Returns (slots, seeds), where slots lists the name (or None) of each
+    slot and seeds the seed of each bucket.
+    """
+    nbuckets = max(1, (len(names) + load - 1) // load)
+    buckets = [[] for i in range(nbuckets)]
     for name in names:
-        output.write(
-            f'\t\t}} else if (0 == strcmp("{name}", section_name)) {{\n')
-        output.write(f'\t\t\treturn _{name}_{fname};\n')
-    output.write('\t}\n')
-    output.write(f'\treturn NULL;\n')
-    output.write('}\n')
-    output.write('\n')
+        buckets[macho_map_hash(name, 0) % nbuckets].append(name)
+    order = sorted(range(nbuckets), key=lambda i: -len(buckets[i]))
 
+    # with as many slots as names a fit may not exist; grow the table until
+    # every bucket can be placed
+    nslots = max(1, len(names))
+    while True:
+        seeds = _place_buckets(buckets, order, nslots)
+        if seeds is not None:
+            break
+        nslots += 1
+
+    slots = [None] * nslots
+    for bucket, seed in zip(buckets, seeds):
+        for name in bucket:
+            slots[macho_map_hash(name, seed) % nslots] = name
+    return slots, seeds
 
-def gen_map(mf, input, output):
-
-    names = set()
-    counts = dict()
-    sizes = dict()
-    sections = mf.sections()
-    macho_map_syms = []
-
-    for sym in mf.symtab():
-        sect = sections[sym._n_sect - 1]
-        if sect._sectname == 'z_macho_map' and NLType.N_SECT in sym._n_type:
-            macho_map_syms.append(sym)
-
-    for sym in macho_map_syms:
-        sect = sections[sym._n_sect - 1]
-        symoffs = sym._n_value - sect._addr + sect._offset
-        n = 8 if mf._header.is_64() else 4
-        input.seek(symoffs, io.SEEK_SET)
-        # FIXME: this ~0x30000000000000 (BIT(54) | BIT(53)) is kind of puzzling
-        mask = (1 << 53) | (1 << 52)
-        namep = int.from_bytes(input.read(n), mf.order()) & ~mask
-        addr = int.from_bytes(input.read(n), mf.order()) & ~mask
-        size = int.from_bytes(input.read(n), mf.order())
-        name = get_offset_string(input, namep)
-
-        #data = get_bytes_at(input, addr, size)
-
-        names.add(name)
-        if name in counts.keys():
-            counts[name] += 1
-            assert sizes[name] == size
+
+def _place_buckets(buckets, order, nslots, max_seed=1 << 16):
+    taken = [False] * nslots
+    seeds = [0] * len(buckets)
+    for i in order:
+        bucket = buckets[i]
+        if not bucket:
+            break
+        for seed in range(1, max_seed):
+            slots = {macho_map_hash(name, seed) % nslots for name in bucket}
+            if len(slots) == len(bucket) and not any(taken[j] for j in slots):
+                break
         else:
-            counts[name] = 1
-            sizes[name] = size
+            return None
+        for j in slots:
+            taken[j] = True
+        seeds[i] = seed
+    return seeds
+
+
+def c_identifier(name, used):
+    """Return a unique C identifier derived from a section name"""
+    ident = re.sub(r'[^0-9A-Za-z_]', '_', name)
+    candidate = ident
+    i = 1
+    while candidate in used:
+        candidate = f'{ident}_{i}'
+        i += 1
+    used.add(candidate)
+    return candidate
+
+
+def c_string(name):
+    return '"' + name.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+# names of the SYS_INIT levels, in _SYS_INIT_LEVEL_* order (see include/zephyr.h)
+INIT_LEVELS = ('PRE_KERNEL_1', 'PRE_KERNEL_2', 'POST_KERNEL', 'APPLICATION')
+INIT_SECTION = re.compile(
+    r'\.z_init_(' + '|'.join(INIT_LEVELS) + r')(\d+)_$')
+# all .z_init_<level><prio>_ sections share one array, sorted by level and priority
+INIT_ARRAY = 'z_init'
+
+# struct native_task (see include/soc.h) is sorted by level and priority
+NATIVE_TASK = 'native_task'
+
+
+def native_task_key(mf, addr):
+    """Return the (native_level, priority) of the struct native_task at addr"""
+    if addr is None:
+        raise ValueError(f'{NATIVE_TASK} refers to an undefined symbol')
+    n = 8 if mf.is_64() else 4
+    offset = mf.file_offset(addr + n)
+    if offset is None:
+        raise ValueError(f'{NATIVE_TASK} at {addr:#x} is not backed by file data')
+    return struct.unpack_from(('<' if mf.order() == 'little' else '>') + 'ii', mf.data(), offset)
+
+
+def image_entries(mf):
+    """Return the (name, size, key) of each z_macho_map entry of an image
+
+    key is the sort key of entries of sorted arrays and None otherwise.
+    The image is either linked or a single object file, whose pointers are
+    resolved through its relocations.
+    """
+    mm = mf.macho_map()
+    return [(name, size, native_task_key(mf, addr) if name == NATIVE_TASK else None)
+            for name, addr, size in mm]
+
+
+def read_entries(input_file_name, cache_dir=None):
+    """Return image_entries() of a file (run in worker processes)"""
+    mf = open_macho(input_file_name, cache_dir, macho_map=True)
+    try:
+        return image_entries(mf)
+    finally:
+        mf.close()
+
+
+def collect_entries(input_file_names, cache_dir=None, jobs=None):
+    """Return the z_macho_map entries of all input files, in input order
+
+    Object files are decoded in up to jobs worker processes.  Given in link
+    order, their entries are in the order the linker lays out z_macho_map.
+    """
+    if len(input_file_names) < 2 or (jobs is not None and jobs < 2):
+        return [entry for name in input_file_names for entry in read_entries(name, cache_dir)]
+    with concurrent.futures.ProcessPoolExecutor(min(jobs or len(input_file_names),
+                                                    len(input_file_names))) as executor:
+        cache_dirs = [cache_dir] * len(input_file_names)
+        if stats.ACTIVE is None:
+            images = executor.map(read_entries, input_file_names, cache_dirs)
+            return [entry for entries in images for entry in entries]
+        # the statistics of each worker are merged in this process
+        images = executor.map(stats.collected, [read_entries] * len(input_file_names),
+                              input_file_names, cache_dirs)
+        map_entries = []
+        for entries, phases in images:
+            stats.ACTIVE.merge(phases)
+            map_entries.extend(entries)
+        return map_entries
+
+
+def level_index(levels, nlevels):
+    """Return the boundaries of each level in a sorted list of levels
+
+    Level l spans [index[l], index[l + 1]).
+    """
+    return [bisect.bisect_left(levels, level) for level in range(nlevels + 1)]
+
+
+def layout(map_entries):
+    """Compute where each z_macho_map entry is copied at runtime
+
+    map_entries lists the (name, size, key) of every entry, in section
+    order (see collect_entries()).  Returns (arrays, sections, entries, levels), where arrays maps each
+    emitted array to its size in bytes, sections maps each section name to
+    (array, offset, size) in bytes, entries lists the (section name,
+    offset) of each z_macho_map entry, and levels maps sorted arrays to
+    their level boundaries, in elements.
+    """
+    groups = group_entries((entry[0] for entry in map_entries),
+                           (entry[1] for entry in map_entries))
+    indexes = collections.defaultdict(list)
+    for i, entry in enumerate(map_entries):
+        indexes[entry[0]].append(i)
+
+    arrays = dict()
+    sections = dict()
+    entries = [None] * len(map_entries)
+    levels = dict()
+    init = []
+    for name, (count, size) in groups.items():
+        order = indexes[name]
+        if name == NATIVE_TASK:
+            keys = {i: map_entries[i][2] for i in order}
+            order = sorted(order, key=keys.__getitem__)
+            levels[name] = level_index([keys[i][0] for i in order],
+                                       max(keys[i][0] for i in order) + 1)
+        for slot, i in enumerate(order):
+            entries[i] = (name, slot * size)
+
+        m = INIT_SECTION.match(name)
+        if m:
+            init.append((INIT_LEVELS.index(m.group(1)), int(m.group(2)), name))
+        else:
+            arrays[name] = count * size
+            sections[name] = (name, 0, count * size)
 
-    for name in names:
+    if init:
+        init.sort(key=lambda item: item[:2])
+        size = groups[init[0][2]][1]
+        offset = 0
+        for level, prio, name in init:
+            count, entry_size = groups[name]
+            if entry_size != size:
+                raise ValueError(
+                    f'{name}: entry size {entry_size} differs from {size}')
+            sections[name] = (INIT_ARRAY, offset, count * size)
+            offset += count * size
+        arrays[INIT_ARRAY] = offset
+        levels[INIT_ARRAY] = level_index(
+            [level for level, prio, name in init for i in range(groups[name][0])], len(INIT_LEVELS))
+
+    return arrays, sections, entries, levels
+
+
+def gen_map(output, map_layout):
+
+    arrays, sections, entries, levels = map_layout
+
+    used = set()
+    idents = {array: c_identifier(array, used) for array in arrays}
+
+    for array, size in arrays.items():
         # cannot simply copy bytes out of macho-o file because relocations still need to happen at runtime
+        ident = idents[array]
         output.write('__attribute__((used,aligned(16)))\n')
         output.write(
-            f'uint8_t _{name}_list_start[{counts[name] * sizes[name]}] = {{0}};\n')
+            f'uint8_t _{ident}_list_start[{size}] = {{0}};\n')
         output.write(
-            f'uint8_t _{name}_list_end[0] = {{}};\n')
+            f'uint8_t _{ident}_list_end[0] = {{}};\n')
+    output.write('\n')
 
-    # generate list offsets
-    for name in names:
-        output.write('__attribute__((used))\n')
-        output.write(f'static size_t _{name}_list_offset[1];\n')
+    # generate the level boundaries of sorted arrays
+    for array, index in levels.items():
+        ident = idents[array]
+        output.write(
+            f'const size_t _{ident}_level_count = {len(index) - 1};\n')
+        output.write(
+            f'const size_t _{ident}_level_index[{len(index)}] = {{ ' + ', '.join(map(str, index)) + ' };\n')
+    output.write('\n')
+
+    # generate the descriptor table, indexed by a perfect hash of the name
+    slots, seeds = perfect_hash(list(sections))
+    output.write(
+        f'static const uint32_t macho_map_seeds[{len(seeds)}] = {{\n')
+    for i in range(0, len(seeds), 8):
+        output.write(
+            '\t' + ' '.join(f'{seed},' for seed in seeds[i:i + 8]) + '\n')
+    output.write('};\n')
+    output.write('\n')
+    output.write(
+        f'static const struct macho_map_section macho_map_sections[{len(slots)}] = {{\n')
+    for i, name in enumerate(slots):
+        if name is None:
+            continue
+        array, offset, size = sections[name]
+        start = f'_{idents[array]}_list_start'
+        output.write(
+            f'\t[{i}] = {{ {c_string(name)}, {start} + {offset}, {start} + {offset + size} }},\n')
+    output.write('};\n')
     output.write('\n')
 
-    # generate get_list_start(), get_list_end(), get_list_offset()
-    gen_getter(output, names, 'uint8_t', 'list_start')
-    gen_getter(output, names, 'uint8_t', 'list_end')
-    gen_getter(output, names, 'size_t', 'list_offset')
+    # generate the destination of each z_macho_map entry, in section order
+    slot = {name: i for i, name in enumerate(slots) if name is not None}
+    output.write(
+        f'static const struct macho_map_entry macho_map_entries[{len(entries)}] = {{\n')
+    for name, offset in entries:
+        output.write(f'\t{{ {slot[name]}, {offset} }},\n')
+    output.write('};\n')
+
+
+def layout_manifest(map_layout):
+    """Return the manifest describing a layout
+
+    The digest covers the whole layout (including the placement of every
+    entry) and the sources of this script and of the modules decoding the
+    map entries (LAYOUT_SOURCES), so a change to any of them changes the
+    generated file.
+    """
+    arrays, sections, entries, levels = map_layout
+    h = hashlib.sha256()
+    for source in LAYOUT_SOURCES:
+        with open(source, 'rb') as f:
+            h.update(f.read())
+    h.update(json.dumps([arrays, sections, entries, levels]).encode())
+    return {
+        'version': MANIFEST_VERSION,
+        'digest': h.hexdigest(),
+        'sections': {name: list(section) for name, section in sections.items()},
+    }
+
+
+def load_manifest(manifest_name, output_name):
+    """Return the stored manifest, or None if missing or out of sync with the output"""
+    try:
+        with open(manifest_name) as f:
+            manifest = json.load(f)
+        st = os.stat(output_name)
+    except (OSError, ValueError):
+        return None
+    if manifest.get('version') != MANIFEST_VERSION or manifest.get('output') != [st.st_size, st.st_mtime_ns]:
+        return None
+    return manifest
+
+
+def manifest_changes(old, new):
+    """Describe how the sections of two manifests differ, one line each"""
+    if old is None:
+        return ['previous output missing, modified or without a manifest']
+    changes = []
+    old_sections = old['sections']
+    new_sections = new['sections']
+    for name in new_sections:
+        if name not in old_sections:
+            changes.append(f'added section {name}')
+        elif old_sections[name] != new_sections[name]:
+            array, offset, size = new_sections[name]
+            changes.append(
+                f'section {name}: {old_sections[name][2]} -> {size} bytes at {array}+{offset}')
+    for name in old_sections:
+        if name not in new_sections:
+            changes.append(f'removed section {name}')
+    if not changes:
+        changes.append('entry placement or generator changed')
+    return changes
+
+
+def update_map(map_entries, output_name, manifest_name, force=False):
+    """Regenerate output_name unless its manifest shows the same layout
+
+    The output is left untouched (preserving its mtime, so make does not
+    relink what depends on it) when the layout is unchanged.  Returns the
+    list of changes, which is empty when nothing was written.
+    """
+    with stats.timed('layout'):
+        map_layout = layout(map_entries)
+    manifest = layout_manifest(map_layout)
+    old = load_manifest(manifest_name, output_name)
+    if not force and old is not None and old['digest'] == manifest['digest']:
+        return []
+
+    with stats.timed('emit'):
+        output = io.StringIO()
+        gen_map(output, map_layout)
+        with open(output_name, 'w') as f:
+            f.write(output.getvalue())
+
+    st = os.stat(output_name)
+    manifest['output'] = [st.st_size, st.st_mtime_ns]
+    with open(manifest_name, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    return ['regenerated (forced)'] if force else manifest_changes(old, manifest)
 
 
 def main():
     args = parse_args()
+    if args.stats:
+        stats.enable()
+
+    with stats.timed('decode'):
+        map_entries = collect_entries(args.inputs, args.cache_dir, args.jobs)
 
-    mf = MachOFile(args.input)
+    manifest = args.manifest or args.output + MANIFEST_SUFFIX
+    changes = update_map(map_entries, args.output, manifest, args.force)
+    if not changes:
+        print(f'{args.output}: layout unchanged', file=sys.stderr)
+    for change in changes:
+        print(f'{args.output}: {change}', file=sys.stderr)
 
-    with open(args.input, 'rb') as input:
-        with open(args.output, 'w') as output:
-            gen_map(mf, input, output)
+    if args.stats:
+        stats.disable().dump(args.stats)
 
 
 if __name__ == '__main__':
@@ -20,7 +20,7 @@ struct z_macho_map
 
 #if defined(__APPLE__) && defined(__MACH__)
 void macho_map(void);
-void macho_map_append_to_section(const char *section_name, const void *data, size_t data_size);
+void macho_map_copy(const struct z_macho_map *start, const struct z_macho_map *stop);
 #else
 #define macho_map()
 #endif
@@ -18,9 +18,6 @@ void macho_map(void)
     extern struct z_macho_map macho_map_section_start[] __asm("section$start$" MACHO_MAP_SEGMENT "$" MACHO_MAP_SECTION);
     extern struct z_macho_map macho_map_section_stop[] __asm("section$end$" MACHO_MAP_SEGMENT "$" MACHO_MAP_SECTION);
 
-    for (struct z_macho_map *mm = macho_map_section_start; mm < macho_map_section_stop; ++mm)
-    {
-        // D("elf_section_name: '%s' addr: %p size: %zu", mm->elf_section_name, mm->symbol_addr, mm->symbol_size);
-        macho_map_append_to_section(mm->elf_section_name, mm->symbol_addr, mm->symbol_size);
-    }
+    /* gen_map.py precomputed the (sorted) destination of each entry */
+    macho_map_copy(macho_map_section_start, macho_map_section_stop);
 }
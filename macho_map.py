@@ -7,52 +7,13 @@
 """
 
 import argparse
-import io
-import shutil
+import os
 
-from machotools.machofile import MachOFile
+from machotools import stats
+from machotools.cache import CACHE_DIR_ENV, open_macho
+from machotools.constants import *
 from machotools.enums import *
-
-
-class ZMachoTuple(object):
-
-    @staticmethod
-    def get_text_string(file, text, text_offset, ptr):
-        s = ''
-        orig_offset = file.tell()
-
-        string_offset = ptr - text._vmaddr
-        file.seek(string_offset, io.SEEK_SET)
-
-        while True:
-            ch = file.read(1).decode('utf-8')
-            if ch == '\0':
-                break
-            s += ch
-
-        file.seek(orig_offset, io.SEEK_SET)
-        return s
-
-    def __init__(self, file, mf):
-        self._mf = mf
-        n = 8 if mf.is_64() else 4
-        order = mf.order()
-
-        text = None
-        text_offset = None
-        for offset, lc in mf._load_commands.items():
-            if lc._cmd == LCCommand.LC_SEGMENT_64 and lc._segname == '__TEXT':
-                text = lc
-                text_offset = offset
-
-        self._name_p = int.from_bytes(file.read(n), order)
-        self._elf_section_name = ZMachoTuple.get_text_string(
-            file, text, text_offset, self._name_p)
-        self._symbol_value = int.from_bytes(file.read(n), order)
-        self._symbol_size = int.from_bytes(file.read(n), order)
-
-    def __str__(self):
-        return f'name: {self._elf_section_name}, value: {self._symbol_value:x}, size: {self._symbol_size}'
+from machotools.patcher import MachOPatcher
 
 
 def parse_args():
@@ -61,41 +22,58 @@ def parse_args():
                         help='input file', metavar='FILE', required=True)
     parser.add_argument('-o', '--output', dest='output',
                         help='output file', metavar='FILE', required=True)
+    parser.add_argument('--rename-section', dest='renames', action='append', default=[],
+                        help='rename a section of the output', metavar='SEGNAME,SECTNAME=NEWNAME')
+    parser.add_argument('--cache-dir', dest='cache_dir', default=os.environ.get(CACHE_DIR_ENV),
+                        help=f'cache decoded tables in DIR (default: ${CACHE_DIR_ENV})', metavar='DIR')
+    parser.add_argument('--stats', dest='stats', metavar='FILE',
+                        help='write per-phase parse statistics as JSON to FILE (- for stderr)')
     args = parser.parse_args()
 
+    renames = []
+    for rename in args.renames:
+        section, _, new_sectname = rename.partition('=')
+        segname, _, sectname = section.partition(',')
+        if not (segname and sectname and new_sectname):
+            parser.error(f'--rename-section {rename}: expected SEGNAME,SECTNAME=NEWNAME')
+        if len(new_sectname.encode()) > 16:
+            parser.error(f'--rename-section {rename}: {new_sectname} is longer than 16 bytes')
+        renames.append((segname, sectname, new_sectname))
+    args.renames = renames
+
     return args
 
 
+def format_addr(addr):
+    # pointers bound to an imported symbol have no address in the image
+    return '?' if addr is None else f'{addr:x}'
+
+
 def main():
     args = parse_args()
+    if args.stats:
+        stats.enable()
 
-    mf = MachOFile(args.input)
+    mf = open_macho(args.input, args.cache_dir, macho_map=True)
     print(f'{mf._header}')
 
-    sect = None
-    sections = mf.sections()
-
-    for sym in mf.symtab():
-        #print(f'sym: {sym}')
-        if sections[sym._n_sect - 1]._sectname == 'z_macho_map':
-            sect = sections[sym._n_sect - 1]
-            n_sect = sym._n_sect - 1
-
-    if sect:
-        z_macho_tuples = []
-        with open(args.input, 'rb') as file:
-            file.seek(sect._offset, io.SEEK_CUR)
-            n = 8 if mf.is_64() else 4
-            order = mf.order()
-            ntuples = int(sect._size / (3 * n))
-            for i in range(0, ntuples):
-                z_macho_tuples.append(ZMachoTuple(file, mf))
-
-        for tup in z_macho_tuples:
-            print(f'z_macho_tuple: {tup}')
-
-    # TODO: replace later
-    shutil.copy(args.input, args.output)
+    with stats.timed('macho_map'):
+        z_macho_tuples = mf.macho_map()
+    print(''.join(f'z_macho_tuple: name: {tup.name}, value: {format_addr(tup.addr)}, size: {tup.size}\n'
+                  for tup in z_macho_tuples), end='')
+
+    # the output shares storage with the input where possible; only
+    # patched bytes are written
+    with stats.timed('patch'), MachOPatcher(args.input, args.output) as patcher:
+        for segname, sectname, new_sectname in args.renames:
+            patcher.rename_section(segname, sectname, new_sectname)
+        # patching invalidates the signature; signed images must stay
+        # loadable on arm64
+        if patcher.written() and patcher.macho().command(LCCommand.LC_CODE_SIGNATURE):
+            patcher.sign_adhoc()
+
+    if args.stats:
+        stats.disable().dump(args.stats)
 
 
 if __name__ == '__main__':
@@ -12,26 +12,92 @@
 #include <sys/debug.h>
 #include <sys/printk.h>
 #include <sys/__assert.h>
+#include <sys/util.h>
 
-static uint8_t *get_list_start(const char *section_name);
-static uint8_t *get_list_end(const char *section_name);
-static size_t *get_list_offset(const char *section_name);
+struct macho_map_section
+{
+    const char *name;
+    uint8_t *start;
+    uint8_t *end;
+};
+
+/* where one z_macho_map entry is copied: a slot of macho_map_sections[] and an offset in that section */
+struct macho_map_entry
+{
+    uint32_t section;
+    uint32_t offset;
+};
+
+/* seeded 32-bit FNV-1a with the murmur3 finalizer, must match macho_map_hash() in gen_map.py */
+static uint32_t macho_map_hash(const char *name, uint32_t seed)
+{
+    uint32_t h = 2166136261u ^ seed;
 
-/* Generated by python for "fake" sections. Includes _list_start[] _list_end[] symbols, offsets, and empty space */
+    for (; *name != '\0'; ++name)
+    {
+        h ^= (uint8_t)*name;
+        h *= 16777619u;
+    }
+
+    h ^= h >> 16;
+    h *= 0x85ebca6bu;
+    h ^= h >> 13;
+    h *= 0xc2b2ae35u;
+    h ^= h >> 16;
+
+    return h;
+}
+
+/*
+ * Generated by python for "fake" sections. Includes _list_start[] _list_end[] symbols, empty space, the
+ * macho_map_sections[] descriptor table with the macho_map_seeds[] of its perfect hash, the destination of
+ * each z_macho_map entry in macho_map_entries[], and the _level_count / _level_index[] of sorted sections
+ */
 #include "macho_map.inc"
 
-/* need to copy to _list_start[] / _list_end[] areas after runtime relocation */
-void macho_map_append_to_section(const char *section_name, const void *data, size_t data_size)
+static const struct macho_map_section *get_section(const char *section_name)
 {
-    uint8_t *sect_start = get_list_start(section_name);
-    uint8_t *sect_end = get_list_end(section_name);
-    size_t *sect_offset = get_list_offset(section_name);
+    static const char *last_name;
+    static const struct macho_map_section *last;
+    const struct macho_map_section *sect;
+    uint32_t seed;
+
+    /* consecutive entries of z_macho_map usually share the same name literal */
+    if (section_name == last_name)
+    {
+        return last;
+    }
+
+    seed = macho_map_seeds[macho_map_hash(section_name, 0) % ARRAY_SIZE(macho_map_seeds)];
+    sect = &macho_map_sections[macho_map_hash(section_name, seed) % ARRAY_SIZE(macho_map_sections)];
+    if (sect->name == NULL || 0 != strcmp(sect->name, section_name))
+    {
+        return NULL;
+    }
+
+    last_name = section_name;
+    last = sect;
+
+    return sect;
+}
+
+/* copy every z_macho_map entry straight to its pre-sorted location */
+void macho_map_copy(const struct z_macho_map *start, const struct z_macho_map *stop)
+{
+    __ASSERT((size_t)(stop - start) == ARRAY_SIZE(macho_map_entries), "%zu z_macho_map entries, expected %zu",
+             (size_t)(stop - start), ARRAY_SIZE(macho_map_entries));
+
+    for (size_t i = 0; i < ARRAY_SIZE(macho_map_entries) && start + i < stop; ++i)
+    {
+        const struct z_macho_map *mm = &start[i];
+        const struct macho_map_entry *entry = &macho_map_entries[i];
+        const struct macho_map_section *sect = &macho_map_sections[entry->section];
 
-    __ASSERT(sect_start != NULL, "sect_start for section '%s' is NULL", section_name);
-    __ASSERT(sect_end != NULL, "sect_end for section '%s' is NULL", section_name);
-    __ASSERT(sect_offset != NULL, "sect_oiffset for section '%s' is NULL", section_name);
-    __ASSERT(sect_start + *sect_offset + data_size <= sect_end, "append to section '%s' falls outside bounds", section_name);
+        __ASSERT(get_section(mm->elf_section_name) == sect, "entry %zu of section '%s' placed in '%s'", i,
+                 mm->elf_section_name, sect->name);
+        __ASSERT(sect->start + entry->offset + mm->symbol_size <= sect->end, "entry %zu of section '%s' falls outside bounds",
+                 i, sect->name);
 
-    memcpy(sect_start + *sect_offset, data, data_size);
-    *sect_offset += data_size;
+        memcpy(sect->start + entry->offset, mm->symbol_addr, mm->symbol_size);
+    }
 }
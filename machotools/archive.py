@@ -0,0 +1,193 @@
+# Copyright (c) 2021 Friedt Professional Engineering Services, Inc
+# SPDX-License-Identifier: MIT
+
+import concurrent.futures
+import mmap
+import struct
+
+from machotools.machofile import MachOFile
+from machotools.structs import StructLayout
+
+ARMAG = b'!<arch>\n'
+ARFMAG = b'`\n'
+
+# BSD 4.4 long member names: the name follows the header and is counted
+# in the member size
+AR_EFMT1 = '#1/'
+
+SYMDEF_NAMES = ('__.SYMDEF', '__.SYMDEF SORTED',
+                '__.SYMDEF_64', '__.SYMDEF_64 SORTED')
+
+# struct ar_hdr, all fields are space-padded ASCII
+AR_HDR = struct.Struct('16s12s6s6s8s10s2s')
+
+# struct ranlib, the entries of the __.SYMDEF member
+RANLIB = StructLayout(
+    ('ran_strx', 'W'),  # string table index of the symbol name
+    ('ran_off', 'W'),  # file offset of the defining member's header
+)
+
+
+def is_archive(input_file_name, offset=0):
+    with open(input_file_name, 'rb') as f:
+        f.seek(offset)
+        return f.read(len(ARMAG)) == ARMAG
+
+
+def _field(raw, base=10):
+    raw = raw.decode('ascii').strip()
+    return int(raw, base) if raw else 0
+
+
+class ArchiveMember(object):
+    def __init__(self, name, header_offset, offset, size, date, uid, gid, mode):
+        self._name = name
+        # file offset of the ar_hdr (this is what __.SYMDEF refers to)
+        self._header_offset = header_offset
+        # file offset and size of the member contents
+        self._offset = offset
+        self._size = size
+        self._date = date
+        self._uid = uid
+        self._gid = gid
+        self._mode = mode
+
+    def __repr__(self):
+        return '{' f'name: {self._name}, offset: {self._offset}, size: {self._size}, mode: {self._mode:o}' '}'
+
+
+class Archive(object):
+    """A static (ar) archive
+
+    Only the member headers are read when the archive is opened.  Each
+    Mach-O member is then parsed in place as a MachOFile at the member's
+    offset within the archive, so members are never copied out.  The
+    __.SYMDEF ranlib index (if any) is decoded on first use.
+
+    offset and size select an archive embedded in a larger file, such as
+    one slice of a universal binary.
+    """
+
+    def __init__(self, input_file_name, offset=0, size=None):
+        self._name = input_file_name
+        self._offset = offset
+        self._members = []
+        self._symdef = None
+        self._symdef_member = None
+        self._symbols = None
+
+        with open(input_file_name, 'rb') as f:
+            buf = MachOFile._map(f, True)
+        try:
+            end = len(buf) if size is None else offset + size
+            self._parse(buf, offset, end)
+        finally:
+            if isinstance(buf, mmap.mmap):
+                buf.close()
+
+    def _parse(self, buf, offset, end):
+        if buf[offset:offset + len(ARMAG)] != ARMAG:
+            raise ValueError(f'{self._name}: not an archive')
+
+        gnu_names = None
+        pos = offset + len(ARMAG)
+        while pos + AR_HDR.size <= end:
+            (name, date, uid, gid, mode, size, fmag) = AR_HDR.unpack_from(buf, pos)
+            if fmag != ARFMAG:
+                raise ValueError(
+                    f'{self._name}: bad member header at offset {pos}')
+            size = _field(size)
+            data = pos + AR_HDR.size
+            name = name.decode('ascii').rstrip(' ')
+            if name.startswith(AR_EFMT1):
+                namelen = int(name[len(AR_EFMT1):])
+                name = bytes(buf[data:data + namelen]).rstrip(b'\0').decode()
+                data += namelen
+                size -= namelen
+            elif name == '//':
+                # GNU long name table
+                gnu_names = bytes(buf[data:data + size])
+            elif name.startswith('/') and name[1:].isdigit() and gnu_names is not None:
+                start = int(name[1:])
+                name = gnu_names[start:gnu_names.index(b'/\n', start)].decode()
+            elif name.endswith('/') and name != '/':
+                # GNU short names are terminated by a slash
+                name = name[:-1]
+
+            member = ArchiveMember(name, pos, data, size, _field(date), _field(
+                uid), _field(gid), _field(mode, 8))
+            if name in SYMDEF_NAMES:
+                self._symdef_member = member
+                self._symdef = bytes(buf[data:data + size])
+            elif name not in ('/', '//'):
+                self._members.append(member)
+
+            # members are aligned to an even offset
+            pos = data + size + ((data + size) & 1)
+
+    def members(self):
+        return self._members
+
+    def member(self, name):
+        """Return the first member called name, or None"""
+        for member in self._members:
+            if member._name == name:
+                return member
+        return None
+
+    def symbols(self):
+        """Return the __.SYMDEF index as a dict of symbol name -> ArchiveMember
+
+        The index is empty if the archive has no __.SYMDEF member.
+        """
+        if self._symbols is None:
+            self._symbols = self._parse_symdef()
+        return self._symbols
+
+    def _parse_symdef(self):
+        symbols = dict()
+        if self._symdef is None:
+            return symbols
+
+        data = self._symdef
+        n = 8 if '_64' in self._symdef_member._name else 4
+        by_header = {m._header_offset: m for m in self._members}
+        # the index is in the byte order of the members, which is not
+        # recorded anywhere; pick the order that yields a sane size
+        for order in ('little', 'big'):
+            ranlib_size = int.from_bytes(data[:n], order)
+            if ranlib_size + 2 * n <= len(data):
+                break
+        count = ranlib_size // RANLIB.size(n)
+        strtab = n + ranlib_size
+        strsize = int.from_bytes(data[strtab:strtab + n], order)
+        strtab += n
+        for ran_strx, ran_off in RANLIB.iter_unpack(n, order, data, n, count):
+            if ran_strx >= strsize:
+                continue
+            end = data.index(b'\0', strtab + ran_strx)
+            name = data[strtab + ran_strx:end].decode()
+            member = by_header.get(self._offset + ran_off)
+            if member is not None:
+                symbols.setdefault(name, member)
+        return symbols
+
+    def macho(self, member, **kwargs):
+        """Return the MachOFile of one member"""
+        return MachOFile(self._name, offset=member._offset, size=member._size, **kwargs)
+
+    def map(self, func, members=None, max_workers=None, chunksize=16):
+        """Call func(file name, ArchiveMember) for each member in a process pool
+
+        func must be picklable (i.e. a module-level function).  Results are
+        returned in member order.
+        """
+        if members is None:
+            members = self._members
+        if len(members) < 2:
+            return [func(self._name, member) for member in members]
+        with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as pool:
+            return list(pool.map(func, [self._name] * len(members), members, chunksize=chunksize))
+
+    def __repr__(self):
+        return '{' f'name: {self._name}, members: {self._members}' '}'
@@ -0,0 +1,252 @@
+# Copyright (c) 2021 Friedt Professional Engineering Services, Inc
+# SPDX-License-Identifier: MIT
+
+import array
+import hashlib
+import json
+import mmap
+import os
+import struct
+import tempfile
+
+from machotools import stats
+from machotools.enums import *
+from machotools.machofile import MachOFile
+from machotools.structs import NLIST
+from machotools.util import align_up
+
+CACHE_MAGIC = b'MTCACHE\0'
+CACHE_VERSION = 2
+
+# magic, version, length of the JSON metadata that follows
+CACHE_HEADER = struct.Struct('<8sII')
+
+# flags of a cached z_macho_map entry whose name / addr pointer is a bind
+MAP_NO_NAME = 1
+MAP_NO_ADDR = 2
+
+DEFAULT_CACHE_DIR = os.path.join(
+    os.path.expanduser('~'), '.cache', 'machotools')
+DEFAULT_CACHE_SIZE = 256 << 20
+
+# scripts enable the cache when this names a directory
+CACHE_DIR_ENV = 'MACHOTOOLS_CACHE'
+
+
+def open_macho(input_file_name, cache_dir=None, names=False, macho_map=False, **kwargs):
+    """Return a MachOFile, through a ParseCache in cache_dir if given
+
+    names and macho_map are passed on to ParseCache.open().
+    """
+    if cache_dir:
+        return ParseCache(cache_dir).open(input_file_name, names=names,
+                                          macho_map=macho_map, **kwargs)
+    return MachOFile(input_file_name, **kwargs)
+
+
+class ParseCache(object):
+    """Persistent on-disk cache of decoded Mach-O tables
+
+    One entry is kept per image, keyed by the real path of the file, the
+    image offset and size within it, the file size and mtime, and the
+    LC_UUID of the image.  An entry holds:
+
+    - the mach header and load commands (which also describe segments
+      and sections), compared byte for byte against the image on lookup
+    - if requested, the decoded symbol string table, as an array of
+      string table offsets and the NUL-joined names
+    - if requested, the decoded z_macho_map table (see MachoMap), as an
+      array of addrs and sizes, an array of flags marking binds and the
+      NUL-joined names
+
+    Images are opened lazily, so checking an entry only scans the load
+    command headers and reads LC_UUID; commands and sections are then
+    decoded on first access, and a cached z_macho_map needs neither the
+    sections nor the fixups.  The nlist array (and SymbolColumns) are
+    views of the mapped image that cost nothing to build, so they are not
+    cached.  Entries are memory-mapped on lookup and the names are only
+    decoded when the first symbol name is looked up, so a warm open costs
+    little more than a stat() and two mmap() calls.  Entry files are replaced
+    atomically, so concurrent processes can share a cache directory.  The
+    mtime of an entry file is its last use; when the directory grows past
+    max_size, the least recently used entries are evicted.
+    """
+
+    def __init__(self, directory=None, max_size=DEFAULT_CACHE_SIZE):
+        self._directory = directory or DEFAULT_CACHE_DIR
+        self._max_size = max_size
+        os.makedirs(self._directory, exist_ok=True)
+
+    def open(self, input_file_name, offset=0, size=None, names=False, macho_map=False, **kwargs):
+        """Return a MachOFile for an image, with its tables loaded from cache
+
+        On a miss a new entry is stored.  With names=True, for callers
+        that look up most symbol names (e.g. nm), the symbol names are
+        decoded and stored too, if the entry does not have them yet.
+        Likewise macho_map=True stores the table of MachOFile.macho_map().
+        Remaining keyword arguments are passed on to MachOFile, which
+        is lazy unless lazy=False is given.
+        """
+        st = os.stat(input_file_name)
+        kwargs.setdefault('lazy', True)
+        mf = MachOFile(input_file_name, offset=offset, size=size, **kwargs)
+        key = [os.path.realpath(input_file_name), offset, size,
+               st.st_size, st.st_mtime_ns, str(mf.uuid())]
+        path = self._entry_path(key)
+        with stats.timed('cache'):
+            found = self._load(path, key, mf)
+            if (found is None or (names and 'names' not in found)
+                    or (macho_map and 'map_names' not in found)):
+                self._store(path, key, mf, found, names, macho_map)
+        return mf
+
+    def _entry_path(self, key):
+        digest = hashlib.sha1(json.dumps(key).encode()).hexdigest()
+        return os.path.join(self._directory, digest + '.cache')
+
+    def _load(self, path, key, mf):
+        # returns the blobs loaded, or None on a miss
+        try:
+            with open(path, 'rb') as f:
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+
+        try:
+            magic, version, meta_len = CACHE_HEADER.unpack_from(buf)
+            if magic != CACHE_MAGIC or version != CACHE_VERSION:
+                return None
+            meta = json.loads(
+                buf[CACHE_HEADER.size:CACHE_HEADER.size + meta_len])
+            if meta['key'] != key:
+                return None
+            blobs = dict()
+            for name, (start, length) in meta['blobs'].items():
+                blobs[name] = buf[start:start + length]
+                if len(blobs[name]) != length:
+                    raise ValueError(f'{path}: truncated {name}')
+            if blobs['commands'] != mf.commands_data():
+                return None
+            if 'names' in blobs:
+                offsets = array.array('I')
+                offsets.frombytes(blobs['strx'])
+                mf.preload_strings(offsets, blobs['names'])
+            if 'map_names' in blobs:
+                mf.preload_macho_map(*self._map_columns(blobs))
+        except (struct.error, ValueError, KeyError, TypeError):
+            # a corrupt entry is a miss; it is replaced by _store()
+            self._unlink(path)
+            return None
+        finally:
+            buf.close()
+
+        # mark the entry as recently used
+        os.utime(path)
+        return blobs
+
+    @staticmethod
+    def _map_columns(blobs):
+        flags = blobs['map_flags']
+        count = len(flags)
+        words = array.array('Q')
+        words.frombytes(blobs['map_words'])
+        if len(words) != 2 * count:
+            raise ValueError('z_macho_map columns differ in length')
+        names = blobs['map_names'].decode('utf-8').split('\0')[:count]
+        addrs = words[:count].tolist()
+        for i, flag in enumerate(flags):
+            if flag & MAP_NO_NAME:
+                names[i] = None
+            if flag & MAP_NO_ADDR:
+                addrs[i] = None
+        return names, addrs, words[count:].tolist()
+
+    def _store(self, path, key, mf, found=None, names=False, macho_map=False):
+        # the tables of an existing entry are kept
+        blobs = dict(found or ())
+        blobs['commands'] = bytes(mf.commands_data())
+
+        if names and 'names' not in blobs:
+            offsets, names = [], []
+            lc = mf.command(LCCommand.LC_SYMTAB)
+            if lc:
+                n = 8 if mf.is_64() else 4
+                offsets = sorted({fields[0] for fields in NLIST.iter_unpack(
+                    n, mf.order(), mf.data(), lc._symoff, lc._nsyms)})
+                strings = mf.string_table()
+                names = [strings.get(strx) for strx in offsets]
+                mf.preload_strings(offsets, names)
+            # stored even when empty, so that the entry is not redone
+            blobs['strx'] = array.array('I', offsets).tobytes()
+            blobs['names'] = '\0'.join(names).encode()
+
+        if macho_map and 'map_names' not in blobs:
+            mm = mf.macho_map()
+            blobs['map_flags'] = bytes(
+                (MAP_NO_NAME if name is None else 0) | (MAP_NO_ADDR if addr is None else 0)
+                for name, addr in zip(mm.names(), mm.addrs()))
+            blobs['map_words'] = array.array(
+                'Q', [addr or 0 for addr in mm.addrs()] + list(mm.sizes())).tobytes()
+            blobs['map_names'] = '\0'.join(name or '' for name in mm.names()).encode()
+
+        # blobs follow the metadata, whose length depends on their offsets
+        start = 0
+        while True:
+            layout = dict()
+            offset = start
+            for name, blob in blobs.items():
+                layout[name] = (offset, len(blob))
+                offset += len(blob)
+            meta = json.dumps({'key': key, 'blobs': layout}).encode()
+            if CACHE_HEADER.size + len(meta) <= start:
+                break
+            start = align_up(CACHE_HEADER.size + len(meta), 8)
+        meta = meta.ljust(start - CACHE_HEADER.size)
+
+        tmp = None
+        try:
+            fd, tmp = tempfile.mkstemp(dir=self._directory, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(CACHE_HEADER.pack(
+                    CACHE_MAGIC, CACHE_VERSION, len(meta)))
+                f.write(meta)
+                for blob in blobs.values():
+                    f.write(blob)
+            os.replace(tmp, path)
+        except OSError:
+            # the cache is best effort; a read-only or full disk is not fatal
+            if tmp is not None:
+                self._unlink(tmp)
+            return
+        self.evict()
+
+    @staticmethod
+    def _unlink(path):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits max_size"""
+        entries = []
+        for entry in os.scandir(self._directory):
+            if entry.name.endswith('.cache'):
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                entries.append((st.st_mtime_ns, st.st_size, entry.path))
+        entries.sort()
+        total = sum(size for mtime, size, path in entries)
+        for mtime, size, path in entries:
+            if total <= self._max_size:
+                break
+            self._unlink(path)
+            total -= size
+
+    def clear(self):
+        """Remove every entry"""
+        for entry in os.scandir(self._directory):
+            if entry.name.endswith('.cache'):
+                os.unlink(entry.path)
@@ -1,2 +1,6 @@
 # Copyright (c) 2021 Friedt Professional Engineering Services, Inc
 # SPDX-License-Identifier: MIT
+
+# see include/sys/macho_map.h
+MACHO_MAP_SEGMENT = '__RODATA'
+MACHO_MAP_SECTION = 'z_macho_map'
@@ -14,6 +14,14 @@ class MHMagic(Enum):
     MH_CIGAM_64 = 0xcffaedfe  # NXSwapInt(MH_MAGIC_64)
 
 
+class FatMagic(Enum):
+    # Constants for the magic field of the fat_header (always big-endian)
+    FAT_MAGIC = 0xcafebabe  # the fat magic number
+    FAT_CIGAM = 0xbebafeca  # NXSwapLong(FAT_MAGIC)
+    FAT_MAGIC_64 = 0xcafebabf  # the 64-bit fat magic number
+    FAT_CIGAM_64 = 0xbfbafeca  # NXSwapLong(FAT_MAGIC_64)
+
+
 class MHCpuMask(Enum):
     CPU_ARCH_MASK = 0xff000000  # mask for architecture bits
     CPU_SUBTYPE_MASK = 0xff000000  # mask for feature flags
@@ -359,3 +367,106 @@ class NLStab(Enum):
     N_ECOMM = 0xe4  # end common: name,,n_sect,0,0
     N_ECOML = 0xe8  # end common (local name): 0,,n_sect,0,address
     N_LENG = 0xfe  # second stab entry with length information
+
+
+# Values for the pointer_format field of dyld_chained_starts_in_segment
+class ChainedPtrFormat(Enum):
+    DYLD_CHAINED_PTR_ARM64E = 1  # stride 8, unauth target is vmaddr
+    DYLD_CHAINED_PTR_64 = 2  # target is vmaddr
+    DYLD_CHAINED_PTR_32 = 3
+    DYLD_CHAINED_PTR_32_CACHE = 4
+    DYLD_CHAINED_PTR_32_FIRMWARE = 5
+    DYLD_CHAINED_PTR_64_OFFSET = 6  # target is vm offset
+    DYLD_CHAINED_PTR_ARM64E_KERNEL = 7  # stride 4, unauth target is vm offset
+    DYLD_CHAINED_PTR_64_KERNEL_CACHE = 8
+    DYLD_CHAINED_PTR_ARM64E_USERLAND = 9  # stride 8, unauth target is vm offset
+    DYLD_CHAINED_PTR_ARM64E_FIRMWARE = 10  # stride 4, unauth target is vmaddr
+    DYLD_CHAINED_PTR_X86_64_KERNEL_CACHE = 11  # stride 1, x86_64 kernel caches
+    # stride 8, unauth target is vm offset, 24-bit bind
+    DYLD_CHAINED_PTR_ARM64E_USERLAND24 = 12
+
+
+# Values for the imports_format field of dyld_chained_fixups_header
+class ChainedImportFormat(Enum):
+    DYLD_CHAINED_IMPORT = 1
+    DYLD_CHAINED_IMPORT_ADDEND = 2
+    DYLD_CHAINED_IMPORT_ADDEND64 = 3
+
+
+# Flags of an exports trie terminal node
+class ExportSymbolFlag(Enum):
+    EXPORT_SYMBOL_FLAGS_KIND_MASK = 0x03
+    EXPORT_SYMBOL_FLAGS_WEAK_DEFINITION = 0x04
+    EXPORT_SYMBOL_FLAGS_REEXPORT = 0x08
+    EXPORT_SYMBOL_FLAGS_STUB_AND_RESOLVER = 0x10
+    EXPORT_SYMBOL_FLAGS_STATIC_RESOLVER = 0x20
+
+
+# Values of the EXPORT_SYMBOL_FLAGS_KIND_MASK bits
+class ExportSymbolKind(Enum):
+    EXPORT_SYMBOL_FLAGS_KIND_REGULAR = 0x00
+    EXPORT_SYMBOL_FLAGS_KIND_THREAD_LOCAL = 0x01
+    EXPORT_SYMBOL_FLAGS_KIND_ABSOLUTE = 0x02
+
+
+# Magic numbers of the code signing blobs (always big endian)
+class CSMagic(Enum):
+    CSMAGIC_REQUIREMENT = 0xfade0c00  # single Requirement blob
+    CSMAGIC_REQUIREMENTS = 0xfade0c01  # Requirements vector (internal requirements)
+    CSMAGIC_CODEDIRECTORY = 0xfade0c02  # CodeDirectory blob
+    CSMAGIC_EMBEDDED_SIGNATURE = 0xfade0cc0  # embedded form of signature data
+    CSMAGIC_EMBEDDED_SIGNATURE_OLD = 0xfade0b02  # XXX
+    CSMAGIC_EMBEDDED_ENTITLEMENTS = 0xfade7171  # embedded entitlements
+    CSMAGIC_EMBEDDED_DER_ENTITLEMENTS = 0xfade7172  # embedded DER encoded entitlements
+    CSMAGIC_DETACHED_SIGNATURE = 0xfade0cc1  # multi-arch collection of embedded signatures
+    CSMAGIC_BLOBWRAPPER = 0xfade0b01  # CMS Signature, among other things
+
+
+# Slot types of the blobs of a SuperBlob, and special slot numbers
+class CSSlot(Enum):
+    CSSLOT_CODEDIRECTORY = 0  # slot index for CodeDirectory
+    CSSLOT_INFOSLOT = 1
+    CSSLOT_REQUIREMENTS = 2
+    CSSLOT_RESOURCEDIR = 3
+    CSSLOT_APPLICATION = 4
+    CSSLOT_ENTITLEMENTS = 5
+    CSSLOT_DER_ENTITLEMENTS = 7
+    CSSLOT_ALTERNATE_CODEDIRECTORIES = 0x1000  # first alternate CodeDirectory, if any
+    CSSLOT_SIGNATURESLOT = 0x10000  # CMS Signature
+    CSSLOT_IDENTIFICATIONSLOT = 0x10001
+    CSSLOT_TICKETSLOT = 0x10002
+
+
+# Values of the hashType field of a CodeDirectory
+class CSHashType(Enum):
+    CS_HASHTYPE_SHA1 = 1
+    CS_HASHTYPE_SHA256 = 2
+    CS_HASHTYPE_SHA256_TRUNCATED = 3
+    CS_HASHTYPE_SHA384 = 4
+
+
+# Flags of a CodeDirectory (a subset of the code signing flags)
+class CSFlag(Enum):
+    CS_VALID = 0x00000001  # dynamically valid
+    CS_ADHOC = 0x00000002  # ad hoc signed
+    CS_GET_TASK_ALLOW = 0x00000004  # has get-task-allow entitlement
+    CS_INSTALLER = 0x00000008  # has installer entitlement
+    CS_HARD = 0x00000100  # don't load invalid pages
+    CS_KILL = 0x00000200  # kill process if it becomes invalid
+    CS_CHECK_EXPIRATION = 0x00000400  # force expiration checking
+    CS_RESTRICT = 0x00000800  # tell dyld to treat restricted
+    CS_ENFORCEMENT = 0x00001000  # require enforcement
+    CS_REQUIRE_LV = 0x00002000  # require library validation
+    CS_RUNTIME = 0x00010000  # apply hardened runtime policies
+    CS_LINKER_SIGNED = 0x00020000  # automatically signed by the linker
+
+
+# Values of the execSegFlags field of a CodeDirectory
+class CSExecSegFlag(Enum):
+    CS_EXECSEG_MAIN_BINARY = 0x1  # executable segment denotes main binary
+    CS_EXECSEG_ALLOW_UNSIGNED = 0x10  # allow unsigned pages (for debugging)
+    CS_EXECSEG_DEBUGGER = 0x20  # main binary is debugger
+    CS_EXECSEG_JIT = 0x40  # JIT enabled
+    CS_EXECSEG_SKIP_LV = 0x80  # OBSOLETE: skip library validation
+    CS_EXECSEG_CAN_LOAD_CDHASH = 0x100  # can bless cdhash for execution
+    CS_EXECSEG_CAN_EXEC_CDHASH = 0x200  # can execute blessed cdhash
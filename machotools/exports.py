@@ -0,0 +1,134 @@
+# Copyright (c) 2021 Friedt Professional Engineering Services, Inc
+# SPDX-License-Identifier: MIT
+
+import collections
+
+from machotools.enums import *
+from machotools.util import read_uleb128
+
+_KIND_MASK = ExportSymbolFlag.EXPORT_SYMBOL_FLAGS_KIND_MASK.value
+_WEAK_DEFINITION = ExportSymbolFlag.EXPORT_SYMBOL_FLAGS_WEAK_DEFINITION.value
+_REEXPORT = ExportSymbolFlag.EXPORT_SYMBOL_FLAGS_REEXPORT.value
+_STUB_AND_RESOLVER = ExportSymbolFlag.EXPORT_SYMBOL_FLAGS_STUB_AND_RESOLVER.value
+
+
+class ExportedSymbol(collections.namedtuple('ExportedSymbol', ['name', 'flags', 'address', 'other', 'import_name'])):
+    """One terminal of the exports trie
+
+    address is relative to the mach header (the stub address for
+    stub-and-resolver exports, which have the resolver offset in other).
+    Re-exports have no address; other is the dylib ordinal and import_name
+    the name in that dylib (None if the same name).
+    """
+    __slots__ = ()
+
+    def kind(self):
+        return ExportSymbolKind(self.flags & _KIND_MASK)
+
+    def is_weak(self):
+        return self.flags & _WEAK_DEFINITION != 0
+
+    def is_reexport(self):
+        return self.flags & _REEXPORT != 0
+
+    def is_stub_and_resolver(self):
+        return self.flags & _STUB_AND_RESOLVER != 0
+
+
+class ExportsTrie(object):
+    """The exports trie of LC_DYLD_EXPORTS_TRIE or LC_DYLD_INFO(_ONLY)
+
+    The trie is decoded straight from the mapped image and never as a
+    whole: lookup() follows the one edge matching the next part of the
+    name at each node, so it costs O(len(name)), and iterating yields the
+    exports one at a time from a depth-first walk.
+    """
+
+    def __init__(self, data):
+        self._data = data
+
+    def _cstring(self, offset):
+        end = offset
+        data = self._data
+        while data[end]:
+            end += 1
+        return bytes(data[offset:end]), end + 1
+
+    def _terminal(self, name, offset):
+        # returns the export at node offset, or None if it is not a terminal
+        size, offset = read_uleb128(self._data, offset)
+        if not size:
+            return None
+        flags, offset = read_uleb128(self._data, offset)
+        address = other = import_name = None
+        if flags & _REEXPORT:
+            other, offset = read_uleb128(self._data, offset)
+            import_name, offset = self._cstring(offset)
+            import_name = import_name.decode() or None
+        elif flags & _STUB_AND_RESOLVER:
+            address, offset = read_uleb128(self._data, offset)
+            other, offset = read_uleb128(self._data, offset)
+        else:
+            address, offset = read_uleb128(self._data, offset)
+        return ExportedSymbol(name, flags, address, other, import_name)
+
+    def _children(self, offset):
+        # returns the offset of the child count of the node at offset
+        size, offset = read_uleb128(self._data, offset)
+        return offset + size
+
+    def lookup(self, name):
+        """Return the ExportedSymbol called name, or None"""
+        if not len(self._data):
+            return None
+        key = name.encode()
+        data = self._data
+        pos = 0
+        node = 0
+        # each step consumes at least one byte of the name
+        for _ in range(len(key) + 1):
+            if pos == len(key):
+                return self._terminal(name, node)
+            offset = self._children(node)
+            count = data[offset]
+            offset += 1
+            for _ in range(count):
+                label, offset = self._cstring(offset)
+                child, offset = read_uleb128(data, offset)
+                if label and key.startswith(label, pos):
+                    node = child
+                    pos += len(label)
+                    break
+            else:
+                return None
+        return None
+
+    def __contains__(self, name):
+        return self.lookup(name) is not None
+
+    def __iter__(self):
+        """Yield every ExportedSymbol, depth first in trie order"""
+        if not len(self._data):
+            return
+        data = self._data
+        visited = set()
+        stack = [(0, b'')]
+        while stack:
+            node, prefix = stack.pop()
+            if node in visited:
+                raise ValueError(f'exports trie loops at node {node:#x}')
+            visited.add(node)
+
+            terminal = self._terminal(None, node)
+            if terminal is not None:
+                yield terminal._replace(name=prefix.decode())
+
+            offset = self._children(node)
+            count = data[offset]
+            offset += 1
+            children = []
+            for _ in range(count):
+                label, offset = self._cstring(offset)
+                child, offset = read_uleb128(data, offset)
+                children.append((child, prefix + label))
+            stack.extend(reversed(children))
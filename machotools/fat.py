@@ -0,0 +1,127 @@
+# Copyright (c) 2021 Friedt Professional Engineering Services, Inc
+# SPDX-License-Identifier: MIT
+
+import concurrent.futures
+import platform
+
+from machotools.enums import *
+from machotools.machofile import MachOFile
+from machotools.structs import StructLayout
+
+# The fat header and fat_arch structures are always big-endian
+FAT_HEADER = StructLayout(
+    ('magic', 'I'),  # FAT_MAGIC or FAT_MAGIC_64
+    ('nfat_arch', 'I'),  # number of structs that follow
+)
+
+FAT_ARCH = StructLayout(
+    ('cputype', 'i'),  # cpu specifier (int)
+    ('cpusubtype', 'I'),  # machine specifier (int)
+    ('offset', 'W'),  # file offset to this object file
+    ('size', 'W'),  # size of this object file
+    ('align', 'I'),  # alignment as a power of 2
+    ('reserved', 'I', 8),  # reserved
+)
+
+# arch(3) names, as (cputype, cpusubtype or None for any)
+ARCH_NAMES = {
+    'i386': (MHCpuType.CPU_TYPE_X86, None),
+    'x86_64': (MHCpuType.CPU_TYPE_X86_64, None),
+    'x86_64h': (MHCpuType.CPU_TYPE_X86_64, 8),
+    'arm': (MHCpuType.CPU_TYPE_ARM, None),
+    'arm64': (MHCpuType.CPU_TYPE_ARM64, None),
+    'arm64e': (MHCpuType.CPU_TYPE_ARM64, 2),
+    'arm64_32': (MHCpuType.CPU_TYPE_ARM64_32, None),
+    'ppc': (MHCpuType.CPU_TYPE_POWERPC, None),
+    'ppc64': (MHCpuType.CPU_TYPE_POWERPC64, None),
+}
+
+
+def host_arch():
+    machine = platform.machine()
+    return 'arm64' if machine == 'aarch64' else machine
+
+
+def is_fat(input_file_name):
+    with open(input_file_name, 'rb') as f:
+        magic = int.from_bytes(f.read(4), 'big')
+    return magic in (FatMagic.FAT_MAGIC.value, FatMagic.FAT_MAGIC_64.value)
+
+
+class FatArch(object):
+    def __init__(self, values):
+        (cputype, self._cpusubtype, self._offset, self._size,
+         self._align, *reserved) = values
+        try:
+            self._cputype = MHCpuType(cputype)
+        except ValueError:
+            # not a known cpu type; the raw value is kept so that the
+            # other slices can still be used
+            self._cputype = cputype
+
+    def name(self):
+        subtype = self._cpusubtype & ~MHCpuMask.CPU_SUBTYPE_MASK.value
+        for name, (cputype, cpusubtype) in ARCH_NAMES.items():
+            if cputype == self._cputype and cpusubtype == subtype:
+                return name
+        for name, (cputype, cpusubtype) in ARCH_NAMES.items():
+            if cputype == self._cputype and cpusubtype is None:
+                return name
+        cputype = self._cputype.value if isinstance(self._cputype, MHCpuType) else self._cputype
+        return f'{cputype}:{self._cpusubtype}'
+
+    def __repr__(self):
+        return '{' f'arch: {self.name()}, cputype: {self._cputype}, cpusubtype: {self._cpusubtype}, offset: {self._offset}, size: {self._size}, align: {self._align}' '}'
+
+
+class FatFile(object):
+    """A universal (fat) binary
+
+    Each architecture slice is exposed as a MachOFile constructed at the
+    slice's offset within the file.
+    """
+
+    def __init__(self, input_file_name):
+        self._name = input_file_name
+        with open(input_file_name, 'rb') as f:
+            header = f.read(FAT_HEADER.size(4))
+            self._magic = FatMagic(int.from_bytes(header[:4], 'big'))
+            if self._magic not in (FatMagic.FAT_MAGIC, FatMagic.FAT_MAGIC_64):
+                raise ValueError(f'unsupported fat magic {self._magic}')
+            n = 8 if self._magic == FatMagic.FAT_MAGIC_64 else 4
+            _, nfat_arch = FAT_HEADER.unpack_from(n, 'big', header)
+            data = f.read(nfat_arch * FAT_ARCH.size(n))
+        self._archs = [FatArch(values)
+                       for values in FAT_ARCH.iter_unpack(n, 'big', data, 0, nfat_arch)]
+
+    def archs(self):
+        return self._archs
+
+    def arch(self, name):
+        """Return the FatArch called name (see ARCH_NAMES), or None"""
+        for arch in self._archs:
+            if arch.name() == name:
+                return arch
+        return None
+
+    def macho(self, arch, **kwargs):
+        """Return the MachOFile of one slice"""
+        return MachOFile(self._name, offset=arch._offset, size=arch._size, **kwargs)
+
+    def map(self, func, archs=None, max_workers=None):
+        """Call func(file name, FatArch) for each slice in a process pool
+
+        Slices are parsed concurrently, so inspecting every architecture
+        takes about as long as the largest slice.  func must be picklable
+        (i.e. a module-level function).  Results are returned in slice
+        order.
+        """
+        if archs is None:
+            archs = self._archs
+        if len(archs) < 2:
+            return [func(self._name, arch) for arch in archs]
+        with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as pool:
+            return list(pool.map(func, [self._name] * len(archs), archs))
+
+    def __repr__(self):
+        return '{' f'magic: {self._magic}, archs: {self._archs}' '}'
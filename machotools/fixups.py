@@ -0,0 +1,394 @@
+# Copyright (c) 2021 Friedt Professional Engineering Services, Inc
+# SPDX-License-Identifier: MIT
+
+import collections
+import struct
+import zlib
+
+from machotools.enums import *
+from machotools.stringtable import StringTable
+from machotools.structs import StructLayout
+from machotools.symbols import np
+
+DYLD_CHAINED_FIXUPS_HEADER = StructLayout(
+    ('fixups_version', 'I'),  # 0
+    ('starts_offset', 'I'),  # offset of dyld_chained_starts_in_image in chain_data
+    ('imports_offset', 'I'),  # offset of imports table in chain_data
+    ('symbols_offset', 'I'),  # offset of symbol strings in chain_data
+    ('imports_count', 'I'),  # number of imported symbol names
+    ('imports_format', 'I'),  # DYLD_CHAINED_IMPORT*
+    ('symbols_format', 'I'),  # 0 => uncompressed, 1 => zlib compressed
+)
+
+# followed by seg_info_offset[seg_count] (uint32_t), one per segment
+DYLD_CHAINED_STARTS_IN_IMAGE = StructLayout(
+    ('seg_count', 'I'),
+)
+
+# followed by page_start[page_count] (uint16_t)
+DYLD_CHAINED_STARTS_IN_SEGMENT = StructLayout(
+    ('size', 'I'),  # size of this (amount kernel needs to copy)
+    ('page_size', 'H'),  # 0x1000 or 0x4000
+    ('pointer_format', 'H'),  # DYLD_CHAINED_PTR_*
+    ('segment_offset', 'Q'),  # offset in memory to start of segment
+    # for 32-bit OS, any value beyond this is not a pointer
+    ('max_valid_pointer', 'I'),
+    ('page_count', 'H'),  # how many pages are in array
+)
+
+DYLD_CHAINED_PTR_START_NONE = 0xffff  # used in page_start[] to denote a page with no fixups
+# used in page_start[] to denote a page which has multiple starts
+DYLD_CHAINED_PTR_START_MULTI = 0x8000
+# used in chain_starts[] to denote last start in list for page
+DYLD_CHAINED_PTR_START_LAST = 0x8000
+
+ChainedImport = collections.namedtuple(
+    'ChainedImport', ['name', 'lib_ordinal', 'weak', 'addend'])
+
+
+def _where(cond, a, b):
+    if np is not None and isinstance(cond, np.ndarray):
+        return np.where(cond, a, b)
+    return a if cond else b
+
+
+# The decoders below take a raw pointer value, or a NumPy array of them,
+# and return (bind, target, ordinal, addend).  target is the rebased
+# (unslid) vmaddr and is only meaningful where bind is 0; ordinal and
+# addend are only meaningful where bind is 1.
+
+def _decode_64(raw, base, offset):
+    # dyld_chained_ptr_64_rebase / dyld_chained_ptr_64_bind
+    bind = (raw >> 63) & 1
+    target = (raw & 0xfffffffff) + (base if offset else 0)
+    target = target | (((raw >> 36) & 0xff) << 56)
+    ordinal = raw & 0xffffff
+    addend = (raw >> 24) & 0xff
+    return bind, target, ordinal, addend
+
+
+def _decode_32(raw, base, offset):
+    # dyld_chained_ptr_32_rebase / dyld_chained_ptr_32_bind
+    bind = (raw >> 31) & 1
+    target = (raw & 0x3ffffff) + (base if offset else 0)
+    ordinal = raw & 0xfffff
+    addend = (raw >> 20) & 0x3f
+    return bind, target, ordinal, addend
+
+
+def _decode_arm64e(raw, base, offset, ordinal_bits=16):
+    # dyld_chained_ptr_arm64e_{rebase,bind,auth_rebase,auth_bind}
+    auth = (raw >> 63) & 1
+    bind = (raw >> 62) & 1
+    plain = (raw & 0x7ffffffffff) + (base if offset else 0)
+    plain = plain | (((raw >> 43) & 0xff) << 56)
+    # authenticated rebases always hold a 32-bit vm offset
+    target = _where(auth, (raw & 0xffffffff) + base, plain)
+    ordinal = raw & ((1 << ordinal_bits) - 1)
+    addend = _where(auth, 0, (raw >> 32) & 0x7ffff)
+    return bind, target, ordinal, addend
+
+
+def _decode_arm64e_userland24(raw, base, offset):
+    return _decode_arm64e(raw, base, offset, 24)
+
+
+ChainedPointerFormat = collections.namedtuple('ChainedPointerFormat', [
+    'stride', 'size', 'next_shift', 'next_mask', 'decode', 'offset', 'addend_sign'])
+
+# pointer_format -> layout of the pointers in a chain; offset tells whether
+# unauthenticated rebase targets are vm offsets (from the image base) or
+# vmaddrs, addend_sign the sign bit of signed bind addends (0 if unsigned)
+POINTER_FORMATS = {
+    ChainedPtrFormat.DYLD_CHAINED_PTR_ARM64E.value:
+        ChainedPointerFormat(8, 8, 51, 0x7ff, _decode_arm64e, False, 1 << 18),
+    ChainedPtrFormat.DYLD_CHAINED_PTR_64.value:
+        ChainedPointerFormat(4, 8, 51, 0xfff, _decode_64, False, 0),
+    ChainedPtrFormat.DYLD_CHAINED_PTR_32.value:
+        ChainedPointerFormat(4, 4, 26, 0x1f, _decode_32, False, 0),
+    ChainedPtrFormat.DYLD_CHAINED_PTR_64_OFFSET.value:
+        ChainedPointerFormat(4, 8, 51, 0xfff, _decode_64, True, 0),
+    ChainedPtrFormat.DYLD_CHAINED_PTR_ARM64E_KERNEL.value:
+        ChainedPointerFormat(4, 8, 51, 0x7ff, _decode_arm64e, True, 1 << 18),
+    ChainedPtrFormat.DYLD_CHAINED_PTR_ARM64E_USERLAND.value:
+        ChainedPointerFormat(8, 8, 51, 0x7ff, _decode_arm64e, True, 1 << 18),
+    ChainedPtrFormat.DYLD_CHAINED_PTR_ARM64E_FIRMWARE.value:
+        ChainedPointerFormat(4, 8, 51, 0x7ff, _decode_arm64e, False, 1 << 18),
+    ChainedPtrFormat.DYLD_CHAINED_PTR_ARM64E_USERLAND24.value:
+        ChainedPointerFormat(8, 8, 51, 0x7ff, _decode_arm64e_userland24, True, 1 << 18),
+}
+
+
+class ChainedFixups(object):
+    """Decoder of the LC_DYLD_CHAINED_FIXUPS chains of an image
+
+    Each fixup chain is walked once, collecting the location and raw value
+    of every pointer in a segment; the raw values are then decoded in one
+    vectorized pass (with NumPy when available).  The result is a rebase
+    map and a bind map, both keyed by the (unslid) vmaddr of the pointer,
+    so resolving a pointer is a dict lookup.  Pages are decoded on demand:
+    resolve() only walks the chains of the pages it needs.
+    """
+
+    def __init__(self, mf, lc):
+        self._mf = mf
+        self._order = mf.order()
+        self._prefix = '<' if self._order == 'little' else '>'
+        self._data = bytes(mf.data()[lc._dataoff:lc._dataoff + lc._datasize])
+        (self._fixups_version, self._starts_offset, self._imports_offset,
+         self._symbols_offset, self._imports_count, self._imports_format,
+         self._symbols_format) = DYLD_CHAINED_FIXUPS_HEADER.unpack_from(4, self._order, self._data)
+        self._base = mf.base_address()
+        self._imports = None
+        self._segment_starts = None
+        # pages decoded so far, as (segment index, page) pairs
+        self._decoded = set()
+        self._rebases = dict()
+        self._binds = dict()
+
+    def segment_starts(self):
+        """Return (segment index, starts, page_start) for each segment with fixups
+
+        starts are the dyld_chained_starts_in_segment fields and page_start
+        the page_start[] array (including any trailing chain_starts[]).
+        """
+        data = self._data
+        offset = self._starts_offset
+        seg_count, = DYLD_CHAINED_STARTS_IN_IMAGE.unpack_from(
+            4, self._order, data, offset)
+        seg_info_offsets = struct.unpack_from(
+            self._prefix + 'I' * seg_count,
+            data, offset + DYLD_CHAINED_STARTS_IN_IMAGE.size(4))
+
+        result = []
+        for index, seg_info_offset in enumerate(seg_info_offsets):
+            if seg_info_offset == 0:
+                continue
+            start = offset + seg_info_offset
+            starts = DYLD_CHAINED_STARTS_IN_SEGMENT.unpack_from(
+                4, self._order, data, start)
+            size = starts[0]
+            head = DYLD_CHAINED_STARTS_IN_SEGMENT.size(4)
+            count = (size - head) // 2
+            page_start = struct.unpack_from(
+                self._prefix + 'H' * count, data, start + head)
+            result.append((index, starts, page_start))
+        return result
+
+    def _walk(self, fmt, seg_data, offset, unpack, locations, raws):
+        stride = fmt.stride
+        shift = fmt.next_shift
+        mask = fmt.next_mask
+        while True:
+            raw = unpack(seg_data, offset)[0]
+            locations.append(offset)
+            raws.append(raw)
+            delta = (raw >> shift) & mask
+            if not delta:
+                break
+            offset += delta * stride
+
+    def _walk_page(self, fmt, seg_data, page_offset, page_size, chain_starts, unpack, locations, raws):
+        if np is None:
+            for start in chain_starts:
+                self._walk(fmt, seg_data, page_offset + start,
+                           unpack, locations, raws)
+            return
+
+        # extract the raw value and next field of every possible pointer
+        # position in the page at once; walking a chain is then only a
+        # matter of hopping between list indexes
+        unit = 8 if fmt.stride == 8 else 4
+        count = min(page_size, len(seg_data) - page_offset) // unit
+        words = np.frombuffer(seg_data, dtype=self._prefix + ('u8' if unit == 8 else 'u4'),
+                              count=count, offset=page_offset)
+        if fmt.size == 8 and unit == 4:
+            lo, hi = (words[:-1], words[1:]) if self._order == 'little' else (
+                words[1:], words[:-1])
+            page_raws = lo.astype(np.uint64) | (hi.astype(np.uint64) << 32)
+        else:
+            page_raws = words.astype(np.uint64)
+        deltas = ((page_raws >> fmt.next_shift) & fmt.next_mask).tolist()
+        step = fmt.stride // unit
+        n = len(deltas)
+
+        for start in chain_starts:
+            k = start // unit
+            positions = []
+            while k < n:
+                positions.append(k)
+                delta = deltas[k]
+                if not delta:
+                    break
+                k += delta * step
+            else:
+                # the chain leaves the page; finish it one pointer at a time
+                self._walk(fmt, seg_data, page_offset + k *
+                           unit, unpack, locations, raws)
+            locations.extend(page_offset + k * unit for k in positions)
+            raws.extend(page_raws[positions].tolist())
+
+    def decode_segment(self, index, starts, page_start, pages=None):
+        """Decode the fixup chains of one segment
+
+        Only the chains starting in pages (all pages by default) are
+        walked.  Returns (rebases, binds): dicts keyed by pointer vmaddr of
+        rebase targets and of (import ordinal, addend) pairs.
+        """
+        (size, page_size, pointer_format, segment_offset,
+         max_valid_pointer, page_count) = starts
+        fmt = POINTER_FORMATS.get(pointer_format)
+        if fmt is None:
+            raise ValueError(
+                f'unsupported chained pointer format {pointer_format}')
+
+        seg = self._mf.segments()[index]
+        seg_data = self._mf.segment_data(seg)
+        unpack = struct.Struct(
+            self._prefix + ('Q' if fmt.size == 8 else 'I')).unpack_from
+
+        locations = []
+        raws = []
+        for page in range(page_count) if pages is None else pages:
+            start = page_start[page]
+            if start == DYLD_CHAINED_PTR_START_NONE:
+                continue
+            chain_starts = [start]
+            if fmt.size == 4 and start & DYLD_CHAINED_PTR_START_MULTI:
+                # 32-bit formats may have several chains per page
+                chain_starts = []
+                i = start & ~DYLD_CHAINED_PTR_START_MULTI
+                while True:
+                    chain_starts.append(
+                        page_start[i] & ~DYLD_CHAINED_PTR_START_LAST)
+                    if page_start[i] & DYLD_CHAINED_PTR_START_LAST:
+                        break
+                    i += 1
+            self._walk_page(fmt, seg_data, page * page_size, page_size,
+                            chain_starts, unpack, locations, raws)
+
+        seg_vmaddr = seg._vmaddr
+        if np is not None:
+            locations = np.array(locations, dtype=np.uint64) + seg_vmaddr
+            bind, target, ordinal, addend = fmt.decode(
+                np.array(raws, dtype=np.uint64), self._base, fmt.offset)
+            rebase = bind == 0
+            rebases = dict(
+                zip(locations[rebase].tolist(), target[rebase].tolist()))
+            bound = ~rebase
+            fields = zip(locations[bound].tolist(), ordinal[bound].tolist(), addend[bound].tolist())
+        else:
+            rebases = dict()
+            fields = []
+            for location, raw in zip(locations, raws):
+                bind, target, ordinal, addend = fmt.decode(
+                    raw, self._base, fmt.offset)
+                if bind:
+                    fields.append((seg_vmaddr + location, ordinal, addend))
+                else:
+                    rebases[seg_vmaddr + location] = target
+
+        binds = dict()
+        sign = fmt.addend_sign
+        for location, ordinal, addend in fields:
+            if addend & sign:
+                addend -= sign << 1
+            binds[location] = (ordinal, addend)
+        return rebases, binds
+
+    def _decode(self, start=None, end=None):
+        # decode (once) the pages overlapping [start, end), or all pages
+        if self._segment_starts is None:
+            self._segment_starts = self.segment_starts()
+        segments = self._mf.segments()
+        for index, starts, page_start in self._segment_starts:
+            page_size, page_count = starts[1], starts[5]
+            seg = segments[index]
+            first, last = 0, page_count
+            if start is not None:
+                lo = max(start, seg._vmaddr) - seg._vmaddr
+                hi = min(end, seg._vmaddr + seg._vmsize) - seg._vmaddr
+                if lo >= hi:
+                    continue
+                first, last = lo // page_size, min(
+                    page_count, (hi - 1) // page_size + 1)
+            pages = [page for page in range(first, last)
+                     if (index, page) not in self._decoded]
+            if not pages:
+                continue
+            rebases, binds = self.decode_segment(
+                index, starts, page_start, pages)
+            self._rebases.update(rebases)
+            self._binds.update(binds)
+            self._decoded.update((index, page) for page in pages)
+
+    def rebases(self):
+        """Return a dict of pointer vmaddr -> rebased target vmaddr"""
+        self._decode()
+        return self._rebases
+
+    def resolve(self, addrs, raws):
+        """Apply the fixups to the raw pointer values read from addrs
+
+        Returns a list with the rebased target of each pointer, None for
+        pointers bound to an imported symbol and the raw value for
+        locations without a fixup.
+        """
+        if len(addrs):
+            self._decode(min(addrs), max(addrs) + 8)
+        rebases = self._rebases
+        binds = self._binds
+        return [rebases.get(addr, None if addr in binds else raw) for addr, raw in zip(addrs, raws)]
+
+    def binds(self):
+        """Return a dict of pointer vmaddr -> (ChainedImport, addend)"""
+        self._decode()
+        imports = self.imports()
+        return {addr: (imports[ordinal], addend) for addr, (ordinal, addend) in self._binds.items()}
+
+    def imports(self):
+        """Return the imported symbols as a list of ChainedImport"""
+        if self._imports is None:
+            self._imports = self._parse_imports()
+        return self._imports
+
+    def _parse_imports(self):
+        data = self._data
+        symbols = data[self._symbols_offset:]
+        if self._symbols_format == 1:
+            symbols = zlib.decompress(symbols)
+        strings = StringTable(symbols)
+
+        order = self._prefix
+        fmt = self._imports_format
+        if fmt == ChainedImportFormat.DYLD_CHAINED_IMPORT.value:
+            entry = struct.Struct(order + 'I')
+        elif fmt == ChainedImportFormat.DYLD_CHAINED_IMPORT_ADDEND.value:
+            entry = struct.Struct(order + 'Ii')
+        elif fmt == ChainedImportFormat.DYLD_CHAINED_IMPORT_ADDEND64.value:
+            entry = struct.Struct(order + 'Qq')
+        else:
+            raise ValueError(f'unsupported chained import format {fmt}')
+
+        imports = []
+        start = self._imports_offset
+        end = start + self._imports_count * entry.size
+        for values in entry.iter_unpack(data[start:end]):
+            raw = values[0]
+            addend = values[1] if len(values) > 1 else 0
+            if fmt == ChainedImportFormat.DYLD_CHAINED_IMPORT_ADDEND64.value:
+                lib_ordinal, weak, name_offset = raw & 0xffff, (
+                    raw >> 16) & 1, raw >> 32
+                if lib_ordinal & 0x8000:
+                    lib_ordinal -= 0x10000
+            else:
+                lib_ordinal, weak, name_offset = raw & 0xff, (
+                    raw >> 8) & 1, raw >> 9
+                if lib_ordinal & 0x80:
+                    lib_ordinal -= 0x100
+            imports.append(ChainedImport(strings.get(
+                name_offset), lib_ordinal, bool(weak), addend))
+        return imports
+
+    def __repr__(self):
+        return '{' f'fixups_version: {self._fixups_version}, starts_offset: {self._starts_offset}, imports_offset: {self._imports_offset}, symbols_offset: {self._symbols_offset}, imports_count: {self._imports_count}, imports_format: {self._imports_format}, symbols_format: {self._symbols_format}' '}'
@@ -0,0 +1,118 @@
+# Copyright (c) 2021 Friedt Professional Engineering Services, Inc
+# SPDX-License-Identifier: MIT
+
+import array
+import bisect
+import itertools
+import re
+
+from machotools.symbols import np
+from machotools.util import read_uleb128
+
+# a run of single-byte (< 0x80), non-terminating deltas
+_SINGLE_BYTE_DELTAS = re.compile(rb'[\x01-\x7f]+')
+
+
+def decode_function_starts(data, base):
+    """Decode LC_FUNCTION_STARTS data into a sorted array of addresses
+
+    The data is a sequence of ULEB128 deltas, the first relative to base
+    (the vmaddr of __TEXT), terminated by a zero delta.  With NumPy every
+    delta is decoded at once and the addresses are a cumulative sum;
+    otherwise runs of single-byte deltas are summed in one step each.
+    Returns a NumPy uint64 array, or an array.array('Q') without numpy.
+    """
+    if np is not None:
+        return _decode_columns(data, base)
+    return _decode_runs(bytes(data), base)
+
+
+def _decode_columns(data, base):
+    raw = np.frombuffer(data, dtype=np.uint8)
+    ends = np.flatnonzero(raw < 0x80)
+    if not len(ends):
+        return np.zeros(0, dtype=np.uint64)
+    raw = raw[:ends[-1] + 1]
+    if len(ends) == len(raw):
+        # only single-byte deltas
+        deltas = raw.astype(np.uint64)
+    else:
+        starts = np.empty_like(ends)
+        starts[0] = 0
+        starts[1:] = ends[:-1] + 1
+        # position of each byte within its ULEB128
+        position = np.arange(len(raw)) - np.repeat(starts, ends - starts + 1)
+        deltas = np.add.reduceat((raw & 0x7f).astype(np.uint64) << (
+            7 * position).astype(np.uint64), starts)
+    zero = np.flatnonzero(deltas == 0)
+    if len(zero):
+        deltas = deltas[:zero[0]]
+    return np.cumsum(deltas, dtype=np.uint64) + np.uint64(base)
+
+
+def _decode_runs(data, base):
+    addrs = array.array('Q')
+    addr = base
+    offset = 0
+    while offset < len(data):
+        m = _SINGLE_BYTE_DELTAS.match(data, offset)
+        if m:
+            run = list(itertools.accumulate(m.group(), initial=addr))
+            addrs.extend(run[1:])
+            addr = run[-1]
+            offset = m.end()
+            continue
+        delta, offset = read_uleb128(data, offset)
+        if not delta:
+            break
+        addr += delta
+        addrs.append(addr)
+    return addrs
+
+
+class FunctionStarts(object):
+    """Function boundaries from LC_FUNCTION_STARTS
+
+    Each function extends to the start of the next one; the last one ends
+    at end (the end of its section).  Lookups are a binary search over the
+    sorted start addresses, vectorized with NumPy for batches.
+    """
+
+    def __init__(self, starts, end):
+        self._starts = starts
+        self._end = end
+
+    def starts(self):
+        return self._starts
+
+    def find(self, addr):
+        """Return the (start, end) of the function containing addr, or None"""
+        i = bisect.bisect_right(self._starts, addr) - 1
+        if i < 0 or addr >= self._end:
+            return None
+        end = self._starts[i + 1] if i + 1 < len(self._starts) else self._end
+        return int(self._starts[i]), int(end)
+
+    def find_starts(self, addresses):
+        """Return the start of the function containing each address (or None)"""
+        if np is None or not isinstance(self._starts, np.ndarray):
+            return [None if bounds is None else bounds[0]
+                    for bounds in map(self.find, addresses)]
+        addrs = np.array(addresses, dtype=np.uint64)
+        i = np.searchsorted(self._starts, addrs, side='right') - 1
+        ok = (i >= 0) & (addrs < self._end)
+        starts = self._starts[np.maximum(i, 0)].tolist()
+        return [start if found else None for start, found in zip(starts, ok.tolist())]
+
+    def sizes(self):
+        """Return the size of each function, in start address order"""
+        if np is not None and isinstance(self._starts, np.ndarray) and len(self._starts):
+            return np.diff(self._starts, append=np.uint64(self._end))
+        ends = itertools.chain(itertools.islice(self._starts, 1, None), (self._end,))
+        return [end - start for start, end in zip(self._starts, ends)]
+
+    def __len__(self):
+        return len(self._starts)
+
+    def __iter__(self):
+        return iter(self._starts)
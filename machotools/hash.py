@@ -1,2 +1,283 @@
 # Copyright (c) 2021 Friedt Professional Engineering Services, Inc
 # SPDX-License-Identifier: MIT
+
+import concurrent.futures
+import hashlib
+import os
+
+from machotools.enums import *
+from machotools.structs import StructLayout
+
+# code signing blobs are big endian regardless of the image byte order
+_ORDER = 'big'
+
+CS_SUPERBLOB = StructLayout(
+    ('magic', 'I'),  # magic number
+    ('length', 'I'),  # total length of SuperBlob
+    ('count', 'I'),  # number of index entries following
+)
+
+# followed by count CS_BLOBINDEX entries
+CS_BLOBINDEX = StructLayout(
+    ('type', 'I'),  # type of entry
+    ('offset', 'I'),  # offset of entry
+)
+
+CS_GENERICBLOB = StructLayout(
+    ('magic', 'I'),  # magic number
+    ('length', 'I'),  # total length of blob
+)
+
+# the fields of the CodeDirectory up to version 0x20400; later fields are
+# only read by the kernel
+CS_CODEDIRECTORY = StructLayout(
+    ('magic', 'I'),  # magic number (CSMAGIC_CODEDIRECTORY)
+    ('length', 'I'),  # total length of CodeDirectory blob
+    ('version', 'I'),  # compatibility version
+    ('flags', 'I'),  # setup and mode flags
+    ('hashOffset', 'I'),  # offset of hash slot element at index zero
+    ('identOffset', 'I'),  # offset of identifier string
+    ('nSpecialSlots', 'I'),  # number of special hash slots
+    ('nCodeSlots', 'I'),  # number of ordinary (code) hash slots
+    ('codeLimit', 'I'),  # limit to main image signature range
+    ('hashSize', 'B'),  # size of each hash in bytes
+    ('hashType', 'B'),  # type of hash (cdHashType* constants)
+    ('platform', 'B'),  # platform identifier; zero if not platform binary
+    ('pageSize', 'B'),  # log2(page size in bytes); 0 => infinite
+    ('spare2', 'I'),  # unused (must be zero)
+    ('scatterOffset', 'I'),  # version 0x20100: offset of optional scatter vector
+    ('teamOffset', 'I'),  # version 0x20200: offset of optional team identifier
+    ('spare3', 'I'),  # version 0x20300: unused (must be zero)
+    ('codeLimit64', 'Q'),  # version 0x20300: limit to main image signature range, 64 bits
+    ('execSegBase', 'Q'),  # version 0x20400: offset of executable segment
+    ('execSegLimit', 'Q'),  # version 0x20400: limit of executable segment
+    ('execSegFlags', 'Q'),  # version 0x20400: executable segment flags
+)
+
+CS_SUPPORTSSCATTER = 0x20100
+CS_SUPPORTSTEAMID = 0x20200
+CS_SUPPORTSCODELIMIT64 = 0x20300
+CS_SUPPORTSEXECSEG = 0x20400
+
+# hashType -> (hashlib constructor, size of the stored hash)
+HASH_TYPES = {
+    CSHashType.CS_HASHTYPE_SHA1.value: (hashlib.sha1, 20),
+    CSHashType.CS_HASHTYPE_SHA256.value: (hashlib.sha256, 32),
+    CSHashType.CS_HASHTYPE_SHA256_TRUNCATED.value: (hashlib.sha256, 20),
+    CSHashType.CS_HASHTYPE_SHA384.value: (hashlib.sha384, 48),
+}
+
+# pages hashed by one task of the thread pool
+PAGES_PER_TASK = 256
+
+_CODEDIRECTORY_SLOTS = frozenset([CSSlot.CSSLOT_CODEDIRECTORY.value] + list(range(
+    CSSlot.CSSLOT_ALTERNATE_CODEDIRECTORIES.value, CSSlot.CSSLOT_ALTERNATE_CODEDIRECTORIES.value + 5)))
+# special slots whose data lives outside of the image (in the bundle)
+_EXTERNAL_SLOTS = frozenset((CSSlot.CSSLOT_INFOSLOT.value, CSSlot.CSSLOT_RESOURCEDIR.value))
+
+
+def _hash_range(data, first, last, limit, page_size, hash_type):
+    new, size = HASH_TYPES[hash_type]
+    return [new(data[i * page_size:min((i + 1) * page_size, limit)]).digest()[:size]
+            for i in range(first, last)]
+
+
+def hash_pages(data, limit, page_size, hash_type, jobs=None):
+    """Return the hash of each page of data[:limit]
+
+    The last page may be short.  Pages are read straight from data (e.g. a
+    view of the mapped image) and hashed by up to jobs threads (default:
+    number of CPUs); hashlib releases the GIL for each page, so throughput
+    scales with the cores.
+    """
+    npages = (limit + page_size - 1) // page_size
+    jobs = jobs or os.cpu_count() or 1
+    if jobs < 2 or npages <= PAGES_PER_TASK:
+        return _hash_range(data, 0, npages, limit, page_size, hash_type)
+
+    ranges = [(first, min(first + PAGES_PER_TASK, npages))
+              for first in range(0, npages, PAGES_PER_TASK)]
+    with concurrent.futures.ThreadPoolExecutor(jobs) as executor:
+        tasks = [executor.submit(_hash_range, data, first, last, limit, page_size, hash_type)
+                 for first, last in ranges]
+        return [digest for task in tasks for digest in task.result()]
+
+
+class CodeDirectory(object):
+    """A CodeDirectory blob of a code signature"""
+
+    def __init__(self, data):
+        self._data = data
+        (magic, self._length, self._version, self._flags, self._hash_offset, self._ident_offset,
+         self._n_special_slots, self._n_code_slots, self._code_limit, self._hash_size,
+         self._hash_type, self._platform, self._page_size, _, self._scatter_offset,
+         self._team_offset, _, self._code_limit64, self._exec_seg_base, self._exec_seg_limit,
+         self._exec_seg_flags) = CS_CODEDIRECTORY.unpack_from(
+             4, _ORDER, bytes(data[:CS_CODEDIRECTORY.size(4)]).ljust(CS_CODEDIRECTORY.size(4), b'\0'))
+        if magic != CSMagic.CSMAGIC_CODEDIRECTORY.value:
+            raise ValueError(f'bad CodeDirectory magic {magic:#x}')
+        if self._version < CS_SUPPORTSSCATTER:
+            self._scatter_offset = 0
+        if self._version < CS_SUPPORTSTEAMID:
+            self._team_offset = 0
+        if self._version < CS_SUPPORTSCODELIMIT64:
+            self._code_limit64 = 0
+        if self._version < CS_SUPPORTSEXECSEG:
+            self._exec_seg_base = self._exec_seg_limit = self._exec_seg_flags = 0
+
+    def identifier(self):
+        end = self._ident_offset
+        while self._data[end]:
+            end += 1
+        return bytes(self._data[self._ident_offset:end]).decode()
+
+    def code_limit(self):
+        return self._code_limit64 or self._code_limit
+
+    def page_size(self):
+        return 1 << self._page_size if self._page_size else self.code_limit()
+
+    def is_adhoc(self):
+        return self._flags & CSFlag.CS_ADHOC.value != 0
+
+    def is_linker_signed(self):
+        return self._flags & CSFlag.CS_LINKER_SIGNED.value != 0
+
+    def code_hash(self, i):
+        """Return the stored hash of code page i"""
+        offset = self._hash_offset + i * self._hash_size
+        return bytes(self._data[offset:offset + self._hash_size])
+
+    def special_hash(self, slot):
+        """Return the stored hash of special slot (e.g. CSSLOT_REQUIREMENTS)"""
+        offset = self._hash_offset - slot * self._hash_size
+        return bytes(self._data[offset:offset + self._hash_size])
+
+    def code_hashes(self):
+        """Return the stored hashes of all code pages"""
+        return [self.code_hash(i) for i in range(self._n_code_slots)]
+
+    def cdhash(self):
+        """Return the hash of the whole CodeDirectory (truncated to 20 bytes)"""
+        new, size = HASH_TYPES[self._hash_type]
+        return new(self._data[:self._length]).digest()[:20]
+
+    def __repr__(self):
+        return '{' f'version: {self._version:#x}, flags: {self._flags:#x}, identifier: {self.identifier()}, nSpecialSlots: {self._n_special_slots}, nCodeSlots: {self._n_code_slots}, codeLimit: {self.code_limit()}, hashType: {self._hash_type}, pageSize: {self.page_size()}' '}'
+
+
+class CodeSignature(object):
+    """The SuperBlob of LC_CODE_SIGNATURE
+
+    Blobs are views into the signature data; nothing is copied.
+    """
+
+    def __init__(self, data):
+        self._data = data
+        magic, length, count = CS_SUPERBLOB.unpack_from(4, _ORDER, data)
+        if magic != CSMagic.CSMAGIC_EMBEDDED_SIGNATURE.value:
+            raise ValueError(f'bad code signature magic {magic:#x}')
+        self._blobs = dict()
+        offset = CS_SUPERBLOB.size(4)
+        for slot, blob_offset in CS_BLOBINDEX.iter_unpack(4, _ORDER, data, offset, count):
+            blob_length = CS_GENERICBLOB.unpack_from(4, _ORDER, data, blob_offset)[1]
+            self._blobs[slot] = data[blob_offset:blob_offset + blob_length]
+
+    def blobs(self):
+        """Return a dict of slot type -> blob"""
+        return self._blobs
+
+    def blob(self, slot):
+        return self._blobs.get(slot)
+
+    def code_directories(self):
+        """Return the CodeDirectory and any alternate ones"""
+        return [CodeDirectory(blob) for slot, blob in self._blobs.items() if slot in _CODEDIRECTORY_SLOTS]
+
+    def code_directory(self):
+        blob = self._blobs.get(CSSlot.CSSLOT_CODEDIRECTORY.value)
+        return None if blob is None else CodeDirectory(blob)
+
+    def verify(self, data, jobs=None):
+        """Check the hashes of every CodeDirectory against the image data
+
+        Returns a list of problems, one line each; an empty list means
+        every code page and embedded special slot matches.  No CMS
+        signature is checked.
+        """
+        problems = []
+        for cd in self.code_directories():
+            if cd._hash_type not in HASH_TYPES:
+                problems.append(f'unsupported hash type {cd._hash_type}')
+                continue
+            limit = cd.code_limit()
+            if limit > len(data):
+                problems.append(f'code limit {limit} is past the end of the image')
+                continue
+            hashes = hash_pages(data, limit, cd.page_size(), cd._hash_type, jobs)
+            if len(hashes) != cd._n_code_slots:
+                problems.append(f'{cd._n_code_slots} code slots for {len(hashes)} pages')
+            for i, (stored, actual) in enumerate(zip(cd.code_hashes(), hashes)):
+                if stored != actual:
+                    problems.append(f'page {i} (offset {i * cd.page_size():#x}) does not match')
+
+            new, size = HASH_TYPES[cd._hash_type]
+            for slot in range(1, cd._n_special_slots + 1):
+                if slot in _EXTERNAL_SLOTS:
+                    continue
+                blob = self._blobs.get(slot)
+                stored = cd.special_hash(slot)
+                actual = bytes(size) if blob is None else new(blob).digest()[:size]
+                if stored != actual:
+                    problems.append(f'special slot {slot} does not match')
+        return problems
+
+
+def _blob(magic, payload):
+    return CS_GENERICBLOB.compile(4, _ORDER).pack(magic, CS_GENERICBLOB.size(4) + len(payload)) + payload
+
+
+def empty_requirements():
+    """Return an empty Requirements blob, as codesign emits for ad-hoc signatures"""
+    return _blob(CSMagic.CSMAGIC_REQUIREMENTS.value, bytes(4))
+
+
+def adhoc_signature(data, code_limit, identifier, flags=CSFlag.CS_ADHOC.value,
+                    exec_seg=(0, 0, 0), requirements=True, page_size=4096,
+                    hash_type=CSHashType.CS_HASHTYPE_SHA256.value, jobs=None):
+    """Return an ad-hoc signature (a SuperBlob) of data[:code_limit]
+
+    exec_seg is the (base, limit, flags) of the executable segment.  With
+    requirements, an empty Requirements blob is included and hashed into
+    its special slot, as codesign does; linker-signed images (flags has
+    CS_LINKER_SIGNED) have only the CodeDirectory.
+    """
+    new, size = HASH_TYPES[hash_type]
+    blobs = []
+    if requirements:
+        blobs.append((CSSlot.CSSLOT_REQUIREMENTS.value, empty_requirements()))
+    n_special_slots = max([slot for slot, blob in blobs], default=0)
+    special = [bytes(size)] * n_special_slots
+    for slot, blob in blobs:
+        special[n_special_slots - slot] = new(blob).digest()[:size]
+
+    ident = identifier.encode() + b'\0'
+    hashes = hash_pages(data, code_limit, page_size, hash_type, jobs)
+    header_size = CS_CODEDIRECTORY.size(4)
+    hash_offset = header_size + len(ident) + n_special_slots * size
+    length = hash_offset + len(hashes) * size
+    header = CS_CODEDIRECTORY.compile(4, _ORDER).pack(
+        CSMagic.CSMAGIC_CODEDIRECTORY.value, length, CS_SUPPORTSEXECSEG, flags, hash_offset,
+        header_size, n_special_slots, len(hashes), code_limit if code_limit < 1 << 32 else 0,
+        size, hash_type, 0, page_size.bit_length() - 1, 0, 0, 0, 0,
+        code_limit if code_limit >= 1 << 32 else 0, *exec_seg)
+    blobs.insert(0, (CSSlot.CSSLOT_CODEDIRECTORY.value,
+                     header + ident + b''.join(special) + b''.join(hashes)))
+
+    offset = CS_SUPERBLOB.size(4) + len(blobs) * CS_BLOBINDEX.size(4)
+    index = b''
+    for slot, blob in blobs:
+        index += CS_BLOBINDEX.compile(4, _ORDER).pack(slot, offset)
+        offset += len(blob)
+    return CS_SUPERBLOB.compile(4, _ORDER).pack(
+        CSMagic.CSMAGIC_EMBEDDED_SIGNATURE.value, offset, len(blobs)) + index + b''.join(blob for slot, blob in blobs)
@@ -0,0 +1,61 @@
+# Copyright (c) 2021 Friedt Professional Engineering Services, Inc
+# SPDX-License-Identifier: MIT
+
+import bisect
+
+
+class AddressIndex(object):
+    """Sorted [start, end) address intervals searched with bisect
+
+    Empty intervals are dropped.  Lookups cost O(log n).
+    """
+
+    def __init__(self, intervals):
+        intervals = sorted((i for i in intervals if i[1] > i[0]),
+                           key=lambda i: i[0])
+        self._starts = [i[0] for i in intervals]
+        self._ends = [i[1] for i in intervals]
+        self._values = [i[2] for i in intervals]
+
+    def find(self, addr):
+        """Return the value of the interval containing addr, or None"""
+        i = bisect.bisect_right(self._starts, addr) - 1
+        if i < 0 or addr >= self._ends[i]:
+            return None
+        return self._values[i]
+
+    def __len__(self):
+        return len(self._starts)
+
+
+class SymbolIndex(object):
+    """Name and section-number indexes over a list of Symbol records
+
+    Symbols defined in a section are kept sorted by (n_sect, n_value), so
+    all symbols of one section are a contiguous slice; section_ranges maps
+    each 1-based section number to that slice.
+    """
+
+    def __init__(self, symbols):
+        self._by_name = dict()
+        defined = []
+        for sym in symbols:
+            self._by_name.setdefault(sym.name, []).append(sym)
+            if sym.is_defined():
+                defined.append(sym)
+        defined.sort(key=lambda sym: (sym.n_sect, sym.n_value))
+        self._defined = defined
+
+        self._section_ranges = dict()
+        start = 0
+        for i in range(1, len(defined) + 1):
+            if i == len(defined) or defined[i].n_sect != defined[start].n_sect:
+                self._section_ranges[defined[start].n_sect] = (start, i)
+                start = i
+
+    def named(self, name):
+        return self._by_name.get(name, [])
+
+    def in_section(self, n_sect):
+        start, stop = self._section_ranges.get(n_sect, (0, 0))
+        return self._defined[start:stop]
@@ -1,12 +1,15 @@
 # Copyright (c) 2021 Friedt Professional Engineering Services, Inc
 # SPDX-License-Identifier: MIT
 
-import io
+import array
+import collections.abc
+import sys
 
+from machotools import stats
 from machotools.enums import *
 from machotools.segments import *
+from machotools.stringtable import StringTable
 from machotools.structs import *
-from machotools.util import align_up
 
 # The load commands directly follow the mach_header.  The total size of all
 # of the commands is given by the sizeofcmds field in the mach_header.  All
@@ -25,57 +28,266 @@ from machotools.util import align_up
 # padding zeroed like objects will compare byte for byte.
 
 
+LOAD_COMMAND = StructLayout(
+    ('cmd', 'I'),  # type of load command
+    ('cmdsize', 'I'),  # total size of command in bytes
+)
+
+SYMTAB_COMMAND = StructLayout(
+    ('cmd', 'I'),  # LC_SYMTAB
+    ('cmdsize', 'I'),  # sizeof(struct symtab_command)
+    ('symoff', 'I'),  # symbol table offset
+    ('nsyms', 'I'),  # number of symbol table entries
+    ('stroff', 'I'),  # string table offset
+    ('strsize', 'I'),  # string table size in bytes
+)
+
+DYSYMTAB_COMMAND = StructLayout(
+    ('cmd', 'I'),  # LC_DYSYMTAB
+    ('cmdsize', 'I'),  # sizeof(struct dysymtab_command)
+    ('ilocalsym', 'I'),  # index to local symbols
+    ('nlocalsym', 'I'),  # number of local symbols
+    ('iextdefsym', 'I'),  # index to externally defined symbols
+    ('nextdefsym', 'I'),  # number of externally defined symbols
+    ('iundefsym', 'I'),  # index to undefined symbols
+    ('nundefsym', 'I'),  # number of undefined symbols
+    ('tocoff', 'I'),  # file offset to table of contents
+    ('ntoc', 'I'),  # number of entries in table of contents
+    ('modtaboff', 'I'),  # file offset to module table
+    ('nmodtab', 'I'),  # number of module table entries
+    ('extrefsymoff', 'I'),  # offset to referenced symbol table
+    ('nextrefsyms', 'I'),  # number of referenced symbol table entries
+    ('indirectsymoff', 'I'),  # file offset to the indirect symbol table
+    ('nindirectsyms', 'I'),  # number of indirect symbol table entries
+    ('extreloff', 'I'),  # offset to external relocation entries
+    ('nextrel', 'I'),  # number of external relocation entries
+    ('locreloff', 'I'),  # offset to local relocation entries
+    ('nlocrel', 'I'),  # number of local relocation entries
+)
+
+DYLD_INFO_COMMAND = StructLayout(
+    ('cmd', 'I'),  # LC_DYLD_INFO or LC_DYLD_INFO_ONLY
+    ('cmdsize', 'I'),  # sizeof(struct dyld_info_command)
+    ('rebase_off', 'I'),  # file offset to rebase info
+    ('rebase_size', 'I'),  # size of rebase info
+    ('bind_off', 'I'),  # file offset to binding info
+    ('bind_size', 'I'),  # size of binding info
+    ('weak_bind_off', 'I'),  # file offset to weak binding info
+    ('weak_bind_size', 'I'),  # size of weak binding info
+    ('lazy_bind_off', 'I'),  # file offset to lazy binding info
+    ('lazy_bind_size', 'I'),  # size of lazy binding info
+    ('export_off', 'I'),  # file offset to the exports trie
+    ('export_size', 'I'),  # size of the exports trie
+)
+
+# indirect symbol table entries that do not refer to a symbol
+INDIRECT_SYMBOL_LOCAL = 0x80000000
+INDIRECT_SYMBOL_ABS = 0x40000000
+
+LINKEDIT_DATA_COMMAND = StructLayout(
+    ('cmd', 'I'),  # LC_CODE_SIGNATURE, LC_FUNCTION_STARTS, ...
+    ('cmdsize', 'I'),  # sizeof(struct linkedit_data_command)
+    ('dataoff', 'I'),  # file offset of data in __LINKEDIT segment
+    ('datasize', 'I'),  # file size of data in __LINKEDIT segment
+)
+
+# load commands that are a linkedit_data_command
+LINKEDIT_DATA_COMMANDS = frozenset((
+    LCCommand.LC_CODE_SIGNATURE,
+    LCCommand.LC_SEGMENT_SPLIT_INFO,
+    LCCommand.LC_FUNCTION_STARTS,
+    LCCommand.LC_DATA_IN_CODE,
+    LCCommand.LC_DYLIB_CODE_SIGN_DRS,
+    LCCommand.LC_LINKER_OPTIMIZATION_HINT,
+    LCCommand.LC_DYLD_EXPORTS_TRIE,
+    LCCommand.LC_DYLD_CHAINED_FIXUPS,
+))
+
+
 class LCGeneric(object):
-    def __init__(self, cmd, file, order):
+    def __init__(self, cmd, data, offset, order):
         self._cmd = cmd
-        self._cmdsize = int.from_bytes(file.read(4), order)
-        file.seek(self._cmdsize - 8, io.SEEK_CUR)
+        _, self._cmdsize = LOAD_COMMAND.unpack_from(4, order, data, offset)
 
     def __repr__(self):
         return '{' f'cmd: {self._cmd}, cmdsize: {self._cmdsize}' '}'
 
 
 class LCSymTab(object):
-    def __init__(self, file, order, n):
+    def __init__(self, data, offset, order, n):
         self._cmd = LCCommand.LC_SYMTAB
-        self._cmdsize = int.from_bytes(file.read(4), order)
-        self._symoff = int.from_bytes(file.read(4), order)
-        self._nsyms = int.from_bytes(file.read(4), order)
-        self._stroff = int.from_bytes(file.read(4), order)
-        self._strsize = int.from_bytes(file.read(4), order)
-        # parse symbol table and then return to original offset
-        origin = file.tell()
-        offset = self._symoff
-        file.seek(offset, io.SEEK_SET)
-        values = set()
-        symtab = []
-        strtab = dict()
-        for i in range(0, self._nsyms):
-            sym = NList(file, order, self._stroff) if n == 4 else NList64(
-                file, order, self._stroff)
-            if sym._n_value in values:
-                continue
-            values.add(sym._n_value)
-            symtab.append(sym)
-            strtab[self._stroff + sym._n_strx] = sym._n_name
-        file.seek(origin, io.SEEK_SET)
-        self._symtab = symtab
-        self._strtab = strtab
+        (_, self._cmdsize, self._symoff, self._nsyms, self._stroff,
+         self._strsize) = SYMTAB_COMMAND.unpack_from(n, order, data, offset)
+        # the symbol table itself is only decoded on first access
+        self._data = data
+        self._order = order
+        self._n = n
+        self._strings_cache = None
+        self._symtab_cache = None
+        self._strtab_cache = None
+
+    @property
+    def _strings(self):
+        if self._strings_cache is None:
+            self._strings_cache = StringTable(
+                self._data[self._stroff:self._stroff + self._strsize])
+        return self._strings_cache
+
+    @property
+    def _symtab(self):
+        if self._symtab_cache is None:
+            self._parse_symtab()
+        return self._symtab_cache
+
+    @property
+    def _strtab(self):
+        if self._strtab_cache is None:
+            self._parse_symtab()
+        return self._strtab_cache
+
+    def _parse_symtab(self):
+        # load the string table once and decode the whole nlist array in one pass
+        with stats.timed('symtab'):
+            strings = self._strings
+            nlist = NList if self._n == 4 else NList64
+            values = set()
+            symtab = []
+            strtab = dict()
+            for fields in NLIST.iter_unpack(self._n, self._order, self._data, self._symoff, self._nsyms):
+                sym = nlist(fields, strings)
+                if sym._n_value in values:
+                    continue
+                values.add(sym._n_value)
+                symtab.append(sym)
+                strtab[self._stroff + sym._n_strx] = sym._n_name
+            self._symtab_cache = symtab
+            self._strtab_cache = strtab
+            stats.count('symtab', nbytes=self._nsyms * NLIST.size(self._n), objects=len(symtab))
 
     def __repr__(self):
         return '{' f'cmd: {self._cmd}, cmdsize: {self._cmdsize} symoff: {self._symoff:08x} nsyms: {self._nsyms} stroff: {self._stroff:08x} strsize: {self._strsize}' '}'
 
 
+class LCDysymTab(object):
+    """LC_DYSYMTAB: the symbol table split into local, defined external and
+    undefined groups, each a contiguous range of symbol indexes"""
+
+    def __init__(self, data, offset, order):
+        self._cmd = LCCommand.LC_DYSYMTAB
+        (_, self._cmdsize, self._ilocalsym, self._nlocalsym, self._iextdefsym,
+         self._nextdefsym, self._iundefsym, self._nundefsym, self._tocoff, self._ntoc,
+         self._modtaboff, self._nmodtab, self._extrefsymoff, self._nextrefsyms,
+         self._indirectsymoff, self._nindirectsyms, self._extreloff, self._nextrel,
+         self._locreloff, self._nlocrel) = DYSYMTAB_COMMAND.unpack_from(4, order, data, offset)
+        self._data = data
+        self._order = order
+
+    def local_symbols(self):
+        return range(self._ilocalsym, self._ilocalsym + self._nlocalsym)
+
+    def extdef_symbols(self):
+        return range(self._iextdefsym, self._iextdefsym + self._nextdefsym)
+
+    def undef_symbols(self):
+        return range(self._iundefsym, self._iundefsym + self._nundefsym)
+
+    def indirect_symbols(self):
+        """Return the indirect symbol table as an array of symbol indexes
+
+        Entries may also be INDIRECT_SYMBOL_LOCAL and / or INDIRECT_SYMBOL_ABS.
+        """
+        table = array.array('I')
+        table.frombytes(self._data[self._indirectsymoff:
+                                   self._indirectsymoff + 4 * self._nindirectsyms])
+        if self._order != sys.byteorder:
+            table.byteswap()
+        return table
+
+    def __repr__(self):
+        return '{' f'cmd: {self._cmd}, cmdsize: {self._cmdsize}, ilocalsym: {self._ilocalsym}, nlocalsym: {self._nlocalsym}, iextdefsym: {self._iextdefsym}, nextdefsym: {self._nextdefsym}, iundefsym: {self._iundefsym}, nundefsym: {self._nundefsym}, indirectsymoff: {self._indirectsymoff:08x}, nindirectsyms: {self._nindirectsyms}' '}'
+
+
+class LCDyldInfo(object):
+    def __init__(self, cmd, data, offset, order):
+        self._cmd = cmd
+        (_, self._cmdsize, self._rebase_off, self._rebase_size, self._bind_off, self._bind_size,
+         self._weak_bind_off, self._weak_bind_size, self._lazy_bind_off, self._lazy_bind_size,
+         self._export_off, self._export_size) = DYLD_INFO_COMMAND.unpack_from(4, order, data, offset)
+
+    def __repr__(self):
+        return '{' f'cmd: {self._cmd}, cmdsize: {self._cmdsize}, rebase_off: {self._rebase_off:08x}, rebase_size: {self._rebase_size}, bind_off: {self._bind_off:08x}, bind_size: {self._bind_size}, weak_bind_off: {self._weak_bind_off:08x}, weak_bind_size: {self._weak_bind_size}, lazy_bind_off: {self._lazy_bind_off:08x}, lazy_bind_size: {self._lazy_bind_size}, export_off: {self._export_off:08x}, export_size: {self._export_size}' '}'
+
+
+class LCLinkEditData(object):
+    def __init__(self, cmd, data, offset, order):
+        self._cmd = cmd
+        (_, self._cmdsize, self._dataoff, self._datasize) = LINKEDIT_DATA_COMMAND.unpack_from(
+            4, order, data, offset)
+
+    def __repr__(self):
+        return '{' f'cmd: {self._cmd}, cmdsize: {self._cmdsize}, dataoff: {self._dataoff:08x}, datasize: {self._datasize}' '}'
+
+
 class LoadCommand(object):
     # @staticmethod
-    def parse(file, order, n):
-        cmd = LCCommand(int.from_bytes(file.read(4), order))
+    def parse(data, offset, order, n):
+        cmd = LCCommand(LOAD_COMMAND.unpack_from(n, order, data, offset)[0])
 
         if cmd == LCCommand.LC_SEGMENT:
-            return LCSegment(file, order)
+            return LCSegment(data, offset, order)
         if cmd == LCCommand.LC_SEGMENT_64:
-            return LCSegment64(file, order)
+            return LCSegment64(data, offset, order)
         if cmd == LCCommand.LC_SYMTAB:
-            return LCSymTab(file, order, n)
+            return LCSymTab(data, offset, order, n)
+        if cmd == LCCommand.LC_DYSYMTAB:
+            return LCDysymTab(data, offset, order)
+        if cmd in (LCCommand.LC_DYLD_INFO, LCCommand.LC_DYLD_INFO_ONLY):
+            return LCDyldInfo(cmd, data, offset, order)
+        if cmd in LINKEDIT_DATA_COMMANDS:
+            return LCLinkEditData(cmd, data, offset, order)
+
+        return LCGeneric(cmd, data, offset, order)
 
-        return LCGeneric(cmd, file, order)
+
+class LoadCommandMap(collections.abc.Mapping):
+    """Load commands keyed by file offset, decoded on first access
+
+    Only the cmd / cmdsize header of each command is read up front; the
+    body of a command is decoded (and cached) the first time it is looked
+    up.  commands() iterates the commands of given types without decoding
+    any of the others.
+    """
+
+    def __init__(self, data, order, n, headers):
+        self._data = data
+        self._order = order
+        self._n = n
+        self._headers = headers
+        self._decoded = dict()
+
+    def __getitem__(self, offset):
+        lc = self._decoded.get(offset)
+        if lc is None:
+            if offset not in self._headers:
+                raise KeyError(offset)
+            lc = LoadCommand.parse(self._data, offset, self._order, self._n)
+            self._decoded[offset] = lc
+            stats.count('load_commands', objects=1)
+        return lc
+
+    def __iter__(self):
+        return iter(self._headers)
+
+    def __len__(self):
+        return len(self._headers)
+
+    def cmd(self, offset):
+        return self._headers[offset]
+
+    def commands(self, *cmds):
+        for offset, cmd in self._headers.items():
+            if cmd in cmds:
+                yield offset, self[offset]
+
+    def __repr__(self):
+        return repr(dict(self.items()))
@@ -2,68 +2,477 @@
 # SPDX-License-Identifier: MIT
 
 import collections
-import io
+import mmap
+import uuid
 
+from machotools import stats
 from machotools.enums import *
+from machotools.exports import ExportsTrie
+from machotools.fixups import ChainedFixups
+from machotools.functionstarts import FunctionStarts, decode_function_starts
+from machotools.hash import CodeSignature
+from machotools.index import AddressIndex, SymbolIndex
+from machotools.machomap import MachoMap
+from machotools.relocation import Relocations
 from machotools.structs import MachHeader
-from machotools.loadcommand import LoadCommand
+from machotools.loadcommand import LOAD_COMMAND, LoadCommandMap
+from machotools.stringtable import StringTable
+from machotools.structs import NLIST
+from machotools.symbols import Symbol, SymbolColumns
 from machotools.util import align_up
 
 
 class MachOFile(object):
-    def __init__(self, input_file_name=None):
+    """A parsed Mach-O image
+
+    The file is mapped into memory once and every structure is decoded
+    directly from offsets into that mapping, so parsing costs no read() or
+    seek() calls.  With use_mmap=False the file is instead read into memory
+    with a single read(), which also works for pipes and other special files.
+
+    With lazy=True only the header of each load command is scanned up front
+    and command bodies are decoded on first access.  The symbol table is
+    always decoded on first access.
+
+    offset and size select a Mach-O image embedded in a larger file, such
+    as one slice of a universal binary or an archive member.  All offsets
+    stored in the image are relative to its start.
+    """
+
+    def __init__(self, input_file_name=None, use_mmap=True, lazy=False, offset=0, size=None):
+        self._buf = None
+        self._data = None
+        self._offset = 0
         self._sections = None
         self._symtab = None
         self._strtab = None
+        self._columns = None
+        self._strings = None
+        self._strings_preloaded = False
+        self._file_strings = None
         self._text = None
+        self._section_map = None
+        self._section_index = None
+        self._segment_index = None
+        self._symbol_index = None
+        self._fixups = None
+        self._exports = None
+        self._function_starts = None
+        self._relocations = dict()
+        self._code_signature = None
+        self._macho_map = None
         if input_file_name:
-            self.parse(input_file_name)
+            self.parse(input_file_name, use_mmap, lazy, offset, size)
 
-    def parse(self, input_file_name):
-        with open(input_file_name, 'rb') as f:
-            self._header = MachHeader(f)
-            align = self._header.align()
-            pad = align_up(f.tell(), align) - f.tell()
-            f.seek(pad, io.SEEK_CUR)
+    @staticmethod
+    def _map(f, use_mmap):
+        if use_mmap:
+            try:
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, OSError):
+                # empty files and non-regular files cannot be mapped
+                pass
+        return f.read()
 
-            lcs = dict()
-            n = 8 if self._header.is_64() else 4
+    def parse(self, input_file_name, use_mmap=True, lazy=False, offset=0, size=None):
+        self.close()
+        with stats.timed('map'), open(input_file_name, 'rb') as f:
+            self._buf = self._map(f, use_mmap)
+            if not isinstance(self._buf, mmap.mmap):
+                stats.count('map', nbytes=len(self._buf), reads=1)
+        whole = memoryview(self._buf)
+        end = len(whole) if size is None else offset + size
+        self._data = whole[offset:end]
+        self._offset = offset
+        whole.release()
+
+        data = self._data
+        with stats.timed('header'):
+            self._header = MachHeader(data)
+            stats.count('header', nbytes=self._header.size(), objects=1)
+        align = self._header.align()
+        offset = align_up(self._header.size(), align)
+
+        with stats.timed('load_commands'):
+            headers = dict()
+            order = self._header.order()
             for i in range(0, self._header._ncmds):
-                offset = f.tell()
-                lc = LoadCommand.parse(f, self._header.order(), n)
-                lcs[offset] = lc
-                offset = f.tell()
-                pad = align_up(offset, align) - offset
-                f.seek(pad, io.SEEK_CUR)
+                cmd, cmdsize = LOAD_COMMAND.unpack_from(4, order, data, offset)
+                headers[offset] = LCCommand(cmd)
+                offset = align_up(offset + cmdsize, align)
+            stats.count('load_commands', nbytes=self._header._sizeofcmds)
+
+            n = 8 if self._header.is_64() else 4
+            self._load_commands = LoadCommandMap(data, order, n, headers)
+            if not lazy:
+                for offset in headers:
+                    self._load_commands[offset]
+
+    def close(self):
+        """Release the mapping backing this file
+
+        Any views previously returned by section_data() or segment_data()
+        must be released before calling close().
+        """
+        self._columns = None
+        self._strings = None
+        self._strings_preloaded = False
+        self._fixups = None
+        self._exports = None
+        self._function_starts = None
+        self._relocations = dict()
+        self._code_signature = None
+        self._macho_map = None
+        if self._data is not None:
+            self._data.release()
+            self._data = None
+        if isinstance(self._buf, mmap.mmap):
+            self._buf.close()
+        self._buf = None
+        self._file_strings = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def data(self):
+        """Return a zero-copy view of the whole file"""
+        return self._data
+
+    def commands_data(self):
+        """Return a zero-copy view of the header and all load commands"""
+        return self._data[:self._header.size() + self._header._sizeofcmds]
 
-            self._load_commands = lcs
+    def section_data(self, sect):
+        """Return a zero-copy view of the contents of a section"""
+        if sect.is_zerofill():
+            return memoryview(bytes(sect._size))
+        return self._data[sect._offset:sect._offset + sect._size]
+
+    def segment_data(self, seg):
+        """Return a zero-copy view of the file contents of a segment"""
+        return self._data[seg._fileoff:seg._fileoff + seg._filesize]
 
     def sections(self):
         if not self._sections:
             self._sections = []
-            for offset, lc in self._load_commands.items():
-                if not (lc._cmd == LCCommand.LC_SEGMENT or lc._cmd == LCCommand.LC_SEGMENT_64):
-                    continue
+            for offset, lc in self._load_commands.commands(LCCommand.LC_SEGMENT, LCCommand.LC_SEGMENT_64):
                 for s in lc._sects.values():
                     self._sections.append(s)
         return self._sections
 
+    def segments(self):
+        return [lc for offset, lc in self._load_commands.commands(LCCommand.LC_SEGMENT, LCCommand.LC_SEGMENT_64)]
+
+    def section_map(self):
+        """Return a dict mapping (segname, sectname) to each section"""
+        if self._section_map is None:
+            self._section_map = {
+                (s._segname, s._sectname): s for s in self.sections()}
+        return self._section_map
+
+    def section_number(self, segname, sectname):
+        """Return the 1-based section number (n_sect) of a section, or None"""
+        sect = self.section_map().get((segname, sectname))
+        if sect is None:
+            return None
+        return self.sections().index(sect) + 1
+
+    def section_at(self, addr):
+        """Return the section containing the virtual address addr, or None"""
+        if self._section_index is None:
+            self._section_index = AddressIndex(
+                (s._addr, s._addr + s._size, s) for s in self.sections())
+        return self._section_index.find(addr)
+
+    def segment_at(self, addr):
+        """Return the segment containing the virtual address addr, or None"""
+        if self._segment_index is None:
+            self._segment_index = AddressIndex(
+                (seg._vmaddr, seg._vmaddr + seg._vmsize, seg) for seg in self.segments())
+        return self._segment_index.find(addr)
+
+    def symbol_index(self):
+        """Return the SymbolIndex, built from one pass over the symbol table"""
+        if self._symbol_index is None:
+            self._symbol_index = SymbolIndex(self.iter_symbols())
+        return self._symbol_index
+
+    def symbols_named(self, name):
+        """Return all symbols with the given name"""
+        return self.symbol_index().named(name)
+
+    def symbols_in_section(self, segname, sectname):
+        """Return the symbols defined in a section, sorted by address"""
+        n_sect = self.section_number(segname, sectname)
+        if n_sect is None:
+            return []
+        return self.symbol_index().in_section(n_sect)
+
+    def base_address(self):
+        """Return the vmaddr of the mach header (the start of __TEXT)"""
+        for seg in self.segments():
+            if seg._fileoff == 0 and seg._filesize:
+                return seg._vmaddr
+        return 0
+
+    def is_object(self) -> bool:
+        return self._header._filetype == MHFiletype.MH_OBJECT
+
+    def file_offset(self, addr):
+        """Return the file offset of the virtual address addr, or None"""
+        if self.is_object():
+            # the sections of an object file need not be laid out in the
+            # file as in its one segment
+            sect = self.section_at(addr)
+            if sect is None or sect.is_zerofill():
+                return None
+            return sect._offset + addr - sect._addr
+        seg = self.segment_at(addr)
+        if seg is None or addr - seg._vmaddr >= seg._filesize:
+            return None
+        return seg._fileoff + addr - seg._vmaddr
+
+    def read_word(self, addr):
+        """Return the raw target word (uint32_t / uint64_t) stored at addr"""
+        offset = self.file_offset(addr)
+        if offset is None:
+            raise ValueError(f'address {addr:#x} is not backed by file data')
+        n = 8 if self.is_64() else 4
+        return int.from_bytes(self._data[offset:offset + n], self.order())
+
+    def read_pointer(self, addr):
+        """Return the pointer stored at addr, with chained fixups applied
+
+        A rebased pointer resolves to its (unslid) target vmaddr with a dict
+        lookup.  Pointers bound to an imported symbol resolve to None.
+        In object files the relocations of the section are applied instead
+        (see Relocations.resolve()).  Otherwise the raw word is returned.
+        """
+        fixups = self.chained_fixups()
+        if fixups is not None:
+            return fixups.resolve((addr,), (self.read_word(addr),))[0]
+        if self.is_object():
+            sect = self.section_at(addr)
+            if sect is not None and sect._nreloc:
+                return self.relocations(sect).resolve((addr,), (self.read_word(addr),))[0]
+        return self.read_word(addr)
+
+    def cstring_at(self, addr):
+        """Return the C string at the virtual address addr"""
+        offset = self.file_offset(addr)
+        if offset is None:
+            raise ValueError(f'address {addr:#x} is not backed by file data')
+        return self.file_strings().get(offset)
+
+    def exports_trie(self):
+        """Return the ExportsTrie of LC_DYLD_EXPORTS_TRIE or LC_DYLD_INFO(_ONLY), or None"""
+        if self._exports is None:
+            lc = self.command(LCCommand.LC_DYLD_EXPORTS_TRIE)
+            if lc:
+                offset, size = lc._dataoff, lc._datasize
+            else:
+                lc = self.command(LCCommand.LC_DYLD_INFO_ONLY) or self.command(
+                    LCCommand.LC_DYLD_INFO)
+                if not lc:
+                    return None
+                offset, size = lc._export_off, lc._export_size
+            self._exports = ExportsTrie(self._data[offset:offset + size])
+        return self._exports
+
+    def function_starts(self):
+        """Return the FunctionStarts index of LC_FUNCTION_STARTS, or None"""
+        if self._function_starts is None:
+            lc = self.command(LCCommand.LC_FUNCTION_STARTS)
+            if not lc:
+                return None
+            starts = decode_function_starts(
+                self._data[lc._dataoff:lc._dataoff + lc._datasize], self.base_address())
+            # the last function extends to the end of its section
+            end = 0
+            if len(starts):
+                sect = self.section_at(int(starts[-1]))
+                end = sect._addr + sect._size if sect else int(starts[-1])
+            self._function_starts = FunctionStarts(starts, end)
+        return self._function_starts
+
+    def relocations(self, sect):
+        """Return the Relocations of a section (see sections())"""
+        key = (sect._segname, sect._sectname)
+        if key not in self._relocations:
+            self._relocations[key] = Relocations(self, sect)
+        return self._relocations[key]
+
+    def code_signature(self):
+        """Return the CodeSignature of LC_CODE_SIGNATURE, or None"""
+        if self._code_signature is None:
+            lc = self.command(LCCommand.LC_CODE_SIGNATURE)
+            if not lc:
+                return None
+            self._code_signature = CodeSignature(
+                self._data[lc._dataoff:lc._dataoff + lc._datasize])
+        return self._code_signature
+
+    def verify_code_signature(self, jobs=None):
+        """Check the code signature against the image, see CodeSignature.verify()"""
+        signature = self.code_signature()
+        if signature is None:
+            return ['image is not signed']
+        return signature.verify(self._data, jobs)
+
+    def chained_fixups(self):
+        """Return the ChainedFixups of the image, or None"""
+        if self._fixups is None:
+            lc = self.command(LCCommand.LC_DYLD_CHAINED_FIXUPS)
+            if lc:
+                self._fixups = ChainedFixups(self, lc)
+        return self._fixups
+
+    def macho_map(self):
+        """Return the MachoMap of the z_macho_map section"""
+        if self._macho_map is None:
+            self._macho_map = MachoMap(self)
+        return self._macho_map
+
+    def preload_macho_map(self, names, addrs, sizes):
+        """Seed macho_map() with an already decoded table, e.g. from a ParseCache"""
+        self._macho_map = MachoMap(self, columns=(names, addrs, sizes))
+
+    def command(self, cmd):
+        """Return the first load command of type cmd, or None"""
+        for offset, lc in self._load_commands.commands(cmd):
+            return lc
+        return None
+
     def symtab(self):
         if not self._symtab:
-            for offset, lc in self._load_commands.items():
-                if lc._cmd == LCCommand.LC_SYMTAB:
-                    self._symtab = lc._symtab
-                    break
+            lc = self.command(LCCommand.LC_SYMTAB)
+            if lc:
+                self._symtab = lc._symtab
         return self._symtab
 
     def strtab(self):
         if not self._strtab:
-            for offset, lc in self._load_commands.items():
-                if lc._cmd == LCCommand.LC_SYMTAB:
-                    self._strtab = lc._strtab
-                    break
+            lc = self.command(LCCommand.LC_SYMTAB)
+            if lc:
+                self._strtab = lc._strtab
         return self._strtab
 
+    def dysymtab(self):
+        """Return the LC_DYSYMTAB command, or None"""
+        return self.command(LCCommand.LC_DYSYMTAB)
+
+    def local_symbol_range(self):
+        """Return the range of local symbol indexes, or None without LC_DYSYMTAB"""
+        lc = self.dysymtab()
+        return lc.local_symbols() if lc else None
+
+    def extdef_symbol_range(self):
+        """Return the range of defined external symbol indexes, or None"""
+        lc = self.dysymtab()
+        return lc.extdef_symbols() if lc else None
+
+    def undef_symbol_range(self):
+        """Return the range of undefined symbol indexes, or None"""
+        lc = self.dysymtab()
+        return lc.undef_symbols() if lc else None
+
+    def indirect_symbols(self):
+        """Return the indirect symbol table (see LCDysymTab), or None"""
+        lc = self.dysymtab()
+        return lc.indirect_symbols() if lc else None
+
+    def iter_symbols(self, filter=None, symbols=None):
+        """Stream the symbol table as Symbol records
+
+        The nlist array is decoded incrementally straight from the mapping
+        and names are resolved without memoization, so memory stays bounded
+        regardless of the number of symbols (unless names were preloaded,
+        see preload_strings()).  Unlike symtab(), entries are
+        not de-duplicated by value.  If given, filter is called with each
+        Symbol and only records for which it returns True are yielded.
+        symbols is a range of symbol indexes (e.g. extdef_symbol_range())
+        to decode instead of the whole table.
+        """
+        lc = self.command(LCCommand.LC_SYMTAB)
+        if not lc:
+            return
+        if self._strings_preloaded:
+            strings = self.string_table()
+        else:
+            strings = StringTable(self._buf, self._offset + lc._stroff,
+                                  lc._strsize, memoize=False)
+        n = 8 if self.is_64() else 4
+        start, count = 0, lc._nsyms
+        if symbols is not None:
+            start = min(symbols.start, lc._nsyms)
+            count = min(symbols.stop, lc._nsyms) - start
+        stats.count('symtab', nbytes=count * NLIST.size(n), objects=count)
+        for n_strx, n_type, n_sect, n_desc, n_value in NLIST.iter_unpack(
+                n, self.order(), self._data, lc._symoff + start * NLIST.size(n), count):
+            sym = Symbol(strings.get(n_strx), n_type, n_sect, n_desc, n_value)
+            if filter is None or filter(sym):
+                yield sym
+
+    def symbol(self, index):
+        """Return the Symbol at index in the symbol table, or None"""
+        return next(self.iter_symbols(symbols=range(index, index + 1)), None)
+
+    def symbol_columns(self, symbols=None):
+        """Return the symbol table as NumPy-backed SymbolColumns
+
+        With symbols, a range of symbol indexes, only those entries are
+        returned (as a view of the same memory).  Raises ImportError if
+        numpy is not installed.
+        """
+        if self._columns is None:
+            lc = self.command(LCCommand.LC_SYMTAB)
+            if lc:
+                n = 8 if self.is_64() else 4
+                with stats.timed('symtab'):
+                    self._columns = SymbolColumns(
+                        self._data, lc._symoff, lc._nsyms, n, self.order(), lc._strings)
+                stats.count('symtab', nbytes=lc._nsyms * NLIST.size(n), objects=1)
+        if symbols is not None and self._columns is not None:
+            return self._columns.slice(symbols.start, symbols.stop)
+        return self._columns
+
+    def string_table(self):
+        """Return the StringTable of the LC_SYMTAB string table"""
+        if self._strings is None:
+            lc = self.command(LCCommand.LC_SYMTAB)
+            if lc:
+                self._strings = lc._strings
+        return self._strings
+
+    def preload_strings(self, offsets, names):
+        """Seed the symbol string table with already decoded names
+
+        offsets are string table indexes (n_strx) and names the matching
+        strings (see StringTable.preload()), e.g. as loaded from a
+        ParseCache.  Symbol names are then
+        resolved with a dict lookup rather than decoded from the file.
+        """
+        strings = self.string_table()
+        if strings is not None:
+            strings.preload(offsets, names)
+            self._strings_preloaded = True
+
+    def file_strings(self):
+        """Return a StringTable resolving C strings by file offset"""
+        if self._file_strings is None:
+            self._file_strings = StringTable(
+                self._buf, self._offset, len(self._data))
+        return self._file_strings
+
+    def uuid(self):
+        """Return the LC_UUID of the image as a uuid.UUID, or None"""
+        for offset, lc in self._load_commands.commands(LCCommand.LC_UUID):
+            return uuid.UUID(bytes=bytes(self._data[offset + 8:offset + 24]))
+        return None
+
     def is_64(self) -> bool:
         return self._header.is_64()
 
@@ -72,8 +481,8 @@ class MachOFile(object):
 
     def get_text_segment(self):
         if not self._text:
-            for offset, lc in self._load_commands.items():
-                if lc._cmd == LCCommand.LC_SEGMENT_64 and lc._segname == '__TEXT':
+            for offset, lc in self._load_commands.commands(LCCommand.LC_SEGMENT_64):
+                if lc._segname == '__TEXT':
                     self._text = lc
                     break
 
@@ -0,0 +1,128 @@
+# Copyright (c) 2021 Friedt Professional Engineering Services, Inc
+# SPDX-License-Identifier: MIT
+
+import array
+import collections
+import sys
+
+from machotools.constants import *
+from machotools.symbols import np
+
+MachoMapEntry = collections.namedtuple(
+    'MachoMapEntry', ['name', 'addr', 'size'])
+
+
+def group_entries(names, sizes):
+    """Return a dict of name -> (count, size), in order of first appearance
+
+    Raises ValueError if entries with the same name differ in size.
+    """
+    groups = dict()
+    for name, size in zip(names, sizes):
+        group = groups.get(name)
+        if group is None:
+            groups[name] = (1, size)
+        elif group[1] != size:
+            raise ValueError(
+                f'{name}: entry size {size} differs from {group[1]}')
+        else:
+            groups[name] = (group[0] + 1, size)
+    return groups
+
+
+class MachoMap(object):
+    """The z_macho_map section decoded as a table
+
+    Each entry is a struct z_macho_map { const char *name; void *addr;
+    size_t size; }.  The whole section is sliced out of the mapped image
+    once and viewed as an (N, 3) array of target words (a NumPy array, or
+    an array.array with numpy missing), in the byte order and word size of
+    the image.  The name and addr columns are resolved through the chained
+    fixups (or, in an object file, the relocations of the section) in one
+    pass, and each distinct name pointer is read from the file strings
+    only once.
+
+    columns, the (names, addrs, sizes) lists of an already decoded table
+    (e.g. from a ParseCache), are used instead of decoding the section.
+    """
+
+    def __init__(self, mf, segname=MACHO_MAP_SEGMENT, sectname=MACHO_MAP_SECTION, columns=None):
+        self._mf = mf
+        self._segname = segname
+        self._sectname = sectname
+        self._sect = None
+        self._names = []
+        self._addrs = []
+        self._sizes = []
+        if columns is not None:
+            self._names, self._addrs, self._sizes = columns
+            return
+        self._sect = mf.section_map().get((segname, sectname))
+        if self._sect is not None:
+            self._decode()
+
+    def _columns(self, data, n, count):
+        order = self._mf.order()
+        if np is not None:
+            dtype = np.dtype(('<' if order == 'little' else '>') +
+                             ('u8' if n == 8 else 'u4'))
+            table = np.frombuffer(data, dtype=dtype,
+                                  count=3 * count).reshape(count, 3)
+            return table[:, 0].tolist(), table[:, 1].tolist(), table[:, 2].tolist()
+
+        table = array.array('Q' if n == 8 else 'I')
+        table.frombytes(data[:3 * n * count])
+        if order != sys.byteorder:
+            table.byteswap()
+        return table[0::3].tolist(), table[1::3].tolist(), table[2::3].tolist()
+
+    def _decode(self):
+        mf = self._mf
+        sect = self._sect
+        n = 8 if mf.is_64() else 4
+        count = sect._size // (3 * n)
+        names, addrs, self._sizes = self._columns(
+            mf.section_data(sect), n, count)
+
+        fixups = mf.chained_fixups()
+        if fixups is None and mf.is_object() and sect._nreloc:
+            fixups = mf.relocations(sect)
+        if fixups is not None:
+            stride = 3 * n
+            entries = range(sect._addr, sect._addr + count * stride, stride)
+            names = fixups.resolve(entries, names)
+            addrs = fixups.resolve(range(sect._addr + n, sect._addr + n + count * stride, stride),
+                                   addrs)
+
+        strings = dict()
+        for namep in set(names):
+            strings[namep] = None if namep is None else mf.cstring_at(namep)
+        self._names = [strings[namep] for namep in names]
+        self._addrs = addrs
+
+    def section(self):
+        if self._sect is None:
+            self._sect = self._mf.section_map().get((self._segname, self._sectname))
+        return self._sect
+
+    def names(self):
+        return self._names
+
+    def addrs(self):
+        return self._addrs
+
+    def sizes(self):
+        return self._sizes
+
+    def groups(self):
+        """Return a dict of name -> (count, size), see group_entries()"""
+        return group_entries(self._names, self._sizes)
+
+    def __getitem__(self, i):
+        return MachoMapEntry(self._names[i], self._addrs[i], self._sizes[i])
+
+    def __iter__(self):
+        return map(MachoMapEntry, self._names, self._addrs, self._sizes)
+
+    def __len__(self):
+        return len(self._names)
@@ -0,0 +1,215 @@
+# Copyright (c) 2021 Friedt Professional Engineering Services, Inc
+# SPDX-License-Identifier: MIT
+
+import fcntl
+import mmap
+import os
+import shutil
+
+from machotools.enums import *
+from machotools.hash import adhoc_signature
+from machotools.machofile import MachOFile
+from machotools.sections import SECTION
+from machotools.segments import SEGMENT_COMMAND
+
+# ioctl(dest_fd, FICLONE, src_fd) shares all extents of src (Linux)
+FICLONE = 0x40049409
+
+
+def clone_file(src, dst):
+    """Copy src to dst, sharing storage with src where possible
+
+    A reflink (FICLONE) is tried first, then os.copy_file_range(), which
+    the kernel may turn into a reflink or an in-kernel copy, and finally
+    shutil.copyfile() (fcopyfile() on macOS, sendfile() on Linux).  The
+    permission bits of src are copied as well.
+    """
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        cloned = _clone(fsrc, fdst)
+    if not cloned:
+        shutil.copyfile(src, dst)
+    shutil.copymode(src, dst)
+
+
+def _clone(fsrc, fdst):
+    try:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        return True
+    except OSError:
+        pass
+
+    if not hasattr(os, 'copy_file_range'):
+        return False
+    size = os.fstat(fsrc.fileno()).st_size
+    offset = 0
+    try:
+        while offset < size:
+            copied = os.copy_file_range(
+                fsrc.fileno(), fdst.fileno(), size - offset, offset, offset)
+            if copied == 0:
+                break
+            offset += copied
+    except OSError:
+        return False
+    return offset == size
+
+
+class MachOPatcher(object):
+    """Patch section contents and load command fields of a Mach-O image
+
+    The output file is created as a clone of the input (see clone_file())
+    and then mapped writable, so patching costs proportional to the bytes
+    changed rather than the file size.  Without output_file_name the input
+    is patched in place.
+
+    offset and size select an image embedded in a larger file, as for
+    MachOFile.  Positions passed to write() are relative to the image.  The
+    image is parsed once, before any patch; records returned by macho() do
+    not reflect later patches.  Patching invalidates any code signature
+    until sign_adhoc() regenerates it.
+    """
+
+    def __init__(self, input_file_name, output_file_name=None, offset=0, size=None):
+        path = input_file_name
+        if output_file_name is not None and not (os.path.exists(output_file_name) and
+                                                 os.path.samefile(input_file_name, output_file_name)):
+            clone_file(input_file_name, output_file_name)
+            path = output_file_name
+
+        self._offset = offset
+        self._written = 0
+        self._path = path
+        self._mf = MachOFile(path, offset=offset, size=size)
+        with open(path, 'r+b') as f:
+            self._buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_WRITE)
+
+    def macho(self):
+        """Return the MachOFile of the image, as parsed before patching"""
+        return self._mf
+
+    def written(self):
+        """Return the number of bytes patched so far"""
+        return self._written
+
+    def write(self, offset, data):
+        """Write data at a file offset of the image"""
+        if offset < 0 or offset + len(data) > len(self._mf.data()):
+            raise ValueError(
+                f'write of {len(data)} bytes at offset {offset} falls outside the image')
+        start = self._offset + offset
+        self._buf[start:start + len(data)] = data
+        self._written += len(data)
+
+    def write_at(self, addr, data):
+        """Write data at the virtual address addr"""
+        offset = self._mf.file_offset(addr)
+        if offset is None or self._mf.file_offset(addr + len(data) - 1) != offset + len(data) - 1:
+            raise ValueError(f'address {addr:#x} is not backed by file data')
+        self.write(offset, data)
+
+    def write_section(self, segname, sectname, data, offset=0):
+        """Overwrite (part of) the contents of a section"""
+        sect = self._section(segname, sectname)[1]
+        if sect.is_zerofill():
+            raise ValueError(f'{segname},{sectname} is zerofill')
+        if offset < 0 or offset + len(data) > sect._size:
+            raise ValueError(
+                f'write of {len(data)} bytes at offset {offset} overflows {segname},{sectname}')
+        self.write(sect._offset + offset, data)
+
+    def set_section_field(self, segname, sectname, field, value):
+        """Update one field of a section header in the load commands"""
+        self._pack(SECTION, self._section(segname, sectname)[0], field, value)
+
+    def set_segment_field(self, segname, field, value):
+        """Update one field of a segment load command"""
+        self._pack(SEGMENT_COMMAND, self._segment(segname)[0], field, value)
+
+    def rename_section(self, segname, sectname, new_sectname):
+        """Rename a section (names are limited to 16 bytes)"""
+        raw = new_sectname.encode()
+        if len(raw) > 16:
+            raise ValueError(
+                f'section name {new_sectname} is longer than 16 bytes')
+        self.set_section_field(segname, sectname,
+                               'sectname', raw.ljust(16, b'\0'))
+
+    def sign_adhoc(self, identifier=None, jobs=None):
+        """Replace the code signature with an ad-hoc one of the patched image
+
+        The identifier, hash type, page size and linker-signed flag of the
+        existing CodeDirectory are kept (the identifier defaults to the
+        file name).  The new signature must fit in the space reserved by
+        LC_CODE_SIGNATURE; the rest is zero filled.  Pages are hashed in
+        jobs threads straight from the writable mapping.
+        """
+        mf = self._mf
+        lc = mf.command(LCCommand.LC_CODE_SIGNATURE)
+        if not lc:
+            raise ValueError('image has no LC_CODE_SIGNATURE')
+        try:
+            cd = mf.code_signature().code_directory()
+        except ValueError:
+            # reserved, but never signed
+            cd = None
+
+        flags = CSFlag.CS_ADHOC.value
+        kwargs = dict()
+        if cd is not None:
+            identifier = identifier or cd.identifier()
+            flags |= cd._flags & CSFlag.CS_LINKER_SIGNED.value
+            kwargs.update(page_size=cd.page_size(), hash_type=cd._hash_type)
+        identifier = identifier or os.path.basename(self._path)
+
+        exec_seg = (0, 0, 0)
+        for seg in mf.segments():
+            if seg._segname == '__TEXT':
+                exec_seg = (seg._fileoff, seg._filesize,
+                            CSExecSegFlag.CS_EXECSEG_MAIN_BINARY.value
+                            if mf._header._filetype == MHFiletype.MH_EXECUTE else 0)
+
+        with memoryview(self._buf) as view:
+            image = view[self._offset:self._offset + len(mf.data())]
+            signature = adhoc_signature(image, lc._dataoff, identifier, flags, exec_seg,
+                                        requirements=not flags & CSFlag.CS_LINKER_SIGNED.value,
+                                        jobs=jobs, **kwargs)
+            image.release()
+        if len(signature) > lc._datasize:
+            raise ValueError(
+                f'signature of {len(signature)} bytes does not fit in {lc._datasize} bytes')
+        self.write(lc._dataoff, signature.ljust(lc._datasize, b'\0'))
+
+    def _pack(self, layout, header_offset, field, value):
+        n = 8 if self._mf.is_64() else 4
+        start = self._offset + header_offset
+        self._written += layout.pack_field_into(field, n, self._mf.order(),
+                                                self._buf, start, value)
+
+    def _segment(self, segname):
+        for offset, lc in self._mf._load_commands.commands(LCCommand.LC_SEGMENT, LCCommand.LC_SEGMENT_64):
+            if lc._segname == segname:
+                return offset, lc
+        raise KeyError(segname)
+
+    def _section(self, segname, sectname):
+        for offset, sect in self._segment(segname)[1]._sects.items():
+            if sect._sectname == sectname:
+                return offset, sect
+        raise KeyError(f'{segname},{sectname}')
+
+    def flush(self):
+        self._buf.flush()
+
+    def close(self):
+        """Flush all patches to the file and release the mappings"""
+        if self._buf is not None:
+            self._buf.flush()
+            self._buf.close()
+            self._buf = None
+        self._mf.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,2 +1,193 @@
 # Copyright (c) 2021 Friedt Professional Engineering Services, Inc
 # SPDX-License-Identifier: MIT
+
+import array
+import collections
+import sys
+
+from machotools.structs import StructLayout
+from machotools.symbols import np
+
+# struct relocation_info / struct scattered_relocation_info
+RELOCATION_INFO = StructLayout(
+    ('r_address', 'i'),  # offset in the section to what is being relocated
+    # r_symbolnum:24, r_pcrel:1, r_length:2, r_extern:1, r_type:4
+    ('r_info', 'I'),
+)
+
+R_SCATTERED = 0x80000000  # mask to be applied to the r_address field of a relocation_info
+R_ABS = 0  # absolute relocation type for Mach-O files
+
+# the plain pointer relocation of every architecture (GENERIC_RELOC_VANILLA,
+# X86_64_RELOC_UNSIGNED, ARM64_RELOC_UNSIGNED, ARM_RELOC_VANILLA, ...)
+RELOC_VANILLA = 0
+
+Relocation = collections.namedtuple('Relocation', [
+    'address', 'symbolnum', 'pcrel', 'length', 'extern', 'type', 'scattered', 'value'])
+
+
+def _where(cond, a, b):
+    if np is not None and isinstance(cond, np.ndarray):
+        return np.where(cond, a, b)
+    return a if cond else b
+
+
+# The bit fields of both structs are declared in host order, so which bits
+# of r_info hold r_symbolnum depends on the byte order of the image.  The
+# scattered layout was chosen to be the same in either order.  The decoder
+# takes the two words of an entry, or NumPy arrays of them, and returns the
+# fields of Relocation.  Only 32-bit images have scattered relocations.
+
+def _decode(word0, word1, big, scattered):
+    if big:
+        symbolnum = word1 >> 8
+        pcrel = (word1 >> 7) & 1
+        length = (word1 >> 5) & 3
+        extern = (word1 >> 4) & 1
+        rtype = word1 & 0xf
+    else:
+        symbolnum = word1 & 0xffffff
+        pcrel = (word1 >> 24) & 1
+        length = (word1 >> 25) & 3
+        extern = (word1 >> 27) & 1
+        rtype = word1 >> 28
+    if not scattered:
+        return word0, symbolnum, pcrel, length, extern, rtype, 0, 0
+    scattered = (word0 >> 31) & 1
+    return (_where(scattered, word0 & 0xffffff, word0),
+            _where(scattered, 0, symbolnum),
+            _where(scattered, (word0 >> 30) & 1, pcrel),
+            _where(scattered, (word0 >> 28) & 3, length),
+            _where(scattered, 0, extern),
+            _where(scattered, (word0 >> 24) & 0xf, rtype),
+            scattered,
+            _where(scattered, word1, 0))
+
+
+class Relocations(object):
+    """The relocation entries of one section of an object file
+
+    The relocation_info array is sliced out of the mapped image in one
+    read and decoded as columns (NumPy arrays, or lists without numpy),
+    with scattered entries (32-bit images only) told apart by their high
+    bit.  address holds the vmaddr of each relocated location; the
+    r_address field is an offset from the start of the section.
+    """
+
+    def __init__(self, mf, sect):
+        self._mf = mf
+        self._sect = sect
+        self._symbols = dict()
+        self._targets = None
+        count = sect._nreloc
+        data = mf.data()[sect._reloff:sect._reloff + count * RELOCATION_INFO.size(4)]
+        big = mf.order() == 'big'
+        scattered = not mf.is_64()
+
+        if np is not None:
+            words = np.frombuffer(data, dtype=('>' if big else '<') + 'u4',
+                                  count=2 * count).astype(np.int64).reshape(count, 2)
+            columns = _decode(words[:, 0], words[:, 1], big, scattered)
+            if not scattered:
+                columns = columns[:6] + (np.zeros(count, dtype=np.int64),) * 2
+        else:
+            words = array.array('I')
+            words.frombytes(data)
+            if mf.order() != sys.byteorder:
+                words.byteswap()
+            entries = [_decode(word0, word1, big, scattered)
+                       for word0, word1 in zip(words[0::2], words[1::2])]
+            columns = tuple(map(list, zip(*entries))) if entries else ([],) * 8
+
+        (offsets, self._symbolnum, self._pcrel, self._length, self._extern,
+         self._type, self._scattered, self._value) = columns
+        self._address = offsets + sect._addr if np is not None else [
+            offset + sect._addr for offset in offsets]
+
+    def section(self):
+        return self._sect
+
+    def address(self):
+        return self._address
+
+    def symbolnum(self):
+        return self._symbolnum
+
+    def pcrel(self):
+        return self._pcrel
+
+    def length(self):
+        return self._length
+
+    def extern(self):
+        return self._extern
+
+    def type(self):
+        return self._type
+
+    def scattered(self):
+        return self._scattered
+
+    def value(self):
+        return self._value
+
+    def _symbol_value(self, symbolnum):
+        # n_value of a defined symbol, or None if it is undefined
+        if symbolnum not in self._symbols:
+            sym = self._mf.symbol(symbolnum)
+            self._symbols[symbolnum] = sym.n_value if sym is not None and not sym.is_undefined() else None
+        return self._symbols[symbolnum]
+
+    def targets(self):
+        """Return a dict of vmaddr -> (extern, type, symbolnum) of each pointer
+
+        Only the first entry at each address is kept, which is the one
+        describing the relocated location when entries come in pairs.
+        """
+        if self._targets is None:
+            targets = dict()
+            columns = (self._address, self._extern, self._type, self._symbolnum)
+            if np is not None:
+                columns = tuple(column.tolist() for column in columns)
+            for addr, extern, rtype, symbolnum in zip(*columns):
+                targets.setdefault(addr, (extern, rtype, symbolnum))
+            self._targets = targets
+        return self._targets
+
+    def resolve(self, addrs, raws):
+        """Apply the relocations to the raw pointer values read from addrs
+
+        As for ChainedFixups.resolve(): returns a list with the target
+        vmaddr of each pointer and None for pointers to undefined symbols.
+        A pointer to a symbol resolves to its n_value plus the addend
+        stored in place; section-relative and scattered pointers already
+        hold their target, as do locations without a relocation.  Pointers
+        with any other relocation type (e.g. the difference of two
+        symbols) resolve to None.
+        """
+        targets = self.targets()
+        resolved = []
+        for addr, raw in zip(addrs, raws):
+            target = targets.get(addr)
+            if target is None:
+                resolved.append(raw)
+                continue
+            extern, rtype, symbolnum = target
+            if rtype != RELOC_VANILLA:
+                resolved.append(None)
+            elif extern:
+                value = self._symbol_value(symbolnum)
+                resolved.append(None if value is None else value + raw)
+            else:
+                resolved.append(raw)
+        return resolved
+
+    def __len__(self):
+        return len(self._address)
+
+    def __iter__(self):
+        columns = (self._address, self._symbolnum, self._pcrel, self._length,
+                   self._extern, self._type, self._scattered, self._value)
+        if np is not None:
+            columns = tuple(column.tolist() for column in columns)
+        return map(Relocation, *columns)
@@ -1,50 +1,72 @@
 # Copyright (c) 2021 Friedt Professional Engineering Services, Inc
 # SPDX-License-Identifier: MIT
 
-import io
-
-from machotools.util import align_up
+from machotools.util import FlagTable, bit_flags, decode_name
 from machotools.enums import *
+from machotools.structs import StructLayout
+
+SECTION = StructLayout(
+    ('sectname', '16s'),  # name of this section
+    ('segname', '16s'),  # segment this section goes in
+    ('addr', 'W'),  # memory address of this section
+    ('size', 'W'),  # size in bytes of this section
+    ('offset', 'I'),  # file offset of this section
+    ('align', 'I'),  # section alignment (power of 2)
+    ('reloff', 'I'),  # file offset of relocation entries
+    ('nreloc', 'I'),  # number of relocation entries
+    ('flags', 'I'),  # flags (section type and attributes)
+    ('reserved1', 'I'),  # reserved (for offset or index)
+    ('reserved2', 'I'),  # reserved (for count or sizeof)
+    ('reserved3', 'I', 8),  # reserved
+)
+
+
+_attributes = bit_flags(SectionAttribute)
+
+# raw section flags -> frozenset of SectionType and SectionAttribute members
+SECTION_FLAGS = FlagTable(lambda flags: (
+    SectionType(SectionFlagMask.SECTION_TYPE.value & flags), *_attributes(flags)))
+
+_SECTION_TYPE = SectionFlagMask.SECTION_TYPE.value
+_ZEROFILL_TYPES = frozenset((SectionType.S_ZEROFILL.value, SectionType.S_GB_ZEROFILL.value,
+                             SectionType.S_THREAD_LOCAL_ZEROFILL.value))
 
 
 class SSectionCommon(object):
-    def __init__(self, n, file, order):
-        self._sectname = file.read(16).decode('utf-8').replace('\0', '')
-        self._segname = file.read(16).decode('utf-8').replace('\0', '')
-        self._addr = int.from_bytes(file.read(n), order)
-        self._size = int.from_bytes(file.read(n), order)
-        self._offset = int.from_bytes(file.read(4), order)
-        self._align = int.from_bytes(file.read(4), order)
-        self._reloff = int.from_bytes(file.read(4), order)
-        self._nreloc = int.from_bytes(file.read(4), order)
-
-        self._flags = set()
-        flags = int.from_bytes(file.read(4), order)
-        self._flags.add(SectionType(
-            SectionFlagMask.SECTION_TYPE.value & flags))
-        for e in SectionAttribute:
-            if flags & e.value:
-                self._flags.add(e)
-
-        self._reserved1 = int.from_bytes(file.read(4), order)
-        self._reserved2 = int.from_bytes(file.read(4), order)
-        if n == 8:
-            self._reserved3 = int.from_bytes(file.read(4), order)
-
-        pad = align_up(file.tell(), n) - file.tell()
-        file.seek(pad, io.SEEK_CUR)
+    __slots__ = ('_sectname', '_segname', '_addr', '_size', '_offset', '_align', '_reloff',
+                 '_nreloc', '_flags_raw', '_reserved1', '_reserved2', '_reserved3')
+
+    def __init__(self, values):
+        (sectname, segname, self._addr, self._size, self._offset, self._align,
+         self._reloff, self._nreloc, self._flags_raw, self._reserved1, self._reserved2,
+         *reserved3) = values
+        self._sectname = decode_name(sectname)
+        self._segname = decode_name(segname)
+
+        if reserved3:
+            self._reserved3 = reserved3[0]
+
+    @property
+    def _flags(self):
+        return SECTION_FLAGS[self._flags_raw]
+
+    def section_type(self):
+        return self._flags_raw & _SECTION_TYPE
+
+    def is_zerofill(self):
+        return self._flags_raw & _SECTION_TYPE in _ZEROFILL_TYPES
 
     def __repr__(self):
         # TODO: would be great if all classes were JSON serializable / deserializable
         # return json.dumps(self.__dict__, sort_keys=True)
-        return '{' f'sectname: {self._sectname}, segname: {self._segname}, addr: {self._addr:x}, size: {self._size}, offset: {self._offset}, align: {self._align}, reloff: {self._reloff}, nreloc: {self._nreloc}, flags: {self._flags}, reserved1: {self._reserved1}, reserved2: {self._reserved2}' '}'
+        return '{' f'sectname: {self._sectname}, segname: {self._segname}, addr: {self._addr:x}, size: {self._size}, offset: {self._offset}, align: {self._align}, reloff: {self._reloff}, nreloc: {self._nreloc}, flags: {set(self._flags)}, reserved1: {self._reserved1}, reserved2: {self._reserved2}' '}'
 
 
 class SSection(SSectionCommon):
-    def __init__(self, file, order):
-        super().__init__(4, file, order)
+    __slots__ = ()
+    n = 4
 
 
 class SSection64(SSectionCommon):
-    def __init__(self, file, order):
-        super().__init__(8, file, order)
+    __slots__ = ()
+    n = 8
@@ -1,52 +1,75 @@
 # Copyright (c) 2021 Friedt Professional Engineering Services, Inc
 # SPDX-License-Identifier: MIT
 
-import io
-
+from machotools import stats
 from machotools.enums import *
 from machotools.sections import *
+from machotools.structs import StructLayout
+from machotools.util import FlagTable, bit_flags, decode_name
+
+SEGMENT_COMMAND = StructLayout(
+    ('cmd', 'I'),  # LC_SEGMENT / LC_SEGMENT_64
+    ('cmdsize', 'I'),  # includes sizeof section structs
+    ('segname', '16s'),  # segment name
+    ('vmaddr', 'W'),  # memory address of this segment
+    ('vmsize', 'W'),  # memory size of this segment
+    ('fileoff', 'W'),  # file offset of this segment
+    ('filesize', 'W'),  # amount to map from the file
+    ('maxprot', 'I'),  # maximum VM protection
+    ('initprot', 'I'),  # initial VM protection
+    ('nsects', 'I'),  # number of sections in segment
+    ('flags', 'I'),  # flags
+)
+
+
+# raw segment flags -> frozenset of SGFlag members
+SEGMENT_FLAGS = FlagTable(bit_flags(SGFlag))
 
 
 class LCSegmentCommon(object):
-    def __init__(self, cmd, file, order):
+    __slots__ = ('_cmd', '_cmdsize', '_segname', '_vmaddr', '_vmsize', '_fileoff',
+                 '_filesize', '_maxprot', '_initprot', '_nsects', '_flags_raw', '_sects')
+
+    def __init__(self, cmd, data, offset, order):
         self._cmd = cmd
         n = 4 if cmd == LCCommand.LC_SEGMENT else 8
-        self._cmdsize = int.from_bytes(file.read(4), order)
-        self._segname = file.read(16).decode('utf-8').replace('\0', '')
-        self._vmaddr = int.from_bytes(file.read(n), order)
-        self._vmsize = int.from_bytes(file.read(n), order)
-        self._fileoff = int.from_bytes(file.read(n), order)
-        self._filesize = int.from_bytes(file.read(n), order)
-        self._maxprot = int.from_bytes(file.read(4), order)
-        self._initprot = int.from_bytes(file.read(4), order)
-        self._nsects = int.from_bytes(file.read(4), order)
-
-        self._flags = set()
-        flags = int.from_bytes(file.read(4), order)  # flags
-        for e in SGFlag:
-            if flags & e.value:
-                self._flags.add(e)
+        (_, self._cmdsize, segname, self._vmaddr, self._vmsize, self._fileoff,
+         self._filesize, self._maxprot, self._initprot, self._nsects,
+         self._flags_raw) = SEGMENT_COMMAND.unpack_from(n, order, data, offset)
+        self._segname = decode_name(segname)
 
         sects = dict()
-        for j in range(0, self._nsects):
-            offset = file.tell()
-            sect = SSection(file, order) if n == 4 else SSection64(file, order)
-            sects[offset] = sect
+        offset += SEGMENT_COMMAND.size(n)
+        section = SSection if n == 4 else SSection64
+        size = SECTION.size(n)
+        with stats.timed('sections'):
+            for values in SECTION.iter_unpack(n, order, data, offset, self._nsects):
+                sects[offset] = section(values)
+                offset += size
+        stats.count('sections', nbytes=self._nsects * size, objects=self._nsects)
 
         self._sects = sects
 
+    @property
+    def _flags(self):
+        return SEGMENT_FLAGS[self._flags_raw]
+
     def __repr__(self):
         # TODO: would be great if all classes were JSON serializable / deserializable
         # return json.dumps(self.__dict__, sort_keys=True)
-        return '{' f'cmd: {self._cmd}, cmdsize: {self._cmdsize}, segname: {self._segname}, vmaddr: {self._vmaddr:x}, vmsize: {self._vmsize:x}, fileoff: {self._fileoff}, filesize: {self._filesize}, maxprot: {self._maxprot}, initprot: {self._initprot}, nsects: {self._nsects}, flags: {self._flags}' '}'
+        return '{' f'cmd: {self._cmd}, cmdsize: {self._cmdsize}, segname: {self._segname}, vmaddr: {self._vmaddr:x}, vmsize: {self._vmsize:x}, fileoff: {self._fileoff}, filesize: {self._filesize}, maxprot: {self._maxprot}, initprot: {self._initprot}, nsects: {self._nsects}, flags: {set(self._flags)}' '}'
 
 
 class LCSegment(LCSegmentCommon):
-    def __init__(self, file, order):
-        super().__init__(LCCommand.LC_SEGMENT, file, order)
+    __slots__ = ()
+
+    def __init__(self, data, offset, order):
+        super().__init__(LCCommand.LC_SEGMENT, data, offset, order)
 
 
 class LCSegment64(LCSegmentCommon):
-    def __init__(self, file, order):
+    __slots__ = ()
+
+    def __init__(self, data, offset, order):
         super().__init__(
-            LCCommand.LC_SEGMENT_64, file, order)
+            LCCommand.LC_SEGMENT_64, data, offset, order)
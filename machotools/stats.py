@@ -0,0 +1,128 @@
+# Copyright (c) 2021 Friedt Professional Engineering Services, Inc
+# SPDX-License-Identifier: MIT
+
+import contextlib
+import json
+import sys
+import time
+
+# the ParseStats being collected, or None; the parsers only test this
+ACTIVE = None
+
+_DISABLED = contextlib.nullcontext()
+
+# called with True / False when collection starts / stops, see on_toggle()
+_HOOKS = []
+
+COUNTERS = ('calls', 'seconds', 'bytes', 'reads', 'seeks', 'objects')
+
+
+class ParseStats(object):
+    """Per-phase parse counters
+
+    Each phase (e.g. 'header', 'load_commands', 'symtab', 'strings',
+    'sections') counts the wall time spent in it, the bytes of the image
+    read or decoded, the number of read() and seek() calls and the number
+    of objects (records, names) created.  Phases nest, and the time of a
+    phase includes the phases it calls.  Collection is off unless enabled
+    with enable(); the parsers then only pay for testing ACTIVE.  Streaming
+    decoders such as MachOFile.iter_symbols() are counted but not timed.
+    """
+
+    def __init__(self):
+        self._phases = dict()
+
+    def _phase(self, name):
+        phase = self._phases.get(name)
+        if phase is None:
+            phase = self._phases[name] = dict.fromkeys(COUNTERS, 0)
+        return phase
+
+    @contextlib.contextmanager
+    def timed(self, name):
+        phase = self._phase(name)
+        start = time.perf_counter()
+        try:
+            yield phase
+        finally:
+            phase['seconds'] += time.perf_counter() - start
+            phase['calls'] += 1
+
+    def count(self, name, nbytes=0, reads=0, seeks=0, objects=0):
+        phase = self._phase(name)
+        phase['bytes'] += nbytes
+        phase['reads'] += reads
+        phase['seeks'] += seeks
+        phase['objects'] += objects
+
+    def merge(self, phases):
+        """Add the counters of as_dict() (e.g. from another process)"""
+        for name, counters in phases.items():
+            phase = self._phase(name)
+            for counter in COUNTERS:
+                phase[counter] += counters.get(counter, 0)
+
+    def as_dict(self):
+        return {name: dict(phase) for name, phase in self._phases.items()}
+
+    def dump(self, file_name=None):
+        """Write the counters as JSON to file_name, or to stderr"""
+        if file_name is None or file_name == '-':
+            json.dump(self.as_dict(), sys.stderr, indent=1)
+            sys.stderr.write('\n')
+            return
+        with open(file_name, 'w') as f:
+            json.dump(self.as_dict(), f, indent=1)
+            f.write('\n')
+
+
+def enable():
+    """Start collecting into a new ParseStats and return it"""
+    global ACTIVE
+    ACTIVE = ParseStats()
+    for hook in _HOOKS:
+        hook(True)
+    return ACTIVE
+
+
+def disable():
+    """Stop collecting and return the ParseStats collected, or None"""
+    global ACTIVE
+    stats, ACTIVE = ACTIVE, None
+    for hook in _HOOKS:
+        hook(False)
+    return stats
+
+
+def on_toggle(hook):
+    """Call hook(enabled) now and whenever collection starts or stops
+
+    Hot paths use this to swap in a counting variant, so that they cost
+    nothing at all while statistics are disabled.
+    """
+    _HOOKS.append(hook)
+    hook(ACTIVE is not None)
+
+
+def timed(name):
+    """Return a context manager timing phase name (a no-op when disabled)"""
+    if ACTIVE is None:
+        return _DISABLED
+    return ACTIVE.timed(name)
+
+
+def collected(func, *args):
+    """Call func(*args) collecting fresh statistics, e.g. in a worker process
+
+    Returns (result, as_dict()) so the caller can merge() the counters.
+    """
+    stats = enable()
+    try:
+        return func(*args), stats.as_dict()
+    finally:
+        disable()
+
+
+def count(name, nbytes=0, reads=0, seeks=0, objects=0):
+    if ACTIVE is not None:
+        ACTIVE.count(name, nbytes, reads, seeks, objects)
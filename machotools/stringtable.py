@@ -0,0 +1,88 @@
+# Copyright (c) 2021 Friedt Professional Engineering Services, Inc
+# SPDX-License-Identifier: MIT
+
+from machotools import stats
+
+
+class StringTable(object):
+    """NUL-terminated strings resolved by offset from a single buffer
+
+    The buffer is loaded once (bytes and mmap objects are used in place,
+    anything else is copied into bytes with a single read) and each name is
+    located with a C-speed find(b'\\0') and sliced out.  Resolved names are
+    memoized per offset, so repeated references to the same name are a dict
+    lookup.  With memoize=False nothing is retained, which keeps memory
+    bounded when every string is only visited once.
+    """
+
+    def __init__(self, data, offset=0, size=None, memoize=True):
+        if not hasattr(data, 'find'):
+            data = bytes(data)
+            stats.count('strings', nbytes=len(data), reads=1)
+        self._data = data
+        self._offset = offset
+        self._end = len(data) if size is None else offset + size
+        self._cache = dict() if memoize else None
+        self._preloaded = []
+
+    def _decode_plain(self, index):
+        start = self._offset + index
+        end = self._data.find(b'\0', start, self._end)
+        if end < 0:
+            end = self._end
+        return self._data[start:end].decode('utf-8')
+
+    def _decode_counted(self, index):
+        # _decode_plain() with parse statistics enabled
+        with stats.ACTIVE.timed('strings') as phase:
+            start = self._offset + index
+            end = self._data.find(b'\0', start, self._end)
+            if end < 0:
+                end = self._end
+            phase['bytes'] += end - start
+            phase['objects'] += 1
+            return self._data[start:end].decode('utf-8')
+
+    def get(self, index):
+        if self._cache is None:
+            return self._decode(index)
+        s = self._cache.get(index)
+        if s is None:
+            if self._preloaded:
+                self._load_preloaded()
+                return self.get(index)
+            s = self._decode(index)
+            self._cache[index] = s
+        return s
+
+    def preload(self, offsets, names):
+        """Memoize already decoded strings
+
+        offsets is a sequence of string offsets and names either the
+        matching sequence of strings or bytes holding the NUL-joined UTF-8
+        strings.  They are only added to the memo on the first lookup.
+        """
+        if self._cache is None:
+            self._cache = dict()
+        self._preloaded.append((offsets, names))
+
+    def _load_preloaded(self):
+        stats.count('strings', objects=sum(len(offsets) for offsets, names in self._preloaded))
+        for offsets, names in self._preloaded:
+            if isinstance(names, (bytes, bytearray)):
+                names = names.decode('utf-8').split('\0')
+            self._cache.update(zip(offsets, names))
+        self._preloaded = []
+
+    def __getitem__(self, index):
+        return self.get(index)
+
+    def __len__(self):
+        return self._end - self._offset
+
+
+def _count_strings(enabled):
+    StringTable._decode = StringTable._decode_counted if enabled else StringTable._decode_plain
+
+
+stats.on_toggle(_count_strings)
@@ -2,38 +2,153 @@
 # SPDX-License-Identifier: MIT
 
 import json
-import io
+import struct
 import sys
 
 from machotools.enums import *
-from machotools.sections import *
+from machotools.util import FlagTable, bit_flags
+
+
+class StructLayout(object):
+    """Declarative layout of a fixed-size Mach-O record
+
+    Fields are (name, format) pairs, where format is a struct format
+    character.  The pseudo-format 'W' is a target word: uint32_t in 32-bit
+    files and uint64_t in 64-bit files.  An optional third element limits a
+    field to files of that word size.  One struct.Struct is compiled and
+    cached per (word size, byte order), so a record is decoded with a single
+    unpack_from() call and an array of records with iter_unpack().
+    """
+
+    _ORDER = {'little': '<', 'big': '>'}
+
+    def __init__(self, *fields):
+        self._fields = fields
+        self._structs = dict()
+
+    def fields(self, n):
+        return tuple(f for f in self._fields if len(f) < 3 or f[2] == n)
+
+    def names(self, n):
+        return tuple(f[0] for f in self.fields(n))
+
+    @staticmethod
+    def _format(field, n):
+        if field[1] == 'W':
+            return 'I' if n == 4 else 'Q'
+        return field[1]
+
+    def compile(self, n, order):
+        key = (n, order)
+        st = self._structs.get(key)
+        if st is None:
+            fmt = ''.join(StructLayout._format(f, n) for f in self.fields(n))
+            st = struct.Struct(StructLayout._ORDER[order] + fmt)
+            self._structs[key] = st
+        return st
+
+    def size(self, n):
+        return self.compile(n, 'little').size
+
+    def offset_of(self, name, n):
+        fmt = '<'
+        for f in self.fields(n):
+            if f[0] == name:
+                return struct.calcsize(fmt)
+            fmt += StructLayout._format(f, n)
+        raise KeyError(name)
+
+    def pack_field_into(self, name, n, order, buf, offset, value):
+        """Write one field of the record at offset in a writable buffer
+
+        Returns the size of the field.
+        """
+        for f in self.fields(n):
+            if f[0] == name:
+                fmt = StructLayout._ORDER[order] + StructLayout._format(f, n)
+                struct.pack_into(fmt, buf, offset + self.offset_of(name, n), value)
+                return struct.calcsize(fmt)
+        raise KeyError(name)
+
+    def unpack_from(self, n, order, data, offset=0):
+        return self.compile(n, order).unpack_from(data, offset)
+
+    def iter_unpack(self, n, order, data, offset, count):
+        st = self.compile(n, order)
+        return st.iter_unpack(data[offset:offset + count * st.size])
+
+
+MACH_HEADER = StructLayout(
+    ('magic', 'I'),  # mach magic number identifier
+    ('cputype', 'i'),  # cpu specifier
+    ('cpusubtype', 'I'),  # machine specifier
+    ('filetype', 'I'),  # type of file
+    ('ncmds', 'I'),  # number of load commands
+    ('sizeofcmds', 'I'),  # the size of all the load commands
+    ('flags', 'I'),  # flags
+    ('reserved', 'I', 8),  # reserved
+)
+
+NLIST = StructLayout(
+    ('n_strx', 'I'),  # index into the string table
+    ('n_type', 'B'),  # type flag, see below
+    ('n_sect', 'B'),  # section number or NO_SECT
+    ('n_desc', 'H'),  # see <mach-o/stab.h>
+    ('n_value', 'W'),  # value of this symbol (or stab offset)
+)
+
+
+# raw mach_header flags -> frozenset of MHFlag members
+MH_FLAGS = FlagTable(bit_flags(MHFlag))
+
+
+def _decode_n_type(n_type):
+    if n_type & NLTypeMask.N_STAB.value:
+        return frozenset((NLStab(n_type),))
+    flags = {NLType(n_type & NLTypeMask.N_TYPE.value)}
+    if n_type & NLTypeMask.N_PEXT.value:
+        flags.add(NLTypeMask.N_PEXT)
+    if n_type & NLTypeMask.N_EXT.value:
+        flags.add(NLTypeMask.N_EXT)
+    return frozenset(flags)
+
+
+def _n_type_table():
+    table = []
+    for n_type in range(256):
+        try:
+            table.append(_decode_n_type(n_type))
+        except ValueError:
+            # not a known stab or type; raised again when accessed
+            table.append(None)
+    return tuple(table)
+
+
+# every possible n_type byte -> frozenset of NLStab / NLType / NLTypeMask members
+N_TYPE_FLAGS = _n_type_table()
 
 
 class MachHeader(object):
-    def __init__(self, file):
+    __slots__ = ('_magic', '_cputype', '_cpusubtype', '_filetype', '_ncmds', '_sizeofcmds',
+                 '_flags_raw', '_reserved')
+
+    def __init__(self, data, offset=0):
         # mach magic number identifier
-        self._magic = MHMagic(int.from_bytes(file.read(4), sys.byteorder))
-
-        order = self.order()
-        self._cputype = MHCpuType(int.from_bytes(
-            file.read(4), order))  # cpu specifier
-        self._cpusubtype = int.from_bytes(
-            file.read(4), order)  # machine specifier
-        self._filetype = MHFiletype(int.from_bytes(
-            file.read(4), order))  # type of file
-        self._ncmds = int.from_bytes(
-            file.read(4), order)  # number of load commands
-        # the size of all the load commands
-        self._sizeofcmds = int.from_bytes(file.read(4), order)
-
-        self._flags = set()
-        flags = int.from_bytes(file.read(4), order)  # flags
-        for e in MHFlag:
-            if flags & e.value:
-                self._flags.add(e)
-
-        if self._magic == MHMagic.MH_MAGIC_64 or self._magic == MHMagic.MH_CIGAM_64:
-            self._reserved = int.from_bytes(file.read(4), order)
+        self._magic = MHMagic(int.from_bytes(
+            data[offset:offset + 4], sys.byteorder))
+
+        n = 8 if self.is_64() else 4
+        (_, cputype, self._cpusubtype, filetype, self._ncmds, self._sizeofcmds,
+         self._flags_raw, *reserved) = MACH_HEADER.unpack_from(n, self.order(), data, offset)
+        self._cputype = MHCpuType(cputype)
+        self._filetype = MHFiletype(filetype)
+
+        if reserved:
+            self._reserved = reserved[0]
+
+    @property
+    def _flags(self):
+        return MH_FLAGS[self._flags_raw]
 
     def is_swapped(self):
         return self._magic == MHMagic.MH_CIGAM or self._magic == MHMagic.MH_CIGAM_64
@@ -41,7 +156,7 @@ class MachHeader(object):
     def order(self):
         order = sys.byteorder
         if self.is_swapped():
-            order = 'big' if sys.byteorder == 'little' else 'big'
+            order = 'big' if sys.byteorder == 'little' else 'little'
         return order
 
     def is_64(self):
@@ -50,48 +165,39 @@ class MachHeader(object):
     def align(self):
         return 8 if self.is_64() else 4
 
+    def size(self):
+        # sizeof(struct mach_header) / sizeof(struct mach_header_64)
+        return MACH_HEADER.size(8 if self.is_64() else 4)
+
     def __str__(self):
-        return '{' f'magic: {self._magic}, cputype: {self._cputype}, cpusubtype: {self._cpusubtype}, filetype: {self._filetype}, ncmds: {self._ncmds}, sizeofcmds: {self._sizeofcmds}, flags: {self._flags}' '}'
+        return '{' f'magic: {self._magic}, cputype: {self._cputype}, cpusubtype: {self._cpusubtype}, filetype: {self._filetype}, ncmds: {self._ncmds}, sizeofcmds: {self._sizeofcmds}, flags: {set(self._flags)}' '}'
 
 
 class NListCommon(object):
-    def __init__(self, file, order, stroff, n):
-        self._n_strx = int.from_bytes(file.read(4), order)
-        n_type = int.from_bytes(file.read(1), order)
-        self._n_type = set()
-        if n_type & NLTypeMask.N_STAB.value:
-            self._n_type.add(NLStab(n_type))
-        else:
-            if n_type & NLTypeMask.N_PEXT.value:
-                self._n_type.add(NLTypeMask.N_PEXT)
-            self._n_type.add(NLType(n_type & NLTypeMask.N_TYPE.value))
-            if n_type & NLTypeMask.N_EXT.value:
-                self._n_type.add(NLTypeMask.N_EXT)
-
-        self._n_sect = int.from_bytes(file.read(1), order)
-        self._n_desc = int.from_bytes(file.read(2), order)
-        self._n_value = int.from_bytes(file.read(n), order)
-
-        offset = file.tell()
-        self._n_name = ''
-        file.seek(stroff + self._n_strx, io.SEEK_SET)
-        while True:
-            ch = file.read(1).decode('utf-8')
-            if ch == '\0':
-                break
-            self._n_name += ch
-        file.seek(offset, io.SEEK_SET)
+    __slots__ = ('_n_strx', '_n_type_raw', '_n_sect',
+                 '_n_desc', '_n_value', '_n_name')
+
+    def __init__(self, values, strings):
+        self._n_strx, self._n_type_raw, self._n_sect, self._n_desc, self._n_value = values
+        self._n_name = strings.get(self._n_strx)
+
+    @property
+    def _n_type(self):
+        n_type = N_TYPE_FLAGS[self._n_type_raw]
+        if n_type is None:
+            return _decode_n_type(self._n_type_raw)
+        return n_type
 
     def __str__(self):
         name = '<binary symbol>' if not self._n_name.strip() else self._n_name
-        return '{' f'n_name: {name}, n_type: {self._n_type}, n_sect: {self._n_sect}, n_desc: {self._n_desc:04x}, n_value: {self._n_value:08x}' '}'
+        return '{' f'n_name: {name}, n_type: {set(self._n_type)}, n_sect: {self._n_sect}, n_desc: {self._n_desc:04x}, n_value: {self._n_value:08x}' '}'
 
 
 class NList(NListCommon):
-    def __init__(self, file, order, stroff):
-        super().__init__(file, order, stroff, 4)
+    __slots__ = ()
+    n = 4
 
 
 class NList64(NListCommon):
-    def __init__(self, file, order, stroff):
-        super().__init__(file, order, stroff, 8)
+    __slots__ = ()
+    n = 8
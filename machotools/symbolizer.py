@@ -0,0 +1,133 @@
+# Copyright (c) 2021 Friedt Professional Engineering Services, Inc
+# SPDX-License-Identifier: MIT
+
+import array
+import bisect
+import collections
+
+from machotools.symbols import np
+
+Resolution = collections.namedtuple(
+    'Resolution', ['address', 'name', 'offset', 'section'])
+
+
+class Symbolizer(object):
+    """Batched address -> symbol+offset resolution
+
+    Symbol start addresses are sorted once into an array; each batch of
+    addresses is then resolved with a vectorized binary search (numpy's
+    searchsorted when available, bisect otherwise).  An address resolves to
+    the closest preceding symbol defined in the same section as the
+    address.  Where several symbols share an address, external symbols
+    are preferred.
+
+    Addresses inside a function (per LC_FUNCTION_STARTS) that starts after
+    the closest preceding symbol, as in stripped binaries, resolve to a
+    sub_<start> name relative to the function start instead.
+    """
+
+    def __init__(self, mf):
+        self._sections = mf.sections()
+        self._section_at = mf.section_at
+        self._functions = mf.function_starts()
+        sects = sorted((s._addr, s._addr + s._size, i + 1)
+                       for i, s in enumerate(self._sections) if s._size)
+        if np is not None:
+            self._load_columns(mf)
+            self._sect_starts = np.array(
+                [s[0] for s in sects], dtype=np.uint64)
+            self._sect_ends = np.array([s[1] for s in sects], dtype=np.uint64)
+            self._sect_numbers = np.array(
+                [s[2] for s in sects], dtype=np.uint8)
+        else:
+            self._load_symbols(mf)
+            self._sect_starts = array.array('Q', [s[0] for s in sects])
+            self._sect_ends = [s[1] for s in sects]
+            self._sect_numbers = [s[2] for s in sects]
+
+    def _load_columns(self, mf):
+        cols = mf.symbol_columns()
+        if cols is None:
+            # no LC_SYMTAB, e.g. a stripped image: only function starts
+            self._starts = np.zeros(0, dtype=np.uint64)
+            self._sects = np.zeros(0, dtype=np.uint8)
+            self._names = []
+            return
+        index = np.flatnonzero(cols.defined() & (cols.n_strx != 0))
+        values = cols.n_value[index].astype(np.uint64)
+        external = cols.external()[index]
+        # sort by address, externals first, and keep one symbol per address
+        order = np.lexsort((~external, values))
+        index, values = index[order], values[order]
+        first = np.ones(len(values), dtype=bool)
+        first[1:] = values[1:] != values[:-1]
+        index = index[first]
+        self._starts = values[first]
+        self._sects = cols.n_sect[index]
+        self._names = cols.names(index)
+
+    def _load_symbols(self, mf):
+        syms = sorted(mf.iter_symbols(filter=lambda sym: sym.is_defined() and sym.name),
+                      key=lambda sym: (sym.n_value, not sym.is_external()))
+        starts = []
+        self._names = []
+        self._sects = []
+        for sym in syms:
+            if starts and starts[-1] == sym.n_value:
+                continue
+            starts.append(sym.n_value)
+            self._names.append(sym.name)
+            self._sects.append(sym.n_sect)
+        self._starts = array.array('Q', starts)
+
+    def _resolve_columns(self, addresses):
+        addrs = np.array(addresses, dtype=np.uint64)
+        i = np.searchsorted(self._starts, addrs, side='right') - 1
+        j = np.searchsorted(self._sect_starts, addrs, side='right') - 1
+        ok = (i >= 0) & (j >= 0)
+        i, j = np.maximum(i, 0), np.maximum(j, 0)
+        ok &= addrs < self._sect_ends[j]
+        ok &= self._sects[i] == self._sect_numbers[j]
+        offsets = (addrs - self._starts[i]).tolist()
+        return zip(ok.tolist(), i.tolist(), offsets)
+
+    def _resolve_symbols(self, addresses):
+        for addr in addresses:
+            i = bisect.bisect_right(self._starts, addr) - 1
+            j = bisect.bisect_right(self._sect_starts, addr) - 1
+            ok = (i >= 0 and j >= 0 and addr < self._sect_ends[j]
+                  and self._sects[i] == self._sect_numbers[j])
+            yield ok, i, addr - self._starts[i] if ok else 0
+
+    def resolve(self, addresses):
+        """Resolve a batch of addresses
+
+        Returns a list with one Resolution per address, or None for
+        addresses outside of any section or without a preceding symbol
+        in that section.
+        """
+        addresses = list(addresses)
+        if not len(self._names) or not len(self._sect_ends):
+            resolutions = [None] * len(addresses)
+        else:
+            if np is not None:
+                found = self._resolve_columns(addresses)
+            else:
+                found = self._resolve_symbols(addresses)
+
+            names = self._names
+            sects = self._sects
+            sections = self._sections
+            resolutions = [Resolution(addr, names[i], offset, sections[sects[i] - 1]) if ok else None
+                           for addr, (ok, i, offset) in zip(addresses, found)]
+
+        if self._functions is not None and len(self._functions):
+            starts = self._functions.find_starts(addresses)
+            for k, (addr, start, res) in enumerate(zip(addresses, starts, resolutions)):
+                if start is not None and (res is None or addr - res.offset < start):
+                    resolutions[k] = Resolution(
+                        addr, f'sub_{start:x}', addr - start, self._section_at(addr))
+        return resolutions
+
+    def __len__(self):
+        return len(self._names)
@@ -0,0 +1,129 @@
+# Copyright (c) 2021 Friedt Professional Engineering Services, Inc
+# SPDX-License-Identifier: MIT
+
+import collections
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from machotools.enums import *
+from machotools.structs import NLIST
+
+_N_STAB = NLTypeMask.N_STAB.value
+_N_TYPE = NLTypeMask.N_TYPE.value
+_N_EXT = NLTypeMask.N_EXT.value
+_N_SECT = NLType.N_SECT.value
+
+_DTYPE_CODES = {'B': 'u1', 'H': 'u2', 'I': 'u4', 'Q': 'u8'}
+_DTYPE_ORDER = {'little': '<', 'big': '>'}
+
+
+class Symbol(collections.namedtuple('Symbol', ['name', 'n_type', 'n_sect', 'n_desc', 'n_value'])):
+    """Lightweight symbol record yielded by MachOFile.iter_symbols()
+
+    n_type is kept as the raw integer from the nlist entry.
+    """
+    __slots__ = ()
+
+    def is_stab(self):
+        return bool(self.n_type & _N_STAB)
+
+    def type(self):
+        """Return the N_TYPE bits, or None for a debugging entry"""
+        if self.is_stab():
+            return None
+        return NLType(self.n_type & _N_TYPE)
+
+    def is_external(self):
+        return self.n_type & (_N_STAB | _N_EXT) == _N_EXT
+
+    def is_undefined(self):
+        return self.n_type & (_N_STAB | _N_TYPE) == NLType.N_UNDF.value
+
+    def is_defined(self):
+        return self.n_type & (_N_STAB | _N_TYPE) == _N_SECT
+
+
+def nlist_dtype(n, order):
+    """Return the NumPy structured dtype of an nlist / nlist_64 record"""
+    fields = []
+    for f in NLIST.fields(n):
+        code = f[1]
+        if code == 'W':
+            code = 'I' if n == 4 else 'Q'
+        fields.append((f[0], _DTYPE_ORDER[order] + _DTYPE_CODES[code]))
+    return np.dtype(fields)
+
+
+class SymbolColumns(object):
+    """Columnar, NumPy-backed view of an LC_SYMTAB symbol table
+
+    The nlist array is decoded with a structured dtype straight from the
+    mapped file, so n_strx, n_type, n_sect, n_desc and n_value are arrays
+    that share memory with the file.  Unlike MachOFile.symtab(), entries
+    are neither copied nor de-duplicated by value.  Filtering is done with
+    the boolean masks below, which can be combined with & | and ~.
+    """
+
+    def __init__(self, data, offset, count, n, order, strings):
+        if np is None:
+            raise ImportError('numpy is required for SymbolColumns')
+        self._set_table(np.frombuffer(
+            data, dtype=nlist_dtype(n, order), count=count, offset=offset), strings)
+
+    def _set_table(self, table, strings):
+        self._table = table
+        self._strings = strings
+        self.n_strx = self._table['n_strx']
+        self.n_type = self._table['n_type']
+        self.n_sect = self._table['n_sect']
+        self.n_desc = self._table['n_desc']
+        self.n_value = self._table['n_value']
+
+    def __len__(self):
+        return len(self._table)
+
+    def slice(self, start, stop):
+        """Return the SymbolColumns of entries [start, stop), sharing memory"""
+        columns = SymbolColumns.__new__(SymbolColumns)
+        columns._set_table(self._table[start:stop], self._strings)
+        return columns
+
+    def stab(self):
+        """Mask of symbolic debugging (STABS) entries"""
+        return (self.n_type & NLTypeMask.N_STAB.value) != 0
+
+    def type_is(self, nltype):
+        """Mask of non-debugging entries whose N_TYPE bits equal nltype"""
+        return ~self.stab() & ((self.n_type & NLTypeMask.N_TYPE.value) == nltype.value)
+
+    def external(self):
+        """Mask of external (global) entries"""
+        return ~self.stab() & ((self.n_type & NLTypeMask.N_EXT.value) != 0)
+
+    def private_external(self):
+        """Mask of private external entries"""
+        return ~self.stab() & ((self.n_type & NLTypeMask.N_PEXT.value) != 0)
+
+    def undefined(self):
+        """Mask of undefined entries"""
+        return self.type_is(NLType.N_UNDF)
+
+    def defined(self):
+        """Mask of entries defined in a section"""
+        return self.type_is(NLType.N_SECT)
+
+    def in_section(self, n_sect):
+        """Mask of entries defined in the (1-based) section number n_sect"""
+        return self.defined() & (self.n_sect == n_sect)
+
+    def name(self, i):
+        return self._strings.get(int(self.n_strx[i]))
+
+    def names(self, mask=None):
+        """Return the names of all entries, or of the entries in mask"""
+        strx = self.n_strx if mask is None else self.n_strx[mask]
+        get = self._strings.get
+        return [get(x) for x in strx.tolist()]
@@ -7,3 +7,47 @@ def align_up(value, align):
         return value
     pad = align - rem
     return value + pad
+
+
+def decode_name(raw):
+    # decode a fixed-size, NUL-padded name (e.g. segname / sectname)
+    return raw.decode('utf-8').replace('\0', '')
+
+
+def read_uleb128(data, offset):
+    """Decode the ULEB128 at offset in data, returning (value, next offset)"""
+    value = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+class FlagTable(object):
+    """Memoized decoding of raw flag words into frozensets of Enum members
+
+    decode(raw) returns the members set in raw.  Each distinct raw value
+    is decoded once and the frozenset shared by every record carrying it,
+    so records only need to store the raw integer.
+    """
+
+    def __init__(self, decode):
+        self._decode = decode
+        self._table = dict()
+
+    def __getitem__(self, raw):
+        flags = self._table.get(raw)
+        if flags is None:
+            flags = frozenset(self._decode(raw))
+            self._table[raw] = flags
+        return flags
+
+
+def bit_flags(enum):
+    """Return a decoder of the single-bit members of enum set in a raw word"""
+    members = tuple((e.value, e) for e in enum)
+    return lambda raw: (e for value, e in members if raw & value)
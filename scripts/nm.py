@@ -4,11 +4,20 @@
 
 import argparse
 import collections
-import magic
+import concurrent.futures
+import functools
+import itertools
+import os
 import re
+import struct
+import sys
 
+from machotools import stats
+from machotools.archive import Archive, is_archive
+from machotools.cache import CACHE_DIR_ENV, open_macho
 from machotools.enums import *
-from machotools.machofile import MachOFile
+from machotools.fat import FatFile, host_arch, is_fat
+from machotools.symbols import np
 
 
 class add_files(argparse.Action):
@@ -60,7 +69,14 @@ def parse_args():
         '-A', dest='A', action="store_true", help='Write the pathname or library name of an object on each line.')
     parser.add_argument(
         '-P', dest='P', action="store_true", help='Write information in a portable output format.')
-    parser.add_argument('-t', dest='t', metavar='format', help='For  the -P output, write the numeric value in the specified format. The format shall be dependent on the single character used as the format option-argument:\nd:\tThe value shall be written in decimal (default).\no:The value shall be written in octal.\nx:\tThe value shall be written in hexadecimal.')
+    parser.add_argument('-t', dest='t', metavar='format', choices=('d', 'o', 'x'), default='d', help='For  the -P output, write the numeric value in the specified format. The format shall be dependent on the single character used as the format option-argument:\nd:\tThe value shall be written in decimal (default).\no:The value shall be written in octal.\nx:\tThe value shall be written in hexadecimal.')
+
+    parser.add_argument('--jobs', dest='jobs', type=int, default=0, metavar='N',
+                        help='Parse input files in N worker processes (default: one per CPU).')
+    parser.add_argument('--cache-dir', dest='cache_dir', default=os.environ.get(CACHE_DIR_ENV),
+                        help=f'cache decoded tables in DIR (default: ${CACHE_DIR_ENV})', metavar='DIR')
+    parser.add_argument('--stats', dest='stats', metavar='FILE',
+                        help='write per-phase parse statistics as JSON to FILE (- for stderr)')
 
     parser.add_argument('file', nargs='*', action=add_files)
 
@@ -72,60 +88,267 @@ def parse_args():
     return args
 
 
-def charcode(sect, sym):
+def charcode(sect, n_type):
     code = '?'
+    stab = n_type & NLTypeMask.N_STAB.value
+    nltype = n_type & NLTypeMask.N_TYPE.value
 
-    if NLType.N_UNDF in sym._n_type:
+    if not stab and nltype == NLType.N_UNDF.value:
         code = 'u'
     elif sect._segname == '__TEXT':
         code = 't'
     elif SectionType.S_ZEROFILL in sect._flags:
         code = 'b'
-    elif NLType.N_ABS in sym._n_type:
+    elif not stab and nltype == NLType.N_ABS.value:
         code = 'a'
     elif sect._segname == '__common':
         code = 'd'
     else:
         code = 'd'
 
-    if NLTypeMask.N_EXT in sym._n_type or NLStab.N_GSYM in sym._n_type:
+    if (not stab and n_type & NLTypeMask.N_EXT.value) or n_type == NLStab.N_GSYM.value:
         code = code.upper()
 
     return code
 
 
-def nm(args, filename):
-    mf = MachOFile(filename)
+def format_symbol(args, sections, name, n_type, n_sect, n_value):
+    if args.j:
+        return name
+    sect = sections[n_sect - 1]
+    code = charcode(sect, n_type)
+    if args.P:
+        if code == 'U':
+            return f'{name} {code}'
+        return f'{name} {code} {n_value:{args.t}} 0'
+    value = ' ' * 16 if code == 'U' else f'{n_value:016x}'
+    return f'{value} {code} {name}'
+
+
+def symbol_ranges(args, mf):
+    """Return the ranges of symbol indexes that -g / -u can match
+
+    With LC_DYSYMTAB only the defined external and undefined groups (or
+    just the undefined group) of the nlist array are scanned.  Otherwise,
+    or if the groups do not cover the table, None stands for the whole
+    table.
+    """
+    lc = mf.dysymtab()
+    symtab = mf.command(LCCommand.LC_SYMTAB)
+    if not (args.g or args.u) or lc is None or symtab is None:
+        return [None]
+    if lc._nlocalsym + lc._nextdefsym + lc._nundefsym != symtab._nsyms:
+        return [None]
+    undef = lc.undef_symbols()
+    if args.u:
+        return [undef]
+    extdef = lc.extdef_symbols()
+    if extdef.stop == undef.start:
+        return [range(extdef.start, undef.stop)]
+    return [extdef, undef]
+
+
+def nm_columns(args, mf):
     sections = mf.sections()
 
-    sorted_syms = sorted(
-        mf.symtab(), key=lambda sym: sym._n_value if args.n else sym._n_name)
-    for sym in sorted_syms:
+    names = []
+    values = []
+    types = []
+    sects = []
+    for symbols in symbol_ranges(args, mf):
+        cols = mf.symbol_columns(symbols)
+        if cols is None:
+            # no LC_SYMTAB
+            break
 
+        mask = np.ones(len(cols), dtype=bool)
         if not args.a:
-            skippable = (NLStab.N_SO, NLStab.N_OSO, NLStab.N_BNSYM)
-            if sym._n_type.intersection(skippable):
-                continue
+            mask &= ~cols.stab()
+        if args.g:
+            mask &= cols.external()
+        if args.u:
+            mask &= cols.undefined()
+        mask &= cols.n_strx != 0
 
-        sect = sections[sym._n_sect - 1]
+        index = np.flatnonzero(mask)
+        names += cols.names(index)
+        values += cols.n_value[index].tolist()
+        types += cols.n_type[index].tolist()
+        sects += cols.n_sect[index].tolist()
 
-        if sym._n_name == '':
-            # i guess these are binary (unnamed) symbols?
-            continue
+    # skip binary (unnamed) symbols
+    order = [i for i in range(len(names)) if names[i] != '']
+    if not args.p:
+        order = sorted(order, key=lambda i: values[i] if args.n else names[i],
+                       reverse=args.r)
+    return [format_symbol(args, sections, names[i], types[i], sects[i], values[i]) for i in order]
+
+
+def nm_symbols(args, mf):
+    sections = mf.sections()
+
+    def wanted(sym):
+        if not args.a and sym.is_stab():
+            return False
+        if args.g and not sym.is_external():
+            return False
+        if args.u and not sym.is_undefined():
+            return False
+        # skip binary (unnamed) symbols
+        return sym.name != ''
 
-        code = charcode(sect, sym)
-        value = ' ' * 16 if code == 'U' else f'{sym._n_value:016x}'
-        print(f'{value} {code} {sym._n_name}')
+    syms = itertools.chain.from_iterable(mf.iter_symbols(filter=wanted, symbols=symbols)
+                                         for symbols in symbol_ranges(args, mf))
+    if not args.p:
+        syms = sorted(
+            syms, key=lambda sym: sym.n_value if args.n else sym.name, reverse=args.r)
+    return [format_symbol(args, sections, sym.name, sym.n_type, sym.n_sect, sym.n_value) for sym in syms]
+
+
+def nm_macho(args, mf):
+    if np is not None:
+        return nm_columns(args, mf)
+    return nm_symbols(args, mf)
+
+
+# One Mach-O image to list: a plain file, a universal slice or an archive
+# member.  name is used in headers and error messages, prefix is prepended
+# to every line (-o, -A) and header requests a "\nname:" line.
+Image = collections.namedtuple(
+    'Image', ['filename', 'offset', 'size', 'name', 'prefix', 'header'])
+
+
+def line_prefix(args, filename, member=None, suffix=''):
+    if args.A:
+        return f'{filename}[{member}]{suffix}: ' if member else f'{filename}{suffix}: '
+    if args.o:
+        return f'{filename}:{member}{suffix}: ' if member else f'{filename}{suffix}: '
+    return ''
+
+
+def archive_images(args, filename, archive, suffix=''):
+    for member in archive.members():
+        yield Image(filename, member._offset, member._size, f'{filename}({member._name}){suffix}',
+                    line_prefix(args, filename, member._name, suffix), True)
+
+
+def fat_images(args, filename):
+    fat = FatFile(filename)
+    if args.arch == 'all':
+        archs = fat.archs()
+    elif args.arch:
+        archs = [arch for arch in fat.archs() if arch.name() == args.arch]
+        if not archs:
+            raise SystemExit(
+                f'nm: file: {filename} does not contain architecture: {args.arch}')
+    else:
+        archs = [arch for arch in fat.archs() if arch.name() == host_arch()]
+        if not archs:
+            archs = fat.archs()
+
+    for arch in archs:
+        suffix = f' (for architecture {arch.name()})' if len(archs) > 1 else ''
+        # slices may themselves be archives (universal static libraries)
+        if is_archive(filename, arch._offset):
+            yield from archive_images(args, filename, Archive(filename, arch._offset, arch._size), suffix)
+        else:
+            yield Image(filename, arch._offset, arch._size, filename + suffix,
+                        line_prefix(args, filename, suffix=suffix), bool(suffix))
+
+
+def images(args, filename):
+    # lib.a(foo.o) names a single archive member
+    m = re.match(r'^(.+)\((.+)\)$', filename)
+    if m and not os.path.exists(filename):
+        member = Archive(m.group(1)).member(m.group(2))
+        if member is None:
+            raise SystemExit(
+                f'nm: no member named {m.group(2)} in {m.group(1)}')
+        yield Image(m.group(1), member._offset, member._size, filename,
+                    line_prefix(args, m.group(1), m.group(2)), False)
+    elif is_fat(filename):
+        yield from fat_images(args, filename)
+    elif is_archive(filename):
+        yield from archive_images(args, filename, Archive(filename))
+    else:
+        yield Image(filename, 0, None, filename, line_prefix(args, filename), False)
+
+
+def nm_image(args, image):
+    """Return the formatted listing of one image, or None if it is not Mach-O
+
+    This runs in a worker process, so the listing is returned as a single
+    string to keep pickling cheap.
+    """
+    try:
+        mf = open_macho(image.filename, args.cache_dir, names=True,
+                        offset=image.offset, size=image.size)
+    except (ValueError, struct.error):
+        return None
+    try:
+        lines = nm_macho(args, mf)
+    except (ValueError, struct.error):
+        # e.g. a truncated image whose tables run past the end of the file
+        return None
+    finally:
+        mf.close()
+
+    if image.prefix:
+        lines = [image.prefix + line for line in lines]
+    text = '\n'.join(lines) + '\n' if lines else ''
+    if image.header:
+        text = f'\n{image.name}:\n' + text
+    return text
+
+
+def nm(args, images, output):
+    worker = functools.partial(nm_image, args)
+    jobs = args.jobs or os.cpu_count() or 1
+    if jobs < 2 or len(images) < 2:
+        return nm_write(images, map(worker, images), output)
+
+    # results are yielded in input order as soon as each one is ready
+    chunksize = max(1, min(64, len(images) // (4 * jobs)))
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        if stats.ACTIVE is None:
+            nm_write(images, pool.map(worker, images, chunksize=chunksize), output)
+            return
+        results = pool.map(functools.partial(stats.collected, worker), images, chunksize=chunksize)
+        nm_write(images, merge_stats(results), output)
+
+
+def merge_stats(results):
+    # merge the statistics of each worker as its listing arrives
+    for text, phases in results:
+        stats.ACTIVE.merge(phases)
+        yield text
+
+
+def nm_write(images, results, output):
+    for image, text in zip(images, results):
+        if text is None:
+            output.flush()
+            print(f'nm: {image.name}: is not an object file', file=sys.stderr)
+            continue
+        output.write(text)
 
 
 def main():
     args = parse_args()
+    if args.stats:
+        stats.enable()
+
+    todo = [image for fn in args.files for image in images(args, fn)]
+    # with several images, each listing is introduced by its name
+    many = len(todo) > 1
+    todo = [image._replace(header=not (args.o or args.A) and (image.header or many))
+            for image in todo]
+
+    with open(sys.stdout.fileno(), 'w', buffering=1 << 20, closefd=False) as output:
+        nm(args, todo, output)
 
-    for fn in args.files:
-        # some inputs may be .a files
-        # some may be lib.a(foo.o) references
-        # need to account for those too
-        nm(args, fn)
+    if args.stats:
+        stats.disable().dump(args.stats)
 
 
 if __name__ == '__main__':
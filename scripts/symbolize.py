@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# Copyright (c) 2021 Friedt Professional Engineering Services, Inc
+# SPDX-License-Identifier: MIT
+
+"""Resolve addresses read from stdin to symbol+offset
+
+Addresses are read one per line (hexadecimal, with or without a leading
+0x) and resolved in batches against the symbol table of the input file.
+Lines that are not an address are copied to the output unchanged.
+"""
+
+import argparse
+import itertools
+import sys
+
+from machotools.machofile import MachOFile
+from machotools.symbolizer import Symbolizer
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--input', dest='input',
+                        help='input file', metavar='FILE', required=True)
+    parser.add_argument('-b', '--batch', dest='batch', type=int, default=65536,
+                        help='number of addresses resolved per batch', metavar='N')
+    args = parser.parse_args()
+
+    return args
+
+
+def format_resolution(line, res):
+    if res is None:
+        return f'{line} ??\n'
+    sect = res.section
+    if sect is None:
+        return f'{line} {res.name}+0x{res.offset:x} (?)\n'
+    return f'{line} {res.name}+0x{res.offset:x} ({sect._segname},{sect._sectname})\n'
+
+
+def parse_address(line):
+    try:
+        return int(line, 16)
+    except ValueError:
+        return None
+
+
+def symbolize(symbolizer, input, output, batch):
+    lines = (line.strip() for line in input)
+    lines = (line for line in lines if line)
+    while True:
+        chunk = list(itertools.islice(lines, batch))
+        if not chunk:
+            break
+        addresses = [parse_address(line) for line in chunk]
+        resolved = iter(symbolizer.resolve(
+            addr for addr in addresses if addr is not None))
+        # lines that are not an address are copied through unchanged;
+        # one write per batch rather than one per line
+        output.write(''.join(f'{line}\n' if addr is None else format_resolution(line, next(resolved))
+                             for line, addr in zip(chunk, addresses)))
+
+
+def main():
+    args = parse_args()
+
+    mf = MachOFile(args.input)
+    symbolizer = Symbolizer(mf)
+
+    symbolize(symbolizer, sys.stdin, sys.stdout, args.batch)
+
+
+if __name__ == '__main__':
+    main()
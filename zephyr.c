@@ -101,6 +101,33 @@ int k_thread_join(struct k_thread *thread, k_timeout_t timeout)
     return 0;
 }
 
+#if defined(__APPLE__) && defined(__MACH__)
+
+/*
+ * gen_map.py lays native tasks out sorted by level and priority, with level l
+ * spanning [_native_task_level_index[l], _native_task_level_index[l + 1])
+ */
+extern const size_t _native_task_level_count;
+extern const size_t _native_task_level_index[];
+
+static void run_native_tasks(int level)
+{
+    extern struct native_task _native_task_list_start[];
+
+    if (level < 0 || (size_t)level >= _native_task_level_count)
+    {
+        return;
+    }
+
+    for (struct native_task *it = &_native_task_list_start[_native_task_level_index[level]];
+         it < &_native_task_list_start[_native_task_level_index[level + 1]]; ++it)
+    {
+        it->task_function();
+    }
+}
+
+#else
+
 static void run_native_tasks(int level)
 {
     STRUCT_SECTION_FOREACH(native_task, it)
@@ -138,17 +165,21 @@ static int compare_native_tasks(const void *a, const void *b)
     return 0;
 }
 
+#endif
+
 static void premain(void)
 {
 
     /* for macOS / native_posix_64 */
     macho_map();
 
+#if !(defined(__APPLE__) && defined(__MACH__))
     /* declare compatible _start[] and _end[] */
     STRUCT_SECTION_FOREACH(native_task, it);
 
     qsort(_native_task_list_start, (_native_task_list_end - _native_task_list_start),
           sizeof(struct native_task), compare_native_tasks);
+#endif
 
     run_native_tasks(_NATIVE_PRE_BOOT_1_LEVEL);
     // native_handle_cmd_line(argc, argv);